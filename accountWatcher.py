@@ -0,0 +1,326 @@
+# Copyright 2012 Abid Hasan Mujtaba
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Author: Abid H. Mujtaba
+# Email: abid.naqvi83@gmail.com
+#
+# This file implements the watch mode of fetchheaders (fetchheaders.py --watch). Each account is polled once and then watched over its own connection using IMAP IDLE: the server pushes a notification whenever an email arrives, is expunged or has its flags changed, and only the emails affected are fetched. After every change an updated Output object for the account is handed to the display.
+#
+# The IMAP NOTIFY extension (RFC 5465) is not used. It extends IDLE to report changes in folders other than the selected one, but only a single folder of each account is watched: the first of the account's folders.
+
+
+import re
+import threading
+
+
+reEvent = re.compile( '([0-9]+) ([A-Za-z]+)(?: (.*))?$' )		# An untagged response such as '12 EXISTS' or '5 FETCH (FLAGS (\\Seen))'
+reFlags = re.compile( '.*FLAGS \\(([^\\)]*)\\)' )
+
+
+class accountWatcher( threading.Thread ) :
+
+    '''
+    A thread which polls a single account and then watches it for changes, putting a new Output object in 'outQueue' every time the displayed information changes. If the connection is lost it is re-established (and the account polled afresh) after settings[ 'pollInterval' ] seconds.
+    '''
+
+    def __init__( self, account, settings, outQueue ) :
+
+        '''
+        account: <DIC> The settings associated with the account. Only the first of its folders is watched (see miscClasses.accountFolders()).
+
+        settings: <DIC> The global settings. 'idleTimeout' is the number of seconds after which IDLE is restarted (servers drop connections that have been idling for more than 30 minutes) and 'pollInterval' is the number of seconds between checks on servers that don't support IDLE.
+        '''
+
+        from miscClasses import accountFolders
+
+        self.account = accountFolders( account )[0]
+        self.settings = settings
+        self.outQueue = outQueue
+
+        self.seq = []		# The UIDs (integers) of ALL emails in the folder in sequence number order. None for an email that has been announced (EXISTS) but whose UID is not yet known.
+
+        super( accountWatcher, self ).__init__()
+
+        self.daemon = True
+
+
+    def run( self ) :
+
+        import time
+
+        while True :
+
+            self.watch()		# Only returns when the connection has been lost
+
+            time.sleep( self.settings[ 'pollInterval' ] )
+
+
+    def watch( self ) :
+
+        '''
+        Connects to the account, polls it and then waits for (and applies) changes until the connection fails.
+        '''
+
+        from imapServer import imapServer
+        from asyncImapServer import runSync
+        from miscClasses import Output, _pollFolder
+
+        account = self.account
+
+        mail = imapServer( account['host'], account['useSSL'], account.get( 'connectTimeout' ), account.get( 'readTimeout' ) )
+
+        if not mail.login( account['username'], account['password'] ) :
+
+            out = Output( account )
+
+            out.error = True
+            out.reason = 'Unable to login. Retrying in ' + str( self.settings[ 'pollInterval' ] ) + ' seconds'
+
+            self.report( out )
+
+            return
+
+
+        out = runSync( _pollFolder( account, mail ) )
+
+        self.report( out )
+
+        uids = mail.getUids( 'all' )
+
+        if out.error or uids is None :
+
+            return
+
+        self.seq = sorted( [ int( uid ) for uid in uids ] )
+
+
+        if 'IDLE' in mail.capabilities :
+
+            timeout = self.settings[ 'idleTimeout' ]
+
+        else :
+
+            timeout = self.settings[ 'pollInterval' ]
+
+
+        while True :
+
+            events = mail.idle( timeout )
+
+            if events is None :
+
+                return
+
+            if events and self.update( mail, out, events ) :
+
+                self.report( out )
+
+
+    def update( self, mail, out, events ) :
+
+        '''
+        Applies the changes reported by the server (see imapServer.idle()) to the Output object 'out', fetching the headers of new emails. Returns True if the displayed information has changed.
+        '''
+
+        from miscClasses import newEmail, convertDates, searchFilter
+        from array import array
+
+        account = self.account
+
+        expunged = set()
+        flags = {}		# New flags of emails keyed by uid
+
+        for event in events :
+
+            m = reEvent.match( event )
+
+            if not m :
+
+                continue
+
+            num = int( m.group(1) )
+            typ = m.group(2).upper()
+
+            if typ == 'EXPUNGE' and num <= len( self.seq ) :		# Sequence numbers of the subsequent emails are decremented, which popping from the list does for us
+
+                uid = self.seq.pop( num - 1 )
+
+                if uid is not None :
+
+                    expunged.add( str( uid ) )
+
+            elif typ == 'EXISTS' :
+
+                while len( self.seq ) < num :
+
+                    self.seq.append( None )
+
+            elif typ == 'FETCH' and num <= len( self.seq ) and self.seq[ num - 1 ] is not None :
+
+                f = reFlags.match( m.group(3) or '' )
+
+                if f :
+
+                    flags[ str( self.seq[ num - 1 ] ) ] = f.group(1)
+
+
+        newIds = []
+
+        if None in self.seq :		# The UIDs of new emails are those above the highest UID we know of
+
+            known = [ x for x in self.seq if x is not None ]
+
+            top = max( known or [ 0 ] )
+
+            ids = mail.getUids( '(UID ' + str( top + 1 ) + ':*)' )
+
+            if ids is None :
+
+                return False
+
+            newIds = [ x for x in ids if int( x ) > top ]		# 'n:*' always includes the last email even if its UID is less than n
+
+            self.seq = known + sorted( [ int( x ) for x in newIds ] )
+
+
+        if not ( expunged or flags or newIds ) :
+
+            return False
+
+
+        displayed = set( str( uid ) for uid in out.uids )
+
+        emails = [ e for e in out.emails if not e.uid in expunged ]
+
+        for email in emails :
+
+            if email.uid in flags :
+
+                email.Seen = '\\Seen' in flags[ email.uid ]
+
+        if account[ 'showUnseen' ] :
+
+            emails = [ e for e in emails if not e.Seen ]
+
+            newIds += [ x for x in flags if not '\\Seen' in flags[ x ] and not x in displayed ]		# Emails marked unseen again must now be displayed
+
+
+        filters = searchFilter( account )
+
+        if newIds and filters :		# Only the new emails that match the filters of the account are displayed
+
+            from imapServer import _uidSets
+
+            matching = set()
+
+            for uidSet in _uidSets( newIds ) :
+
+                ids = mail.getUids( '(UID ' + uidSet + ' ' + filters + ')' )
+
+                if ids is None :
+
+                    return False
+
+                matching.update( ids )
+
+            newIds = [ x for x in newIds if x in matching ]
+
+
+        if newIds and not account[ 'showOnlyNums' ] :
+
+            data = mail.fetchHeaders( newIds, ['from', 'subject', 'date'] )
+
+            if data is None :
+
+                return False
+
+            newIds = [ x for x in newIds if x in data ]
+
+            dates = convertDates( [ data[ x ][ 'date' ] for x in newIds ] )
+
+            for uid, date in zip( newIds, dates ) :
+
+                email = newEmail( uid, data[ uid ], date )
+
+                if not ( account[ 'showUnseen' ] and email.Seen ) :
+
+                    emails.append( email )
+
+
+        emails.sort( key = lambda email : int( email.uid ), reverse = account[ 'latestEmailFirst' ] )
+
+        out.emails = emails
+        out.uids = array( 'I', [ int( e.uid ) for e in emails ] )
+
+        if len( emails ) > 100 :
+
+            out.numDigits = len( str( len( emails ) ) )
+
+        else :
+
+            out.numDigits = 2
+
+
+        if account[ 'showNums' ] :
+
+            nums = mail.numMsgs()
+
+            if nums :
+
+                out.numAll, out.numUnseen = nums
+
+        return True
+
+
+    def report( self, out ) :
+
+        '''
+        Hands a copy of the Output object to the display. The copy (of the object and its lists) ensures that the display never sees a list that is being modified by this thread.
+        '''
+
+        from copy import copy
+        from array import array
+
+        snapshot = copy( out )
+
+        snapshot.emails = list( out.emails )
+        snapshot.uids = array( 'I', out.uids )
+
+        self.outQueue.put( snapshot )
+
+
+
+def watchAccounts( servers, settings ) :
+
+    '''
+    Starts an accountWatcher for every account in 'servers'. A generator which never ends: it yields the initial Output object of each account as it is polled and then an updated one whenever the account changes.
+    '''
+
+    from Queue import Queue, Empty
+
+    outQueue = Queue()
+
+    for account in servers :
+
+        accountWatcher( servers[ account ], settings, outQueue ).start()
+
+    while True :
+
+        try :
+            yield outQueue.get( True, 1 )		# The timeout allows Ctrl-C to interrupt the wait
+
+        except Empty :
+
+            pass
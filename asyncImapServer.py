@@ -0,0 +1,1250 @@
+# Copyright 2012 Abid Hasan Mujtaba
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Author: Abid H. Mujtaba
+# Email: abid.naqvi83@gmail.com
+#
+# This file implements an asynchronous counterpart to the imapServer class. Instead of blocking a whole thread on every command (as imaplib does) each account is polled by a coroutine and all of the coroutines share a single thread and a single select() based event loop. This allows a very large number of accounts to be polled concurrently without a thread (and its stack) per account.
+#
+# Coroutines are implemented using python generators. A coroutine yields:
+#
+#   - Another coroutine (generator). It is run to completion and the value it returns is sent back in to the yielding coroutine.
+#   - A _Wait object. The coroutine is suspended until the associated socket is ready for reading/writing.
+#   - Any other value. It is sent straight back. This means that methods which don't need to communicate with the server can be yielded exactly like ones that do.
+#
+# Since python 2 generators can't return values a coroutine returns a value by raising Return( value ).
+
+
+import re
+import select
+import socket
+import sys
+import time
+import types
+
+from pollStats import timed
+
+
+class Return( Exception ) :
+
+    '''
+    Raised inside a coroutine to return a value to the coroutine (or event loop) that is running it.
+    '''
+
+    def __init__( self, value = None ) :
+
+        Exception.__init__( self )
+
+        self.value = value
+
+
+
+class _Wait :
+
+    '''
+    Yielded by a coroutine when it needs to wait for a socket to become readable ('r') or writable ('w'). If the socket doesn't become ready within 'timeout' seconds (None means wait forever) the event loop throws socket.timeout in to the coroutine, exactly as a blocking socket with a timeout would raise it.
+    '''
+
+    def __init__( self, sock, mode, timeout = None ) :
+
+        self.sock = sock
+        self.mode = mode
+        self.timeout = timeout
+
+        self.deadline = None		# Set by the event loop when the task is suspended
+
+
+
+def runSync( coroutine ) :
+
+    '''
+    Drives a coroutine synchronously (without an event loop) and returns the value it returns. Every value yielded by the coroutine is sent straight back to it, except for nested coroutines which are run (recursively) with their result, or exception, passed back. This is how a coroutine that is written against the blocking imapServer (whose methods return their results directly) is executed.
+    '''
+
+    value = None
+    excInfo = None
+
+    try :
+        while True :
+
+            if excInfo :
+
+                yielded = coroutine.throw( *excInfo )
+
+                excInfo = None
+
+            else :
+
+                yielded = coroutine.send( value )
+
+            value = yielded
+
+            if isinstance( yielded, types.GeneratorType ) :
+
+                try :
+                    value = runSync( yielded )
+
+                except Exception :
+
+                    excInfo = sys.exc_info()
+
+    except Return, r :
+
+        return r.value
+
+    except StopIteration :
+
+        return None
+
+
+
+class _Task :
+
+    '''
+    Struct like object holding the state of a single coroutine (and the coroutines it has called) being run by the eventLoop.
+    '''
+
+    def __init__( self, coroutine, data ) :
+
+        self.stack = [ coroutine ]		# The coroutine at the top of the stack is the one currently being executed
+        self.data = data			# Arbitrary data associated with the task by the caller of eventLoop.spawn()
+
+        self.value = None		# The value to be sent in to the coroutine when it is next resumed
+        self.excInfo = None		# The exception to be thrown in to the coroutine when it is next resumed
+
+        self.wait = None		# The _Wait object the task is suspended on
+
+        self.result = None		# The value returned by the task once it is complete
+        self.error = None		# The exception (if any) raised by the task
+
+
+
+class eventLoop :
+
+    '''
+    A select() based event loop that runs a number of coroutines concurrently in a single thread.
+    '''
+
+    def __init__( self ) :
+
+        self.tasks = []		# Tasks that have not yet completed
+
+
+    def spawn( self, coroutine, data = None ) :
+
+        '''
+        Adds a coroutine to the loop. 'data' is stored with the task and can be used to identify it once it completes. The coroutine is run until it first needs to wait for a socket.
+        '''
+
+        task = _Task( coroutine, data )
+
+        self.tasks.append( task )
+
+        return task
+
+
+    def step( self, timeout = None ) :
+
+        '''
+        Advances every task that is able to make progress (waiting at most 'timeout' seconds for a socket to become ready) and returns the list of tasks that have completed.
+        '''
+
+        finished = []
+
+        for task in [ x for x in self.tasks if x.stack and x.wait is None ] :		# Newly spawned tasks
+
+            self._advance( task )
+
+        readers = [ task.wait.sock for task in self.tasks if task.wait and task.wait.mode == 'r' ]
+        writers = [ task.wait.sock for task in self.tasks if task.wait and task.wait.mode == 'w' ]
+
+        deadlines = [ task.wait.deadline for task in self.tasks if task.wait and task.wait.deadline ]
+
+        if deadlines :		# Don't sleep past the moment the first wait times out
+
+            untilDeadline = max( 0, min( deadlines ) - time.time() )
+
+            if timeout is None or untilDeadline < timeout :
+
+                timeout = untilDeadline
+
+        if readers or writers :
+
+            readable, writable, exceptional = select.select( readers, writers, [], timeout )
+
+            now = time.time()
+
+            for task in list( self.tasks ) :
+
+                if task.wait and ( task.wait.sock in readable or task.wait.sock in writable ) :
+
+                    task.wait = None
+
+                    self._advance( task )
+
+                elif task.wait and task.wait.deadline and task.wait.deadline <= now :
+
+                    task.wait = None
+                    task.excInfo = ( socket.timeout, socket.timeout( 'timed out' ), None )
+
+                    self._advance( task )
+
+        for task in list( self.tasks ) :
+
+            if not task.stack :		# Task has completed
+
+                self.tasks.remove( task )
+
+                finished.append( task )
+
+        return finished
+
+
+    def cancel( self, task ) :
+
+        '''
+        Stops a task that has not completed and removes it from the loop. The coroutines of the task are closed (GeneratorExit is raised at the point where each one is suspended) and the socket it was waiting on is closed.
+        '''
+
+        if task.wait :
+
+            try :
+                task.wait.sock.close()
+
+            except socket.error :
+                pass
+
+        while task.stack :
+
+            task.stack.pop().close()
+
+        task.wait = None
+
+        if task in self.tasks :
+
+            self.tasks.remove( task )
+
+
+    def _advance( self, task ) :
+
+        '''
+        Runs the task until it needs to wait for a socket or completes.
+        '''
+
+        while task.stack :
+
+            coroutine = task.stack[-1]
+
+            try :
+                if task.excInfo :
+
+                    excInfo, task.excInfo = task.excInfo, None
+
+                    yielded = coroutine.throw( *excInfo )
+
+                else :
+
+                    value, task.value = task.value, None
+
+                    yielded = coroutine.send( value )
+
+            except Return, r :		# The coroutine has returned a value which is passed on to its caller
+
+                task.stack.pop()
+                task.value = r.value
+
+                continue
+
+            except StopIteration :
+
+                task.stack.pop()
+
+                continue
+
+            except Exception :		# The exception is propagated to the calling coroutine
+
+                task.stack.pop()
+                task.excInfo = sys.exc_info()
+
+                continue
+
+
+            if isinstance( yielded, types.GeneratorType ) :		# A nested coroutine is to be run
+
+                task.stack.append( yielded )
+
+            elif isinstance( yielded, _Wait ) :
+
+                task.wait = yielded
+
+                if yielded.timeout :
+
+                    yielded.deadline = time.time() + yielded.timeout
+
+                return
+
+            else :		# A plain value is sent straight back
+
+                task.value = yielded
+
+
+        # The stack is empty so the task has completed.
+
+        task.result = task.value
+
+        if task.excInfo :
+
+            task.error = task.excInfo[1]
+
+
+
+def _resolve( host, port, timeout = None ) :
+
+    '''
+    Coroutine that returns the addresses of 'host' (as returned by socket.getaddrinfo()) without blocking the event loop. A lookup can take seconds when the resolver is slow and has no timeout of its own, so unless 'host' is a numeric address it is made by a thread which signals its completion through a socket pair. socket.timeout is raised if the lookup takes longer than 'timeout' seconds, in which case the thread is abandoned.
+    '''
+
+    import threading
+
+    try :
+        raise Return( socket.getaddrinfo( host, port, 0, socket.SOCK_STREAM, 0, socket.AI_NUMERICHOST ) )
+
+    except socket.gaierror :		# Not a numeric address
+
+        pass
+
+    result = []
+    receiver, sender = socket.socketpair()
+
+    def lookup() :
+
+        try :
+            result.append( socket.getaddrinfo( host, port, 0, socket.SOCK_STREAM ) )
+
+        except Exception, e :
+
+            result.append( e )
+
+        try :
+            sender.send( '.' )
+
+        except socket.error :		# The coroutine has timed out (or been cancelled) and closed the receiver
+
+            pass
+
+        finally :
+            sender.close()
+
+    thread = threading.Thread( target = lookup )
+    thread.daemon = True		# An abandoned lookup must not prevent the program from exiting
+    thread.start()
+
+    try :
+        yield _Wait( receiver, 'r', timeout )
+
+        thread.join()		# Only ever waits under runSync(), which sends the _Wait straight back
+
+    finally :
+        receiver.close()
+
+    if isinstance( result[0], Exception ) :
+
+        raise result[0]
+
+    raise Return( result[0] )
+
+
+
+class _Connection :
+
+    '''
+    Implements a non-blocking connection to an IMAP server along with the reading and writing of IMAP commands and responses as coroutines. The responses are parsed in to the same structures that imaplib produces so that the parsing functions in the imapServer module can be reused.
+    '''
+
+    reLiteral = re.compile( '.*\\{([0-9]+)\\}$' )		# A line ending in {size} is followed by a literal of 'size' bytes
+    reUntagged = re.compile( '\\* (?:([0-9]+) )?([A-Z-]+)(?: (.*))?$' )
+    reCode = re.compile( '\\[([A-Z-]+)(?: ([^\\]]*))?\\]' )		# Bracketed response codes such as [UIDVALIDITY 3857529045]
+    mustQuote = re.compile( '[^\\w!#$%&\'*+,.:;<=>?^`|~-]' )
+
+
+    def __init__( self, server, use_ssl = True, connectTimeout = None, readTimeout = None, stats = None ) :
+
+        self.server = server
+        self.use_ssl = use_ssl
+        self.stats = stats		# pollStats object in which the traffic with the server is counted (None means it isn't)
+
+        self.connectTimeout = connectTimeout		# Seconds to wait for the connection to be established (None means forever)
+        self.readTimeout = readTimeout			# Seconds to wait for the server every time data is read or written
+
+        self.sock = None
+        self.buffer = ''		# Data received from the server but not yet consumed
+        self.tagNum = 0
+
+
+    def connect( self ) :
+
+        '''
+        Coroutine that establishes the (SSL) connection with the server and reads the greeting. Returns the untagged responses of the greeting.
+        '''
+
+        import errno, ssl
+
+        from imapServer import _hostPort
+
+        host, port = _hostPort( self.server, self.use_ssl and 993 or 143 )		# Same default ports used by imaplib.IMAP4_SSL and imaplib.IMAP4
+
+        addresses = yield _resolve( host, port, self.connectTimeout )
+
+        for family, socktype, proto, canonname, address in addresses :		# Every address of the host is tried in turn (IPv6 and IPv4 alike) until one accepts the connection, as socket.create_connection() does
+
+            self.sock = socket.socket( family, socktype, proto )
+            self.sock.setblocking( 0 )
+
+            try :
+                err = self.sock.connect_ex( address )
+
+                if err in ( errno.EINPROGRESS, errno.EWOULDBLOCK ) :
+
+                    yield _Wait( self.sock, 'w', self.connectTimeout )		# The socket becomes writable once the connection has been established (or has failed)
+
+                    err = self.sock.getsockopt( socket.SOL_SOCKET, socket.SO_ERROR )
+
+                if not err :
+
+                    break
+
+                error = socket.error( err, 'Unable to connect to ' + self.server )
+
+            except socket.timeout, error :
+
+                pass
+
+            self.sock.close()
+
+        else :
+            raise error		# The error of the last address tried
+
+        if self.use_ssl :
+
+            start = time.time()
+
+            self.sock = ssl.wrap_socket( self.sock, do_handshake_on_connect = False )
+
+            while True :
+
+                try :
+                    self.sock.do_handshake()
+                    break
+
+                except ssl.SSLWantReadError :
+
+                    yield _Wait( self.sock, 'r', self.readTimeout )
+
+                except ssl.SSLWantWriteError :
+
+                    yield _Wait( self.sock, 'w', self.readTimeout )
+
+            if self.stats is not None :
+
+                self.stats.add( 'tls', time.time() - start )		# Part of 'connect' (see pollStats)
+
+        untagged = {}
+
+        line = yield self._readLine()
+
+        typ, data = self._parseUntagged( line[2:] )		# The greeting is an untagged OK (or PREAUTH) response
+
+        self._parseCode( typ, data, untagged )
+
+        raise Return( untagged )
+
+
+    def command( self, name, *args ) :
+
+        '''
+        Coroutine that sends a single command to the server and reads the response. The arguments are quoted where required (as imaplib does).
+
+        Returns the tuple (typ, untagged, text) where 'typ' is the result of the command ('OK', 'NO' or 'BAD'), 'untagged' is a dictionary mapping the type of every untagged response (and bracketed response code) to a list of its data and 'text' is the remainder of the tagged response line.
+        '''
+
+        results = yield self.pipeline( [ ( name, ) + args ] )
+
+        raise Return( results[0] )
+
+
+    def pipeline( self, commands ) :
+
+        '''
+        Coroutine that sends the commands in the list 'commands' (tuples of the command name followed by its arguments) back to back and then reads their responses, so that all of them cost a single round trip (see imapServer._pipeline()). The untagged responses received before the tagged response of a command are attributed to that command.
+
+        Returns a list with the tuple (typ, untagged, text) of each command (see .command()).
+        '''
+
+        tags = []
+        lines = []
+
+        for command in commands :
+
+            self.tagNum += 1
+
+            tags.append( 'A%04d' % self.tagNum )
+
+            lines.append( ' '.join( [ tags[-1], command[0] ] + [ self._quote( x ) for x in command[1:] ] ) + '\r\n' )
+
+        try :
+            yield self._write( ''.join( lines ) )
+
+            results = []
+
+            for tag in tags :
+
+                untagged = {}
+
+                while True :
+
+                    line = yield self._readLine()
+
+                    if line.startswith( tag + ' ' ) :		# The tagged response marks the completion of the command
+
+                        typ, sp, text = line[ len( tag ) + 1 : ].partition( ' ' )
+
+                        self._parseCode( typ, text, untagged )
+
+                        results.append( ( typ, untagged, text ) )
+
+                        break
+
+                    if line.startswith( '* ' ) :
+
+                        typ, data = self._parseUntagged( line[2:] )
+
+                        if typ is None :		# Malformed response. Ignored.
+
+                            continue
+
+                        m = self.reLiteral.match( data )
+
+                        while m :		# The response contains a literal. We store it as a (prefix, literal) tuple followed by the remainder of the line, exactly like imaplib.
+
+                            literal = yield self._read( int( m.group(1) ) )
+
+                            untagged.setdefault( typ, [] ).append( ( data, literal ) )
+
+                            data = yield self._readLine()
+
+                            m = self.reLiteral.match( data )
+
+                        untagged.setdefault( typ, [] ).append( data )
+
+                        self._parseCode( typ, data, untagged )
+
+            raise Return( results )
+
+        except socket.timeout :		# The server didn't respond in time. The rest of its response (should it ever arrive) can't be matched to a command so the connection is closed and every subsequent command fails immediately, just as imaplib does once a read has timed out.
+
+            self.close()
+
+            raise
+
+
+    def uidCommand( self, name, lstUIDs, *args ) :
+
+        '''
+        Coroutine that sends the UID command 'name' (e.g. 'UID FETCH') for the emails in the list 'lstUIDs'. The UIDs are sent as compact sets (see _uidSets() in imapServer), one command per set, and the untagged responses of all the commands are merged so the result is the same as that of a single .command(). 'typ' is 'OK' only if every command succeeded.
+
+        The commands are pipelined, at most 4 at a time (see imapServer._uidCommand()).
+        '''
+
+        from imapServer import _uidSets
+
+        result, untagged, status = 'OK', {}, ''
+
+        uidSets = _uidSets( lstUIDs )
+
+        for ii in range( 0, len( uidSets ), 4 ) :
+
+            results = yield self.pipeline( [ ( name, uidSet ) + args for uidSet in uidSets[ ii : ii + 4 ] ] )
+
+            for typ, responses, text in results :
+
+                for key in responses :
+
+                    untagged.setdefault( key, [] ).extend( responses[ key ] )
+
+                if typ != 'OK' or not status :
+
+                    result, status = typ, text
+
+        raise Return( ( result, untagged, status ) )
+
+
+    def close( self ) :
+
+        try :
+            self.sock.close()
+
+        except :
+            pass
+
+
+    def _parseUntagged( self, line ) :
+
+        '''
+        Splits an untagged response line (without the leading '* ') in to its type and data. As with imaplib a leading message number (e.g. '12 FETCH (...)') is kept at the start of the data. Returns (None, None) if the line is malformed.
+        '''
+
+        m = self.reUntagged.match( '* ' + line )
+
+        if not m :
+
+            return ( None, None )
+
+        number, typ, data = m.groups()
+
+        data = data or ''
+
+        if number :
+
+            data = number + ( data and ' ' + data )
+
+        return ( typ, data )
+
+
+    def _parseCode( self, typ, text, untagged ) :
+
+        '''
+        Stores the bracketed response code (if any) of an OK/NO/BAD response in 'untagged'.
+        '''
+
+        if typ in ( 'OK', 'NO', 'BAD', 'PREAUTH' ) and text :
+
+            m = self.reCode.match( text )
+
+            if m :
+                untagged.setdefault( m.group(1), [] ).append( m.group(2) )
+
+
+    def _quote( self, arg ) :
+
+        if len( arg ) >= 2 and ( arg[0], arg[-1] ) in ( ( '(', ')' ), ( '"', '"' ) ) or arg and self.mustQuote.search( arg ) is None :		# Same rules as imaplib
+
+            return arg
+
+        return '"' + arg.replace( '\\', '\\\\' ).replace( '"', '\\"' ) + '"'
+
+
+    def _readLine( self ) :
+
+        '''
+        Coroutine that returns the next line (without the trailing CRLF) sent by the server.
+        '''
+
+        while True :
+
+            pos = self.buffer.find( '\r\n' )
+
+            if pos >= 0 :
+
+                line, self.buffer = self.buffer[ : pos ], self.buffer[ pos + 2 : ]
+
+                raise Return( line )
+
+            yield self._fill()
+
+
+    def _read( self, size ) :
+
+        '''
+        Coroutine that returns the next 'size' bytes sent by the server.
+        '''
+
+        while len( self.buffer ) < size :
+
+            yield self._fill()
+
+        data, self.buffer = self.buffer[ : size ], self.buffer[ size : ]
+
+        raise Return( data )
+
+
+    def _fill( self ) :
+
+        '''
+        Coroutine that waits for data from the server and appends it to the buffer.
+        '''
+
+        import errno, ssl
+
+        while True :
+
+            try :
+                data = self.sock.recv( 65536 )
+
+            except ssl.SSLWantReadError :
+
+                yield _Wait( self.sock, 'r', self.readTimeout )
+
+                continue
+
+            except socket.error, e :
+
+                if e.args[0] not in ( errno.EAGAIN, errno.EWOULDBLOCK ) :
+
+                    raise
+
+                yield _Wait( self.sock, 'r', self.readTimeout )
+
+                continue
+
+            if not data :
+
+                raise socket.error( 'Connection closed by IMAP server ' + self.server )
+
+            if self.stats is not None :
+
+                self.stats.received( len( data ) )
+
+            self.buffer += data
+
+            return
+
+
+    def _write( self, data ) :
+
+        '''
+        Coroutine that sends all of 'data' to the server.
+        '''
+
+        import errno, ssl
+
+        while data :
+
+            try :
+                sent = self.sock.send( data )
+
+            except ssl.SSLWantWriteError :
+
+                yield _Wait( self.sock, 'w', self.readTimeout )
+
+                continue
+
+            except socket.error, e :
+
+                if e.args[0] not in ( errno.EAGAIN, errno.EWOULDBLOCK ) :
+
+                    raise
+
+                yield _Wait( self.sock, 'w', self.readTimeout )
+
+                continue
+
+            if self.stats is not None :
+
+                self.stats.sent( sent )
+
+            data = data[ sent : ]
+
+
+
+class asyncImapServer :
+
+    '''
+    The asynchronous counterpart of the imapServer class. It exposes the same methods but each one is a coroutine that must be yielded from within a coroutine run by an eventLoop. The arguments and results of the methods are identical to those of imapServer so code written as a coroutine can be run against either class (see runSync()).
+
+    Unlike imapServer the connection is not established by the constructor. The .connect() coroutine must be yielded first.
+    '''
+
+    def __init__( self, server, use_ssl = True, connectTimeout = None, readTimeout = None, stats = None ) :
+
+        self.server = server
+
+        self.stats = stats
+
+        self.conn = _Connection( server, use_ssl, connectTimeout, readTimeout, stats )
+
+        self.capabilities = []
+        self.condstore = False
+        self.qresync = False
+
+        self.folder = 'INBOX'
+        self.responses = {}		# Untagged responses to the last SELECT/EXAMINE command
+
+
+    @timed
+    def connect( self ) :
+
+        try :
+            untagged = yield self.conn.connect()
+
+            if untagged.get( 'CAPABILITY' ) :		# Most servers advertise their capabilities in the greeting
+
+                self.capabilities = untagged[ 'CAPABILITY' ][0].upper().split()
+
+            else :
+
+                typ, untagged, text = yield self.conn.command( 'CAPABILITY' )
+
+                self.capabilities = ' '.join( untagged.get( 'CAPABILITY', [] ) ).upper().split()
+
+        except Exception :		# Never a bare except in a coroutine: GeneratorExit must be allowed through when the task is cancelled (see eventLoop.cancel())
+            print( 'Unable to establish SSL connection to IMAP server ' + self.server )
+
+
+    @timed
+    def login( self, username, password ) :
+
+        self.username = username
+        self.password = password
+
+        try :
+            typ, untagged, text = yield self.conn.command( 'LOGIN', username, '"' + password.replace( '\\', '\\\\' ).replace( '"', '\\"' ) + '"' )		# The password is always quoted (as imaplib does)
+
+            if typ != 'OK' :
+
+                raise Exception( text )
+
+        except Exception :
+            print( 'Credentials (username and password) rejected by IMAP server (or connection lost).' )
+
+            raise Return( False )
+
+        else :
+            if untagged.get( 'CAPABILITY' ) :
+
+                self.capabilities = untagged[ 'CAPABILITY' ][0].upper().split()
+
+            raise Return( True )
+
+
+    @timed
+    def enableCondstore( self ) :
+
+        if not 'ENABLE' in self.capabilities :
+
+            raise Return( False )
+
+        if 'QRESYNC' in self.capabilities :
+
+            extension = 'QRESYNC'
+
+        elif 'CONDSTORE' in self.capabilities :
+
+            extension = 'CONDSTORE'
+
+        else :
+            raise Return( False )
+
+        enabled = []
+
+        try :
+            typ, untagged, text = yield self.conn.command( 'ENABLE', extension )
+
+            enabled = ' '.join( [ x for x in untagged.get( 'ENABLED', [] ) if x ] ).upper().split()
+
+        except Exception :
+            print( 'Unable to enable ' + extension + ' on IMAP server ' + self.server )
+
+        self.qresync = 'QRESYNC' in enabled
+        self.condstore = self.qresync or 'CONDSTORE' in enabled
+
+        raise Return( self.condstore )
+
+
+    @timed
+    def noop( self ) :
+
+        try :
+            typ, untagged, text = yield self.conn.command( 'NOOP' )
+
+        except Exception :
+            raise Return( False )
+
+        raise Return( typ == 'OK' )
+
+
+    @timed
+    def logout( self ) :
+
+        try :
+            yield self.conn.pipeline( [ ( 'CLOSE', ), ( 'LOGOUT', ) ] )		# CLOSE simply fails if no folder is selected
+
+        except Exception :
+            print( 'Unable to successfully logout of IMAP server.' )
+
+        self.conn.close()
+
+
+    @timed
+    def select( self, folder = 'INBOX' ) :
+
+        self.folder = folder
+
+        try :
+            typ, self.responses, text = yield self.conn.command( 'SELECT', folder )
+
+        except Exception :
+            print( 'Unable to select folder ' + self.folder + ' in IMAP server.' )
+
+
+    @timed
+    def examine( self, folder = 'INBOX' ) :
+
+        self.folder = folder
+
+        try :
+            typ, self.responses, text = yield self.conn.command( 'EXAMINE', folder )
+
+        except Exception :
+            print( 'Unable to examine folder ' + self.folder + ' in IMAP server.' )
+
+
+    @timed
+    def openFolder( self, folder, strSearch = None, withNums = False, lstFields = None ) :
+
+        from imapServer import _headerItems, _parseStatus, _parseSearch, _parseHeaders
+
+        self.folder = folder
+
+        prefetch = strSearch and lstFields and 'SEARCHRES' in self.capabilities		# See imapServer.openFolder()
+
+        commands = [ ( 'EXAMINE', folder ) ]
+
+        if withNums :
+
+            commands.append( ( 'STATUS', folder, '(MESSAGES UNSEEN)' ) )
+
+        if prefetch :
+
+            commands.append( ( 'UID SEARCH', 'RETURN', '(SAVE ALL)', strSearch ) )
+            commands.append( ( 'UID FETCH', '$', _headerItems( lstFields ) ) )
+
+        elif strSearch and 'ESEARCH' in self.capabilities :
+
+            commands.append( ( 'UID SEARCH', 'RETURN', '(ALL)', strSearch ) )
+
+        elif strSearch :
+
+            commands.append( ( 'UID SEARCH', strSearch ) )
+
+        nums = uids = headers = None
+
+        try :
+            results = yield self.conn.pipeline( commands )
+
+            typ, self.responses, text = results.pop(0)
+
+            if typ != 'OK' :
+
+                raise Exception( text )
+
+        except Exception :
+            print( 'Unable to examine folder ' + self.folder + ' in IMAP server.' )
+
+            raise Return( ( None, None, None ) )
+
+        if withNums :
+
+            typ, untagged, text = results.pop(0)
+
+            nums = ( _parseStatus( untagged.get( 'STATUS', [] ) ).values() or [ None ] )[0]
+
+            if nums is None :
+                print( 'Unable to receive number of total and unseen messages in folder: ' + self.folder )
+
+        if strSearch :
+
+            typ, untagged, text = results.pop(0)
+
+            if typ == 'OK' :
+                uids = _parseSearch( untagged )
+
+            else :
+                print( 'Unable to retrieve UIDs of emails specified by strSearch from IMAP server in folder: ' + self.folder )
+
+        if prefetch and uids is not None :
+
+            typ, untagged, text = results.pop(0)
+
+            if typ == 'OK' :
+                headers = _parseHeaders( untagged.get( 'FETCH', [] ), uids, lstFields )
+
+        raise Return( ( nums, uids, headers ) )
+
+
+    @timed
+    def uidValidity( self ) :
+
+        '''
+        Returns the UIDVALIDITY reported by the last SELECT/EXAMINE. A plain method (no communication with the server) that may nonetheless be yielded.
+        '''
+
+        try :
+            return int( self.responses[ 'UIDVALIDITY' ][0] )
+
+        except Exception :
+            print( 'Unable to receive UIDVALIDITY of folder: ' + self.folder )
+
+
+    @timed
+    def highestModSeq( self ) :
+
+        if self.condstore and self.responses.get( 'HIGHESTMODSEQ' ) :
+
+            return int( self.responses[ 'HIGHESTMODSEQ' ][0] )
+
+
+    @timed
+    def numMsgs( self ) :
+
+        from imapServer import _substring
+
+        try :
+            typ, untagged, text = yield self.conn.command( 'STATUS', self.folder, '(MESSAGES UNSEEN)' )
+
+            tmpStr = untagged[ 'STATUS' ][0]
+
+        except Exception :
+            print( 'Unable to receive number of total and unseen messages in folder: ' + self.folder )
+
+        else :
+            raise Return( ( int( _substring( '.*MESSAGES ([0-9]*).*', tmpStr ) ), int( _substring( '.*UNSEEN ([0-9]*).*', tmpStr ) ) ) )
+
+
+    @timed
+    def folderStatus( self, lstFolders ) :
+
+        from imapServer import _quoteFolder, _parseStatus
+
+        try :
+            if 'LIST-STATUS' in self.capabilities :		# See imapServer.folderStatus()
+
+                patterns = '(' + ' '.join( [ _quoteFolder( folder ) for folder in lstFolders ] ) + ')'
+
+                typ, untagged, text = yield self.conn.command( 'LIST', '""', patterns, 'RETURN', '(STATUS (MESSAGES UNSEEN))' )
+
+                data = untagged.get( 'STATUS', [] )
+
+            else :
+
+                data = []
+
+                results = yield self.conn.pipeline( [ ( 'STATUS', folder, '(MESSAGES UNSEEN)' ) for folder in lstFolders ] )
+
+                for typ, untagged, text in results :
+
+                    data += untagged.get( 'STATUS', [] )
+
+        except Exception :
+            print( 'Unable to receive the status of the folders in IMAP server.' )
+
+        else :
+            raise Return( _parseStatus( data ) )
+
+
+    @timed
+    def getUids( self, strSearch ) :
+
+        from imapServer import reEsearchAll, _expandUidSet
+
+        try :
+            if 'ESEARCH' in self.capabilities :		# See imapServer.getUids()
+
+                typ, untagged, text = yield self.conn.command( 'UID SEARCH', 'RETURN', '(ALL)', strSearch )
+
+                m = reEsearchAll.search( ( untagged.get( 'ESEARCH' ) or [ '' ] )[-1] )
+
+                uids = _expandUidSet( m.group(1) ) if m else []
+
+            else :
+
+                typ, untagged, text = yield self.conn.command( 'UID SEARCH', strSearch )
+
+                uids = ( untagged[ 'SEARCH' ][0] or '' ).split()
+
+        except Exception :
+            print( 'Unable to retrieve UIDs of emails specified by strSearch from IMAP server in folder: ' + self.folder )
+
+        else :
+            raise Return( uids )
+
+
+    @timed
+    def fetchHeaders( self, lstUIDs, lstFields = ['from', 'subject'] ) :
+
+        from imapServer import _headerItems, _parseHeaders
+
+        data = []
+
+        try :
+            typ, untagged, text = yield self.conn.uidCommand( 'UID FETCH', lstUIDs, _headerItems( lstFields ) )
+
+            data = untagged.get( 'FETCH', [] )
+
+        except Exception :
+            print( 'Unable to fetch header fields from folder ' + self.folder )
+
+        raise Return( _parseHeaders( data, lstUIDs, lstFields ) )
+
+
+    @timed
+    def fetchHeadersAndFlags( self, lstUIDs, lstFields, flagUIDs = [], modSeq = None ) :
+
+        from imapServer import _headerItems, _changedSince, _uidSets, _splitFetch, _parseHeaders, _expandUidSet
+
+        commands = [ ( 'UID FETCH', uidSet, _headerItems( lstFields ) ) for uidSet in _uidSets( lstUIDs ) ]		# See imapServer.fetchHeadersAndFlags()
+
+        if modSeq :
+
+            commands.append( ( 'UID FETCH', '1:*', '(UID FLAGS)', _changedSince( modSeq, self.qresync ) ) )
+
+        elif flagUIDs :
+
+            commands += [ ( 'UID FETCH', uidSet, '(UID FLAGS)' ) for uidSet in _uidSets( flagUIDs ) ]
+
+        data = []
+        vanished = []
+
+        try :
+            for ii in range( 0, len( commands ), 4 ) :
+
+                results = yield self.conn.pipeline( commands[ ii : ii + 4 ] )
+
+                for typ, untagged, text in results :
+
+                    data += untagged.get( 'FETCH', [] )
+
+                    for item in untagged.get( 'VANISHED', [] ) :
+
+                        if item :
+                            vanished += _expandUidSet( item.split()[-1] )
+
+        except Exception :
+            print( 'Unable to fetch header fields from folder ' + self.folder )
+
+        flags = dict( [ ( uid, flagStr ) for uid, flagStr, header in _splitFetch( data ) ] )
+
+        raise Return( ( _parseHeaders( data, lstUIDs, lstFields ), flags, vanished ) )
+
+
+    @timed
+    def fetchFlags( self, lstUIDs ) :
+
+        from imapServer import _splitFetch
+
+        output = {}
+
+        try :
+            typ, untagged, text = yield self.conn.uidCommand( 'UID FETCH', lstUIDs, '(UID FLAGS)' )
+
+        except Exception :
+            print( 'Unable to fetch flags for specified emails.' )
+
+        else :
+
+            for uid, flags, header in _splitFetch( untagged.get( 'FETCH', [] ) ) :
+
+                output[ uid ] = flags
+
+            raise Return( output )
+
+
+    @timed
+    def syncFlags( self, modSeq ) :
+
+        from imapServer import _splitFetch, _expandUidSet, _changedSince
+
+        output = {}
+        vanished = []
+
+        try :
+            typ, untagged, text = yield self.conn.command( 'UID FETCH', '1:*', '(UID FLAGS)', _changedSince( modSeq, self.qresync ) )
+
+            for item in untagged.get( 'VANISHED', [] ) :
+
+                if item :
+                    vanished += _expandUidSet( item.split()[-1] )
+
+        except Exception :
+            print( 'Unable to fetch changed flags from folder ' + self.folder )
+
+        else :
+
+            for uid, flags, header in _splitFetch( untagged.get( 'FETCH', [] ) ) :
+
+                output[ uid ] = flags
+
+        raise Return( ( output, vanished ) )
+
+
+    @timed
+    def copy( self, lstUIDs, folder ) :
+
+        try :
+            yield self.conn.uidCommand( 'UID COPY', lstUIDs, folder )
+
+        except Exception :
+            print( 'Unable to copy specified emails to folder ' + folder + '.' )
+
+
+    @timed
+    def delete( self, lstUIDs ) :
+
+        try :
+            yield self.conn.uidCommand( 'UID STORE', lstUIDs, '+FLAGS', '(\\Deleted)' )
+
+        except Exception :
+            print( 'Unable to set \\Deleted flags on specified emails.' )
+
+
+    @timed
+    def expunge( self ) :
+
+        yield self.conn.command( 'EXPUNGE' )
+
+
+    @timed
+    def move( self, lstUIDs, folder ) :
+
+        if not 'MOVE' in self.capabilities :
+
+            raise Return( False )
+
+        try :
+            typ, untagged, text = yield self.conn.uidCommand( 'UID MOVE', lstUIDs, folder )
+
+        except Exception :
+            print( 'Unable to move specified emails to folder ' + folder + '.' )
+
+            raise Return( False )
+
+        raise Return( typ == 'OK' )
+
+
+    @timed
+    def uidExpunge( self, lstUIDs ) :
+
+        if not 'UIDPLUS' in self.capabilities :
+
+            raise Return( False )
+
+        try :
+            typ, untagged, text = yield self.conn.uidCommand( 'UID EXPUNGE', lstUIDs )
+
+        except Exception :
+            print( 'Unable to expunge specified emails.' )
+
+            raise Return( False )
+
+        raise Return( typ == 'OK' )
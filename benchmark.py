@@ -0,0 +1,440 @@
+#! /usr/bin/python
+#
+# Copyright 2012 Abid Hasan Mujtaba
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Author: Abid H. Mujtaba
+# Email: abid.naqvi83@gmail.com
+#
+# This script benchmarks fetchheaders end-to-end against a fakeImapServer (see fakeImapServer.py) seeded with synthetic accounts, so that changes to the program can be measured without a live server. Run 'python benchmark.py -h' for the options.
+#
+# The server runs in a process of its own and every scenario (see scenarios) is run in a fresh process, so that neither the server nor the other scenarios affect the time and memory measured. For each scenario the wall time, the CPU time, the round trips and commands seen by the server, the bytes sent and received and the peak RSS of the process are reported.
+#
+# The results can be saved as JSON (--json) and later used as a baseline that a new run is compared with (--compare).
+
+
+from __future__ import print_function
+
+
+scenarios = [ 'pollAccount', 'threadedExec', 'asyncExec', 'deleteEmails', 'display' ]		# In the order in which they are run. deleteEmails modifies the accounts so it comes after the scenarios that poll them.
+
+
+
+def argParse() :
+
+    '''
+    Reads in the arguments passed to the script (see fetchheaders.argParse()).
+    '''
+
+    import argparse
+
+    parser = argparse.ArgumentParser( description = "Benchmarks fetchheaders against a local fake IMAP server holding synthetic emails. Reports wall time, CPU time, round trips, bytes transferred and peak RSS for each scenario." )
+
+    parser.add_argument( "-s", "--scenarios", help = "Comma-separated list of the scenarios to run (default: all of " + ', '.join( scenarios ) + ").", default = ','.join( scenarios ) )
+
+    parser.add_argument( "-a", "--accounts", help = "The number of accounts (default 5).", type = int, default = 5 )
+    parser.add_argument( "-m", "--messages", help = "The number of emails in each folder (default 1000).", type = int, default = 1000 )
+    parser.add_argument( "-f", "--folders", help = "Comma-separated list of the folders of each account that are filled with emails and polled (default INBOX).", default = 'INBOX' )
+    parser.add_argument( "--unseen", help = "The fraction of the emails that are unseen (default 0.3).", type = float, default = 0.3 )
+
+    parser.add_argument( "--capabilities", help = "The capabilities advertised by the server. Use it to benchmark servers without the extensions fetchheaders takes advantage of.", default = None )
+    parser.add_argument( "--latency", help = "Seconds added by the server to every round trip (default 0).", type = float, default = 0 )
+    parser.add_argument( "--bandwidth", help = "Maximum number of bytes per second the server sends to each client (0, the default, means no limit).", type = int, default = 0 )
+    parser.add_argument( "--slow", help = "A command whose response is delayed, as COMMAND=SECONDS (e.g. 'UID FETCH=0.5'). May be repeated.", action = "append", default = [] )
+    parser.add_argument( "--fail", help = "A command which fails, as COMMAND=NO|BAD|BYE (e.g. LOGIN=NO). May be repeated.", action = "append", default = [] )
+    parser.add_argument( "--failRate", help = "The probability that any other command fails with a NO response.", type = float, default = 0 )
+
+    parser.add_argument( "-A", "--showAll", help = "Flag: Poll all emails, not just unseen ones.", action = "store_true" )
+    parser.add_argument( "--cache", help = "Flag: Use the header cache (in a temporary folder). Each scenario is run once to fill the cache before it is measured.", action = "store_true" )
+    parser.add_argument( "--max", help = "Only fetch the headers of the newest MAX emails of each account (0, the default, means no limit).", type = int, default = 0, dest = "limit" )
+    parser.add_argument( "-t", "--threads", help = "The number of threads used by threadedExec (default 5).", type = int, default = 5 )
+    parser.add_argument( "--maxConnections", help = "The number of connections used by asyncExec (default 50).", type = int, default = 50 )
+    parser.add_argument( "--parseProcesses", help = "The number of processes that parse the headers of large folders (0, the default, means the polling threads parse them, see fetchheaders.conf).", type = int, default = 0 )
+    parser.add_argument( "--timeout", help = "The number of seconds after which the polling of an account is abandoned (0, the default, means never).", type = int, default = 0 )
+    parser.add_argument( "--delete", help = "The number of emails deleted from each account by the deleteEmails scenario (default 10).", type = int, default = 10 )
+    parser.add_argument( "--color", help = "Flag: Color the output of the display scenario.", action = "store_true" )
+
+    parser.add_argument( "-r", "--repeat", help = "The number of times each scenario is run (default 3). The median times are reported.", type = int, default = 3 )
+    parser.add_argument( "--json", help = "Save the results in the specified JSON file." )
+    parser.add_argument( "--compare", help = "Compare the results with those saved (using --json) in the specified file." )
+
+    args = parser.parse_args()
+
+    for name in args.scenarios.split( ',' ) :
+
+        if not name in scenarios :
+
+            parser.error( 'Unknown scenario: ' + name )
+
+    return args
+
+
+
+def makeServers( port, args, cacheFolder ) :
+
+    '''
+    Returns the dictionary of account settings (as created by fetchheaders.setOptions()) of the accounts of the fake server listening on 'port'.
+    '''
+
+    servers = {}
+
+    for ii in range( args.accounts ) :
+
+        name = 'Account' + str( ii + 1 )
+
+        servers[ name ] = { 'name': name, 'host': '127.0.0.1:' + str( port ), 'username': 'user' + str( ii + 1 ), 'password': 'secret', 'useSSL': False,
+                            'folder': args.folders.split( ',' ), 'showUnseen': not args.showAll, 'latestEmailFirst': True, 'showNums': True, 'showOnlyNums': False,
+                            'trashFolder': 'Trash', 'deleteEmails': True, 'useCache': args.cache, 'cacheFolder': cacheFolder, 'limit': args.limit,
+                            'searchSince': None, 'searchFrom': None, 'searchSubject': None, 'searchLarger': None, 'search': None,
+                            'connectTimeout': 30, 'readTimeout': 60 }
+
+    return servers
+
+
+
+def startServer( args, stats ) :
+
+    '''
+    Starts a fakeImapServer (seeded according to 'args') in a new process and waits for it to be ready. Returns the tuple ( process, port ).
+    '''
+
+    import multiprocessing
+    import socket
+
+    listener = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+    listener.bind( ( '127.0.0.1', 0 ) )
+    listener.listen( 128 )
+
+    ready = multiprocessing.Event()
+
+    process = multiprocessing.Process( target = _serve, args = ( listener, args, stats, ready ) )
+    process.daemon = True
+    process.start()
+
+    port = listener.getsockname()[1]
+
+    listener.close()		# The server process has its own copy
+
+    ready.wait()
+
+    return ( process, port )
+
+
+
+def _serve( listener, args, stats, ready ) :
+
+    from fakeImapServer import fakeImapServer, seedAccounts, parseOptions, defaultCapabilities
+
+    accounts = seedAccounts( args.accounts, args.messages, args.folders.split( ',' ), args.unseen )
+
+    server = fakeImapServer( accounts, listener = listener, capabilities = args.capabilities or defaultCapabilities, latency = args.latency, bandwidth = args.bandwidth, slowCommands = parseOptions( args.slow, float ), failCommands = parseOptions( args.fail, str ), failRate = args.failRate, stats = stats )
+
+    ready.set()
+
+    server.serveForever()
+
+
+
+def setupScenario( name, servers, args ) :
+
+    '''
+    Prepares the scenario 'name' and returns a function which runs it (the part that is measured). The function returns the number of Output objects with error = True.
+    '''
+
+    from miscClasses import pollAccount, threadedExec, asyncExec, deleteEmails
+
+    timeout = args.timeout or None
+
+    errors = lambda outs : len( [ out for out in outs if out.error ] )
+
+    if name == 'pollAccount' :		# The accounts polled one after the other
+
+        return lambda : errors( [ out for account in sorted( servers ) for out in pollAccount( servers[ account ] ) ] )
+
+    if name == 'threadedExec' :
+
+        return lambda : errors( list( threadedExec( servers, args.threads, timeout ) ) )
+
+    if name == 'asyncExec' :
+
+        return lambda : errors( list( asyncExec( servers, args.maxConnections, timeout ) ) )
+
+    outs = list( threadedExec( servers, args.threads, timeout ) )
+
+    if name == 'deleteEmails' :		# Some of the emails displayed are deleted from every folder
+
+        def run() :
+
+            for out in outs :
+
+                if not out.error and out.emails :
+
+                    deleteEmails( out.settings, [ email.uid for email in out.emails[ :args.delete ] ] )
+
+            return errors( outs )
+
+        return run
+
+    if name == 'display' :		# The polled accounts are displayed in the terminal (the output is thrown away)
+
+        import fetchheaders
+        import os
+        import sys
+
+        fetchheaders.showFlags = args.showAll
+
+        if args.color :		# The default colors (see fetchheaders.conf.spec)
+
+            fetchheaders.colorTitle, fetchheaders.colorFlag, fetchheaders.colorDate, fetchheaders.colorFrom, fetchheaders.colorSubjectSeen, fetchheaders.colorSubjectUnseen = 'blue', 'red', 'yellow', 'cyan', 'yellow', 'green'
+
+        fetchheaders.compileRenderer()		# As applyGlobalSettings() would
+
+        def run() :
+
+            stdout = sys.stdout
+
+            sys.stdout = open( os.devnull, 'w' )
+
+            try :
+                for out in outs :
+
+                    fetchheaders.displayAccount( out )
+
+                sys.stdout.flush()
+
+            finally :
+
+                sys.stdout.close()
+
+                sys.stdout = stdout
+
+            return errors( outs )
+
+        return run
+
+
+
+def runScenario( name, servers, args, stats ) :
+
+    '''
+    Runs the scenario 'name' once in a new process and returns a dictionary of its measurements.
+    '''
+
+    import multiprocessing
+
+    parent, child = multiprocessing.Pipe()
+
+    process = multiprocessing.Process( target = _measure, args = ( child, name, servers, args, stats ) )
+    process.start()
+
+    result = parent.recv()
+
+    process.join()
+
+    return result
+
+
+
+def _measure( conn, name, servers, args, stats ) :
+
+    import os
+    import resource
+    import time
+    import traceback
+
+    try :
+        if args.parseProcesses :		# Started before any thread (see miscClasses.startParsePool())
+
+            from miscClasses import startParsePool
+
+            startParsePool( args.parseProcesses )
+
+        run = setupScenario( name, servers, args )
+
+        if args.cache :		# Fill the cache first
+
+            run()
+
+        time.sleep( 0.05 )		# Lets the server finish counting the setup before the counters are read
+
+        before = stats.snapshot()
+        cpu = os.times()
+        start = time.time()
+
+        errors = run()
+
+        wall = time.time() - start
+        cpu = sum( os.times()[ :2 ] ) - sum( cpu[ :2 ] )
+
+        time.sleep( 0.05 )		# The server counts the last bytes it sends after sending them
+
+        after = stats.snapshot()
+
+        result = dict( ( key, after[ key ] - before[ key ] ) for key in after )
+
+        result.update( { 'wall': wall, 'cpu': cpu, 'errors': errors, 'peakRSS': resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss / 1024.0 } )		# ru_maxrss is in kilobytes (on Linux)
+
+    except Exception :
+
+        result = { 'error': traceback.format_exc() }
+
+    conn.send( result )
+
+
+
+def summarize( runs ) :
+
+    '''
+    Combines the results of the repeated runs of a scenario: the median of the times, the largest peak RSS and the counts of the last run (they barely vary from one run to the next).
+    '''
+
+    median = lambda values : sorted( values )[ len( values ) // 2 ]
+
+    result = dict( runs[-1] )
+
+    result[ 'wall' ] = median( [ run[ 'wall' ] for run in runs ] )
+    result[ 'cpu' ] = median( [ run[ 'cpu' ] for run in runs ] )
+    result[ 'peakRSS' ] = max( [ run[ 'peakRSS' ] for run in runs ] )
+
+    return result
+
+
+
+columns = [ ( 'wall', 'wall (s)', '%.3f' ), ( 'cpu', 'cpu (s)', '%.3f' ), ( 'roundTrips', 'round trips', '%d' ), ( 'commands', 'commands', '%d' ), ( 'bytesIn', 'sent (KB)', '%.1f' ), ( 'bytesOut', 'received (KB)', '%.1f' ), ( 'peakRSS', 'peak RSS (MB)', '%.1f' ), ( 'errors', 'errors', '%d' ) ]
+
+
+
+def report( results, baseline = None ) :
+
+    '''
+    Prints the results (a dictionary keyed by scenario) as a table. If 'baseline' (results loaded from a file saved with --json) is given the relative change of every measurement is printed below it.
+    '''
+
+    def value( result, key ) :
+
+        if key.startswith( 'bytes' ) :
+
+            return result[ key ] / 1024.0
+
+        return result[ key ]
+
+    print( '%-14s' % 'scenario' + ''.join( '%15s' % title for key, title, form in columns ) )
+
+    for name in scenarios :
+
+        if not name in results :
+
+            continue
+
+        print( '%-14s' % name + ''.join( '%15s' % ( form % value( results[ name ], key ) ) for key, title, form in columns ) )
+
+        if baseline and name in baseline :
+
+            changes = []
+
+            for key, title, form in columns :
+
+                old = baseline[ name ].get( key )
+
+                if old :
+
+                    changes.append( '%+14.1f%%' % ( 100.0 * ( results[ name ][ key ] - old ) / old ) )
+
+                else :
+
+                    changes.append( '%15s' % '-' )
+
+            print( '%-14s' % '  vs baseline' + ''.join( changes ) )
+
+
+
+def main() :
+
+    import json
+    import os
+    import shutil
+    import sys
+    import tempfile
+
+    sys.path.insert( 0, os.path.dirname( os.path.abspath( __file__ ) ) )		# The fetchheaders modules are imported from the same folder as this script
+
+    from fakeImapServer import serverStats
+
+    args = argParse()
+
+    stats = serverStats( shared = True )
+
+    print( 'Seeding ' + str( args.accounts ) + ' accounts with ' + str( args.messages ) + ' emails in each of ' + args.folders + ' ...' )
+
+    process, port = startServer( args, stats )
+
+    cacheFolder = tempfile.mkdtemp( prefix = 'fetchheaders-benchmark-' )
+
+    servers = makeServers( port, args, cacheFolder )
+
+    results = {}
+
+    try :
+        for name in [ name for name in scenarios if name in args.scenarios.split( ',' ) ] :
+
+            runs = []
+
+            for ii in range( args.repeat ) :
+
+                run = runScenario( name, servers, args, stats )
+
+                if 'error' in run :
+
+                    print( 'Scenario ' + name + ' failed:\n' + run[ 'error' ] )
+
+                    break
+
+                runs.append( run )
+
+            if runs :
+
+                results[ name ] = summarize( runs )
+
+    finally :
+
+        process.terminate()
+
+        shutil.rmtree( cacheFolder, True )
+
+    print( '' )
+
+    baseline = None
+
+    if args.compare :
+
+        with open( args.compare ) as f :
+
+            baseline = json.load( f )[ 'results' ]
+
+    report( results, baseline )
+
+    if args.json :
+
+        parameters = dict( ( key, value ) for key, value in vars( args ).items() if not key in ( 'json', 'compare' ) )
+
+        with open( args.json, 'w' ) as f :
+
+            json.dump( { 'parameters': parameters, 'results': results }, f, indent = 2, sort_keys = True )
+
+
+
+if __name__ == '__main__' :
+
+    main()
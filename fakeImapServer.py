@@ -0,0 +1,1777 @@
+#! /usr/bin/python
+#
+# Copyright 2012 Abid Hasan Mujtaba
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Author: Abid H. Mujtaba
+# Email: abid.naqvi83@gmail.com
+#
+# This file implements a self-contained stand-in for an IMAP server which runs on localhost. It holds a number of accounts seeded with synthetic emails (see seedAccounts()) and implements the subset of IMAP4rev1 (and of the extensions CONDSTORE, QRESYNC, ESEARCH, SEARCHRES, LIST-STATUS, UIDPLUS, MOVE and IDLE) that fetchheaders uses, so that the program can be exercised and measured (see benchmark.py) without a live server.
+#
+# Network conditions can be simulated: a latency added to every round trip, a limit on the bandwidth of the responses, commands that are slow to respond and commands that fail. The server counts the round trips, commands and bytes exchanged with its clients (see serverStats).
+#
+# It can also be run on its own, e.g. 'python fakeImapServer.py --port 1143 --accounts 3 --messages 500', and polled by fetchheaders using a configuration file whose accounts have host = localhost:1143, username = user1 (user2, ...) and password = secret.
+#
+# The emails are kept in memory so the server is only suitable for testing. It is not secure in any way.
+
+
+import random
+import re
+import socket
+import threading
+import time
+
+
+defaultCapabilities = 'IMAP4rev1 LITERAL+ IDLE UIDPLUS MOVE ENABLE CONDSTORE QRESYNC ESEARCH SEARCHRES LIST-STATUS'
+
+reToken = re.compile( '\\s*(?:"((?:[^"\\\\]|\\\\.)*)"|(\\()|(\\))|([^\\s()"\\[\\]]*(?:\\[[^\\]]*\\][^\\s()]*)?))' )		# A quoted string, a parenthesis or an atom (which may contain a bracketed section with spaces, e.g. BODY.PEEK[HEADER.FIELDS (FROM DATE)])
+reLiteral = re.compile( '.*\\{([0-9]+)(\\+?)\\}$' )		# A line ending in {size} (or the non-synchronizing {size+}) is followed by a literal of 'size' bytes
+reBodySection = re.compile( 'BODY(\\.PEEK)?\\[([^\\]]*)\\]', re.I )
+reHeaderFields = re.compile( 'HEADER\\.FIELDS(\\.NOT)? \\(([^\\)]*)\\)', re.I )
+reHeaderLine = re.compile( '\r\n(?![ \t])' )		# A line break that is NOT followed by whitespace (which would indicate a folded header)
+
+months = [ 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec' ]
+
+
+
+class fakeMessage( object ) :
+
+    '''
+    A single email stored by the server. Only its header is stored. The body is made up of filler text when asked for (see .body()).
+    '''
+
+    __slots__ = ( 'uid', 'flags', 'modSeq', 'header', 'size', 'date' )
+
+    def __init__( self, uid, flags, modSeq, header, size, date ) :
+
+        self.uid = uid
+        self.flags = flags		# A set of flags e.g. set( [ '\\Seen' ] )
+        self.modSeq = modSeq		# Modification sequence (RFC 7162) of the last change to the email
+        self.header = header		# The raw header, ending with an empty line
+        self.size = size		# Total size (header and body) in bytes
+        self.date = date		# Internal date as seconds since the epoch
+
+
+    def body( self ) :
+
+        filler = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod.\r\n'		# 76 characters per line
+
+        length = max( 0, self.size - len( self.header ) )
+
+        return ( filler * ( length // len( filler ) + 1 ) )[ :length ]
+
+
+
+class fakeFolder( object ) :
+
+    '''
+    A folder of an account: its emails (in ascending order of UID, so that the sequence number of an email is its index plus one) and the state needed to implement UIDs and modification sequences.
+    '''
+
+    def __init__( self, uidValidity ) :
+
+        self.messages = []
+        self.uidValidity = uidValidity
+        self.uidNext = 1
+        self.highestModSeq = 1
+        self.expunged = []		# Tuples ( uid, modSeq ) of the expunged emails, used to report them as VANISHED (RFC 7162)
+
+
+    def add( self, header, flags, size, date ) :
+
+        self.highestModSeq += 1
+
+        message = fakeMessage( self.uidNext, set( flags ), self.highestModSeq, header, size, date )
+
+        self.uidNext += 1
+
+        self.messages.append( message )
+
+        return message
+
+
+    def unseen( self ) :
+
+        return len( [ message for message in self.messages if not '\\Seen' in message.flags ] )
+
+
+
+class fakeAccount( object ) :
+
+    '''
+    An account: its password and its folders (a dictionary keyed by the name of the folder).
+    '''
+
+    def __init__( self, password ) :
+
+        self.password = password
+        self.folders = {}
+
+
+    def folder( self, name ) :
+
+        if name.upper() == 'INBOX' :		# The name INBOX is case-insensitive
+
+            name = 'INBOX'
+
+        return self.folders.get( name )
+
+
+
+def seedAccounts( numAccounts, numMessages, folders = [ 'INBOX' ], unseen = 0.3, password = 'secret', seed = 0 ) :
+
+    '''
+    Creates 'numAccounts' accounts named user1, user2, ... (all with the password 'password') and returns them as a dictionary keyed by username. 'numMessages' synthetic emails are created in each of the folders 'folders'. A fraction 'unseen' of them are unseen. Every account also has an empty Trash folder (unless it is one of 'folders').
+
+    The emails are generated from 'seed' so that the same arguments always produce the same accounts. Their headers mimic real ones: some names and subjects are MIME encoded-words, some subjects are long enough to be folded and the sizes of the emails vary from a few to a few hundred kilobytes.
+    '''
+
+    rand = random.Random( seed )
+
+    start = time.time() - numMessages * 600		# The emails arrive 10 minutes apart, the last one just now
+
+    accounts = {}
+
+    for ii in range( numAccounts ) :
+
+        account = fakeAccount( password )
+
+        for name in list( folders ) + [ name for name in [ 'Trash' ] if not name in folders ] :
+
+            folder = account.folders[ name ] = fakeFolder( rand.randint( 1, 2 ** 31 ) )
+
+            if name == 'Trash' and not name in folders :
+
+                continue
+
+            for jj in range( numMessages ) :
+
+                date = start + jj * 600
+
+                flags = []
+
+                if rand.random() >= unseen :
+
+                    flags.append( '\\Seen' )
+
+                if rand.random() < 0.05 :
+
+                    flags.append( '\\Flagged' )
+
+                header = syntheticHeader( rand, date )
+
+                folder.add( header, flags, len( header ) + int( rand.lognormvariate( 9, 1.2 ) ), date )
+
+        accounts[ 'user' + str( ii + 1 ) ] = account
+
+    return accounts
+
+
+
+def syntheticHeader( rand, date ) :
+
+    '''
+    Returns a plausible email header (ending with an empty line) for an email sent at 'date' (seconds since the epoch), using the random number generator 'rand'.
+    '''
+
+    from email.utils import formatdate
+    import base64
+
+    first = [ 'Alice', 'Bob', 'Carol', 'Dave', 'Erin', 'Frank', 'Grace', 'Heidi', 'Ivan', 'Judy', 'Mallory', 'Oscar', 'Peggy', 'Trent', 'Victor', 'Walter' ]
+    last = [ 'Smith', 'Jones', 'Taylor', 'Brown', 'Williams', 'Wilson', 'Johnson', 'Davies', 'Robinson', 'Wright' ]
+    words = [ 'meeting', 'report', 'quarterly', 'update', 'invoice', 'schedule', 'project', 'review', 'release', 'notes', 'budget', 'travel', 'draft', 'proposal', 'agenda', 'minutes', 'feedback', 'reminder', 'newsletter', 'order' ]
+
+    firstName = rand.choice( first )
+    lastName = rand.choice( last )
+    address = firstName.lower() + '.' + lastName.lower() + '@example.com'
+
+    if rand.random() < 0.2 :		# Names with non-ASCII characters are sent as encoded-words (RFC 2047)
+
+        name = '=?UTF-8?B?' + base64.b64encode( ( firstName + u' M\xfcller' ).encode( 'utf-8' ) ) + '?='
+
+    elif rand.random() < 0.2 :
+
+        name = ''
+
+    else :
+
+        name = '"' + firstName + ' ' + lastName + '"'
+
+    sender = ( name + ' <' + address + '>' ) if name else address
+
+    subject = ' '.join( rand.choice( words ) for ii in range( rand.randint( 2, 12 ) ) ).capitalize()
+
+    if rand.random() < 0.1 :
+
+        subject = '=?ISO-8859-1?Q?' + subject.replace( ' ', '_' ) + '_=E9t=E9?='
+
+    elif rand.random() < 0.2 :
+
+        subject = 'Re: ' + subject
+
+    if len( subject ) > 60 :		# Long subjects are folded
+
+        cut = subject.rfind( ' ', 0, 60 )
+
+        if cut > 0 :
+
+            subject = subject[ :cut ] + '\r\n\t' + subject[ cut + 1: ]
+
+    lines = [ 'Return-Path: <' + address + '>',
+              'Received: from mail.example.com (mail.example.com [192.0.2.1])\r\n\tby mx.example.org with ESMTPS id ' + '%016x' % rand.getrandbits( 64 ),
+              'Message-ID: <' + '%016x' % rand.getrandbits( 64 ) + '@example.com>',
+              'Date: ' + formatdate( date ),
+              'From: ' + sender,
+              'To: user@example.org',
+              'Subject: ' + subject,
+              'MIME-Version: 1.0',
+              'Content-Type: text/plain; charset=UTF-8' ]
+
+    return '\r\n'.join( lines ) + '\r\n\r\n'
+
+
+
+class serverStats( object ) :
+
+    '''
+    Counters of the activity of a fakeImapServer: the connections accepted, the commands received, the round trips (the number of responses a client had to wait for, see _Session.flush()) and the bytes received and sent.
+
+    shared: If True the counters are kept in memory shared with child processes (see multiprocessing.RawArray), so that a server running in one process can be monitored from another. The object must then be created before the processes are forked.
+    '''
+
+    fields = ( 'connections', 'commands', 'roundTrips', 'bytesIn', 'bytesOut' )
+
+    def __init__( self, shared = False ) :
+
+        if shared :
+
+            from multiprocessing import RawArray
+
+            self.values = RawArray( 'd', len( self.fields ) )
+
+        else :
+
+            self.values = [ 0 ] * len( self.fields )
+
+        self.lock = threading.Lock()
+
+
+    def add( self, field, amount = 1 ) :
+
+        index = self.fields.index( field )
+
+        with self.lock :
+
+            self.values[ index ] += amount
+
+
+    def snapshot( self ) :
+
+        '''
+        Returns the current values of the counters as a dictionary.
+        '''
+
+        return dict( zip( self.fields, [ int( value ) for value in self.values[:] ] ) )
+
+
+
+class _Bad( Exception ) :		# Raised by a command handler to send a BAD response
+
+    pass
+
+
+class _No( Exception ) :		# Raised by a command handler to send a NO response
+
+    pass
+
+
+class _Bye( Exception ) :		# Raised to drop the connection
+
+    pass
+
+
+
+class fakeImapServer( threading.Thread ) :
+
+    '''
+    A thread which accepts connections on a TCP socket and serves each one from its own thread (see _Session).
+
+    accounts: The dictionary of fakeAccount objects keyed by username (see seedAccounts()).
+
+    address: The (host, port) tuple to listen on. Port 0 picks a free port: the one chosen is available as .port once the object has been created.
+
+    listener: An already listening socket to use instead of 'address' (e.g. one created by a parent process).
+
+    capabilities: The capabilities advertised (a space-separated string).
+
+    latency: The number of seconds added to every round trip. It is waited before every response the client is waiting for (see _Session.flush()), so that pipelined commands only pay it once.
+
+    bandwidth: The maximum number of bytes per second sent to each client (0 means no limit).
+
+    slowCommands: A dictionary mapping command names (e.g. 'LOGIN', 'UID FETCH', or 'FETCH' for both FETCH and UID FETCH) to a number of seconds by which the response to the command is delayed.
+
+    failCommands: A dictionary mapping command names (as for slowCommands) to the way the command fails: 'NO', 'BAD' or 'BYE' (the connection is dropped without a response).
+
+    failRate: The probability that any other command (except LOGOUT) fails with a NO response.
+
+    certfile: A PEM file with the certificate and private key of the server. If given connections are wrapped in SSL (as on port 993).
+
+    stats: The serverStats object in which the activity of the server is counted. A new one is created if not given.
+    '''
+
+    def __init__( self, accounts, address = ( '127.0.0.1', 0 ), listener = None, capabilities = defaultCapabilities, latency = 0, bandwidth = 0, slowCommands = {}, failCommands = {}, failRate = 0, certfile = None, stats = None, seed = 0 ) :
+
+        super( fakeImapServer, self ).__init__()
+
+        self.daemon = True
+
+        self.accounts = accounts
+        self.capabilities = capabilities
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.slowCommands = dict( ( key.upper(), value ) for key, value in slowCommands.items() )
+        self.failCommands = dict( ( key.upper(), value.upper() ) for key, value in failCommands.items() )
+        self.failRate = failRate
+        self.certfile = certfile
+        self.stats = stats or serverStats()
+
+        self.random = random.Random( seed )		# Decides which commands fail (see failRate)
+
+        self.lock = threading.RLock()		# Serializes access to the accounts by the sessions
+        self.sessions = set()
+
+        if listener is None :
+
+            listener = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+            listener.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+            listener.bind( address )
+            listener.listen( 128 )
+
+        self.listener = listener
+        self.port = listener.getsockname()[1]
+
+
+    def run( self ) :
+
+        while True :
+
+            try :
+                sock, peer = self.listener.accept()
+
+            except socket.error :		# The listening socket has been closed
+
+                return
+
+            _Session( self, sock ).start()
+
+
+    def serveForever( self ) :
+
+        '''
+        Serves clients from the calling thread (rather than a new one, see .start()). Never returns.
+        '''
+
+        self.run()
+
+
+    def close( self ) :
+
+        self.listener.close()
+
+
+    def deliver( self, username, folder = 'INBOX', count = 1 ) :
+
+        '''
+        Adds 'count' new (unseen) emails to 'folder' of the account 'username' and notifies the clients that have the folder selected (immediately if they are idling, see IDLE). Returns the UIDs of the new emails.
+        '''
+
+        with self.lock :
+
+            box = self.accounts[ username ].folder( folder )
+
+            uids = []
+
+            for ii in range( count ) :
+
+                header = syntheticHeader( self.random, time.time() )
+
+                uids.append( box.add( header, [], len( header ) + 2048, time.time() ).uid )
+
+            for session in list( self.sessions ) :
+
+                if session.box is box :
+
+                    session.notify( '* ' + str( len( box.messages ) ) + ' EXISTS' )
+
+        return uids
+
+
+
+class _Session( threading.Thread ) :
+
+    '''
+    A thread which serves a single connection to a fakeImapServer. Every command is handled by the method named after it (e.g. doSELECT).
+    '''
+
+    def __init__( self, server, sock ) :
+
+        super( _Session, self ).__init__()
+
+        self.daemon = True
+
+        self.server = server
+        self.sock = sock
+        self.buffer = ''		# Data received from the client but not yet consumed
+
+        self.account = None		# The fakeAccount logged in to
+        self.box = None			# The selected fakeFolder
+        self.readOnly = False
+        self.condstore = False		# CONDSTORE/QRESYNC enabled (RFC 7162)
+        self.qresync = False
+        self.saved = set()		# UIDs of the result saved by a SEARCH RETURN (SAVE) (RFC 5182)
+
+        self.output = []		# Lines of the response being assembled
+        self.pending = []		# Untagged responses (e.g. new emails) to be sent at the completion of the next command
+        self.idling = False
+        self.writeLock = threading.Lock()
+        self.sendTime = 0		# Time at which the data sent so far has 'arrived' when the bandwidth is limited
+
+
+    def run( self ) :
+
+        self.server.stats.add( 'connections' )
+
+        with self.server.lock :
+
+            self.server.sessions.add( self )
+
+        try :
+            self.sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )		# As real servers do: the responses to pipelined commands are written one at a time
+
+            if self.server.certfile :
+
+                import ssl
+
+                self.sock = ssl.wrap_socket( self.sock, server_side = True, certfile = self.server.certfile )
+
+            self.serve()
+
+        except ( socket.error, _Bye ) :
+
+            pass
+
+        finally :
+
+            with self.server.lock :
+
+                self.server.sessions.discard( self )
+
+            try :
+                self.sock.close()
+
+            except socket.error :
+
+                pass
+
+
+    def serve( self ) :
+
+        self.output.append( '* OK [CAPABILITY ' + self.server.capabilities + '] fakeImapServer ready' )		# Waiting for the greeting costs the client a round trip
+
+        self.flush()
+
+        while True :
+
+            line = self.readCommand()
+
+            if line is None :		# The client closed the connection
+
+                return
+
+            tokens = _tokenize( line )
+
+            if len( tokens ) < 2 or isinstance( tokens[0], list ) or isinstance( tokens[1], list ) :
+
+                self.output.append( '* BAD Invalid command' )
+
+                self.flush()
+
+                continue
+
+            tag = tokens[0]
+            name = tokens[1].upper()
+            args = tokens[2:]
+
+            full = name
+
+            if name == 'UID' and args and not isinstance( args[0], list ) :
+
+                full = 'UID ' + args[0].upper()
+
+            self.server.stats.add( 'commands' )
+
+            delay = self.server.slowCommands.get( full, self.server.slowCommands.get( full.split()[-1], 0 ) )
+
+            if delay :
+
+                time.sleep( delay )
+
+            failure = self.server.failCommands.get( full, self.server.failCommands.get( full.split()[-1] ) )
+
+            if failure is None and self.server.failRate and name != 'LOGOUT' and self.server.random.random() < self.server.failRate :
+
+                failure = 'NO'
+
+            if failure == 'BYE' :
+
+                raise _Bye()
+
+            elif failure :
+
+                self.output.append( tag + ' ' + failure + ' ' + full + ' failed (simulated)' )
+
+                self.flush()
+
+                continue
+
+            try :
+                with self.server.lock :
+
+                    text = getattr( self, 'do' + name.replace( '-', '' ), self.unknown )( tag, args )
+
+                    self.output += self.pending
+                    self.pending = []
+
+                self.output.append( tag + ' OK ' + ( text or name + ' completed' ) )
+
+            except _No as e :
+
+                self.output.append( tag + ' NO ' + ( str( e ) or name + ' failed' ) )
+
+            except ( _Bad, ValueError, IndexError, KeyError, TypeError ) as e :
+
+                self.output.append( tag + ' BAD ' + ( str( e ) or 'Invalid arguments' ) )
+
+            self.flush()
+
+            if name == 'LOGOUT' :
+
+                return
+
+
+    def readLine( self ) :
+
+        '''
+        Returns the next line received from the client (without its line break) or None if the connection has been closed.
+
+        '''
+
+        while not '\r\n' in self.buffer :
+
+            data = self.sock.recv( 65536 )
+
+            if not data :
+
+                return None
+
+            self.server.stats.add( 'bytesIn', len( data ) )
+
+            self.buffer += data
+
+        line, self.buffer = self.buffer.split( '\r\n', 1 )
+
+        return line
+
+
+    def readCommand( self ) :
+
+        '''
+        Returns the next command received from the client, with any literals (RFC 3501 section 4.3) replaced by quoted strings.
+        '''
+
+        line = self.readLine()
+
+        if line is None :
+
+            return None
+
+        m = reLiteral.match( line )
+
+        while m :
+
+            size = int( m.group(1) )
+
+            if not m.group(2) :		# A synchronizing literal: the client waits for our go-ahead
+
+                self.output.append( '+ Ready for literal' )
+
+                self.flush()
+
+            while len( self.buffer ) < size :
+
+                data = self.sock.recv( 65536 )
+
+                if not data :
+
+                    return None
+
+                self.server.stats.add( 'bytesIn', len( data ) )
+
+                self.buffer += data
+
+            literal, self.buffer = self.buffer[ :size ], self.buffer[ size: ]
+
+            rest = self.readLine()
+
+            if rest is None :
+
+                return None
+
+            line = line[ :m.start(1) - 1 ] + '"' + literal.replace( '\\', '\\\\' ).replace( '"', '\\"' ) + '"' + rest
+
+            m = reLiteral.match( rest ) and reLiteral.match( line )
+
+        return line
+
+
+    def write( self, data ) :
+
+        '''
+        Sends 'data' to the client, as slowly as the bandwidth limit of the server requires.
+        '''
+
+        with self.writeLock :
+
+            self.sock.sendall( data )
+
+            self.server.stats.add( 'bytesOut', len( data ) )
+
+            if self.server.bandwidth :
+
+                now = time.time()
+
+                self.sendTime = max( self.sendTime, now ) + len( data ) / float( self.server.bandwidth )
+
+                if self.sendTime > now :
+
+                    time.sleep( self.sendTime - now )
+
+
+    def flush( self ) :
+
+        '''
+        Sends the response assembled in .output.
+
+        If nothing else has been received from the client by then it must be waiting for this response: this counts as a round trip (and the simulated latency is waited before the response is sent). Pipelined commands are received together so only the response to the last of them counts.
+        '''
+
+        import select
+
+        if not self.output :
+
+            return
+
+        data = '\r\n'.join( self.output ) + '\r\n'
+
+        self.output = []
+
+        if not self.buffer and not ( hasattr( self.sock, 'pending' ) and self.sock.pending() ) and not select.select( [ self.sock ], [], [], 0 )[0] :
+
+            self.server.stats.add( 'roundTrips' )
+
+            if self.server.latency :
+
+                time.sleep( self.server.latency )
+
+        self.write( data )
+
+
+    def notify( self, line ) :
+
+        '''
+        Sends the untagged response 'line' to the client as soon as it is allowed: immediately while idling, otherwise along with the response to the next command.
+        '''
+
+        if self.idling :
+
+            self.write( line + '\r\n' )
+
+        else :
+
+            self.pending.append( line )
+
+
+    def untagged( self, line ) :
+
+        self.output.append( '* ' + line )
+
+
+    def requireAuth( self ) :
+
+        if self.account is None :
+
+            raise _Bad( 'Not logged in' )
+
+
+    def requireSelected( self ) :
+
+        if self.box is None :
+
+            raise _Bad( 'No folder selected' )
+
+
+    def folder( self, name ) :
+
+        self.requireAuth()
+
+        box = self.account.folder( _string( name ) )
+
+        if box is None :
+
+            raise _No( '[TRYCREATE] No such folder' )
+
+        return box
+
+
+    def unknown( self, tag, args ) :
+
+        raise _Bad( 'Unknown command' )
+
+
+    # Commands valid in any state:
+
+    def doCAPABILITY( self, tag, args ) :
+
+        self.untagged( 'CAPABILITY ' + self.server.capabilities )
+
+
+    def doNOOP( self, tag, args ) :
+
+        pass
+
+
+    doCHECK = doNOOP
+
+
+    def doLOGOUT( self, tag, args ) :
+
+        self.untagged( 'BYE Logging out' )
+
+
+    def doIDLE( self, tag, args ) :
+
+        self.requireAuth()
+
+        self.output += self.pending + [ '+ idling' ]		# Anything pending is sent straight away
+
+        self.pending = []
+
+        self.flush()
+
+        self.idling = True
+
+        self.server.lock.release()		# Other sessions (and deliver()) must be able to carry on while we wait
+
+        try :
+            line = self.readLine()
+
+        finally :
+
+            self.idling = False
+
+            self.server.lock.acquire()
+
+        if line is None :
+
+            raise _Bye()
+
+        if line.upper() != 'DONE' :
+
+            raise _Bad( 'Expected DONE' )
+
+
+    # Commands valid in the authenticated state:
+
+    def doLOGIN( self, tag, args ) :
+
+        username, password = _string( args[0] ), _string( args[1] )
+
+        account = self.server.accounts.get( username )
+
+        if account is None or account.password != password :
+
+            raise _No( '[AUTHENTICATIONFAILED] Invalid credentials' )
+
+        self.account = account
+
+        return '[CAPABILITY ' + self.server.capabilities + '] Logged in'
+
+
+    def doENABLE( self, tag, args ) :
+
+        self.requireAuth()
+
+        enabled = [ ext.upper() for ext in args if ext.upper() in self.server.capabilities.split() and ext.upper() in ( 'CONDSTORE', 'QRESYNC' ) ]
+
+        if 'QRESYNC' in enabled :
+
+            self.qresync = True
+
+        if enabled :
+
+            self.condstore = True
+
+        self.untagged( 'ENABLED' + ''.join( ' ' + ext for ext in enabled ) )
+
+
+    def doSELECT( self, tag, args ) :
+
+        self.box = None		# A failed SELECT leaves no folder selected
+
+        box = self.folder( args[0] )
+
+        if len( args ) > 1 and isinstance( args[1], list ) and args[1] and args[1][0].upper() in ( 'CONDSTORE', 'QRESYNC' ) :
+
+            self.condstore = True
+
+        self.box = box
+        self.readOnly = ( self.command == 'EXAMINE' )
+        self.saved = set()
+
+        self.untagged( 'FLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft)' )
+        self.untagged( str( len( box.messages ) ) + ' EXISTS' )
+        self.untagged( '0 RECENT' )
+        self.untagged( 'OK [PERMANENTFLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft \\*)] Flags permitted' )
+        self.untagged( 'OK [UIDVALIDITY ' + str( box.uidValidity ) + '] UIDs valid' )
+        self.untagged( 'OK [UIDNEXT ' + str( box.uidNext ) + '] Predicted next UID' )
+
+        if 'CONDSTORE' in self.server.capabilities.split() :
+
+            self.untagged( 'OK [HIGHESTMODSEQ ' + str( box.highestModSeq ) + '] Highest' )
+
+        return ( self.readOnly and '[READ-ONLY]' or '[READ-WRITE]' ) + ' ' + self.command + ' completed'
+
+
+    command = 'SELECT'
+
+    def doEXAMINE( self, tag, args ) :
+
+        self.command = 'EXAMINE'
+
+        try :
+            return self.doSELECT( tag, args )
+
+        finally :
+
+            self.command = 'SELECT'
+
+
+    def doSTATUS( self, tag, args ) :
+
+        box = self.folder( args[0] )
+
+        self.untagged( 'STATUS ' + _quote( _string( args[0] ) ) + ' (' + _statusItems( box, args[1] ) + ')' )
+
+
+    def doLIST( self, tag, args ) :
+
+        self.requireAuth()
+
+        patterns = args[1] if isinstance( args[1], list ) else [ args[1] ]
+
+        items = None
+
+        if len( args ) > 3 and args[2].upper() == 'RETURN' :		# LIST-STATUS (RFC 5819): RETURN (STATUS (MESSAGES UNSEEN))
+
+            options = args[3]
+
+            for ii in range( len( options ) - 1 ) :
+
+                if not isinstance( options[ ii ], list ) and options[ ii ].upper() == 'STATUS' :
+
+                    items = options[ ii + 1 ]
+
+        regexes = [ re.compile( re.escape( _string( pattern ) ).replace( '\\*', '.*' ).replace( '\\%', '[^/]*' ) + '$', re.I ) for pattern in patterns ]
+
+        for name in sorted( self.account.folders ) :
+
+            if [ regex for regex in regexes if regex.match( name ) ] :
+
+                self.untagged( 'LIST (\\HasNoChildren) "/" ' + _quote( name ) )
+
+                if items is not None :
+
+                    self.untagged( 'STATUS ' + _quote( name ) + ' (' + _statusItems( self.account.folders[ name ], items ) + ')' )
+
+
+    # Commands valid in the selected state:
+
+    def doCLOSE( self, tag, args ) :
+
+        self.requireSelected()
+
+        if not self.readOnly :		# CLOSE expunges silently
+
+            self.expunge( [ message.uid for message in self.box.messages if '\\Deleted' in message.flags ], silent = True )
+
+        self.box = None
+
+
+    def doUNSELECT( self, tag, args ) :
+
+        self.requireSelected()
+
+        self.box = None
+
+
+    def doEXPUNGE( self, tag, args ) :
+
+        self.requireSelected()
+
+        if self.readOnly :
+
+            raise _No( 'Folder is read-only' )
+
+        self.expunge( [ message.uid for message in self.box.messages if '\\Deleted' in message.flags ] )
+
+
+    def doUID( self, tag, args ) :
+
+        self.requireSelected()
+
+        handler = getattr( self, 'uid' + args[0].upper(), None )
+
+        if handler is None :
+
+            raise _Bad( 'Unknown UID command' )
+
+        return handler( tag, args[1:], True )
+
+
+    def doSEARCH( self, tag, args ) :
+
+        self.requireSelected()
+
+        return self.uidSEARCH( tag, args, False )
+
+
+    def doFETCH( self, tag, args ) :
+
+        self.requireSelected()
+
+        return self.uidFETCH( tag, args, False )
+
+
+    def doSTORE( self, tag, args ) :
+
+        self.requireSelected()
+
+        return self.uidSTORE( tag, args, False )
+
+
+    def doCOPY( self, tag, args ) :
+
+        self.requireSelected()
+
+        return self.uidCOPY( tag, args, False )
+
+
+    def doMOVE( self, tag, args ) :
+
+        self.requireSelected()
+
+        return self.uidMOVE( tag, args, False )
+
+
+    def select( self, setString, byUid ) :
+
+        '''
+        Returns the list of tuples ( sequence number, fakeMessage ) of the emails in the selected folder specified by the UID set (or sequence set) 'setString'.
+        '''
+
+        messages = self.box.messages
+
+        if byUid and setString == '$' :
+
+            return [ ( ii + 1, message ) for ii, message in enumerate( messages ) if message.uid in self.saved ]
+
+        if byUid :
+
+            ranges = _parseSet( setString, messages and messages[-1].uid or 0 )
+
+            return [ ( ii + 1, message ) for ii, message in enumerate( messages ) if _inRanges( message.uid, ranges ) ]
+
+        ranges = _parseSet( setString, len( messages ) )
+
+        return [ ( ii + 1, message ) for ii, message in enumerate( messages ) if _inRanges( ii + 1, ranges ) ]
+
+
+    def uidSEARCH( self, tag, args, byUid ) :
+
+        options = None
+
+        if args and not isinstance( args[0], list ) and args[0].upper() == 'RETURN' :		# ESEARCH (RFC 4731) and SEARCHRES (RFC 5182)
+
+            options = [ option.upper() for option in args[1] ] or [ 'ALL' ]
+            args = args[2:]
+
+        if args and not isinstance( args[0], list ) and args[0].upper() == 'CHARSET' :
+
+            args = args[2:]
+
+        keys = _searchKeys( args, self )
+
+        matches = [ ( seq, message ) for seq, message in enumerate( self.box.messages, 1 ) if _matches( keys, seq, message ) ]
+
+        numbers = [ byUid and message.uid or seq for seq, message in matches ]
+
+        if options is None :
+
+            self.untagged( 'SEARCH' + ''.join( ' ' + str( number ) for number in numbers ) )
+
+            return
+
+        if 'SAVE' in options :
+
+            self.saved = set( message.uid for seq, message in matches )
+
+            if len( options ) == 1 :		# Only SAVE: no ESEARCH response
+
+                return
+
+        data = []
+
+        if 'MIN' in options and numbers :	data.append( 'MIN ' + str( min( numbers ) ) )
+        if 'MAX' in options and numbers :	data.append( 'MAX ' + str( max( numbers ) ) )
+        if 'ALL' in options and numbers :	data.append( 'ALL ' + _compactSet( numbers ) )
+        if 'COUNT' in options :			data.append( 'COUNT ' + str( len( numbers ) ) )
+
+        self.untagged( 'ESEARCH (TAG "' + tag + '")' + ( byUid and ' UID' or '' ) + ''.join( ' ' + item for item in data ) )
+
+
+    def uidFETCH( self, tag, args, byUid ) :
+
+        items = args[1] if isinstance( args[1], list ) else [ args[1] ]
+        items = [ item.upper() for item in items ]
+
+        macros = { 'ALL': [ 'FLAGS', 'INTERNALDATE', 'RFC822.SIZE', 'ENVELOPE' ], 'FAST': [ 'FLAGS', 'INTERNALDATE', 'RFC822.SIZE' ], 'FULL': [ 'FLAGS', 'INTERNALDATE', 'RFC822.SIZE', 'ENVELOPE', 'BODY' ] }
+
+        if len( items ) == 1 and items[0] in macros :
+
+            items = macros[ items[0] ]
+
+        changedSince = None
+        vanished = False
+
+        if len( args ) > 2 :		# Modifiers, e.g. (CHANGEDSINCE 12345 VANISHED)
+
+            modifiers = [ modifier.upper() for modifier in args[2] ]
+
+            if 'CHANGEDSINCE' in modifiers :
+
+                changedSince = int( modifiers[ modifiers.index( 'CHANGEDSINCE' ) + 1 ] )
+
+                self.condstore = True
+
+            vanished = 'VANISHED' in modifiers
+
+            if vanished and not ( byUid and self.qresync and changedSince is not None ) :
+
+                raise _Bad( 'VANISHED requires UID FETCH, CHANGEDSINCE and QRESYNC' )
+
+        selected = self.select( args[0], byUid )
+
+        if vanished :
+
+            ranges = _parseSet( args[0], self.box.uidNext )
+
+            gone = [ uid for uid, modSeq in self.box.expunged if modSeq > changedSince and _inRanges( uid, ranges ) ]
+
+            if gone :
+
+                self.untagged( 'VANISHED (EARLIER) ' + _compactSet( gone ) )
+
+        for seq, message in selected :
+
+            if changedSince is not None and message.modSeq <= changedSince :
+
+                continue
+
+            parts = []
+
+            if byUid and not 'UID' in items :
+
+                parts.append( 'UID ' + str( message.uid ) )
+
+            bodies = []
+
+            for item in items :
+
+                if item == 'UID' :
+
+                    parts.append( 'UID ' + str( message.uid ) )
+
+                elif item == 'FLAGS' :
+
+                    parts.append( 'FLAGS (' + ' '.join( sorted( message.flags ) ) + ')' )
+
+                elif item == 'MODSEQ' :
+
+                    parts.append( 'MODSEQ (' + str( message.modSeq ) + ')' )
+
+                elif item == 'RFC822.SIZE' :
+
+                    parts.append( 'RFC822.SIZE ' + str( message.size ) )
+
+                elif item == 'INTERNALDATE' :
+
+                    parts.append( 'INTERNALDATE "' + _internalDate( message.date ) + '"' )
+
+                elif item.startswith( 'BODY' ) or item.startswith( 'RFC822' ) :
+
+                    bodies.append( item )
+
+                elif item != 'ENVELOPE' and item != 'BODY' :
+
+                    raise _Bad( 'Unknown FETCH item ' + item )
+
+            if ( changedSince is not None or self.condstore ) and not 'MODSEQ' in items :
+
+                parts.append( 'MODSEQ (' + str( message.modSeq ) + ')' )
+
+            if not bodies :
+
+                self.untagged( str( seq ) + ' FETCH (' + ' '.join( parts ) + ')' )
+
+                continue
+
+            response = '* ' + str( seq ) + ' FETCH (' + ''.join( part + ' ' for part in parts )
+
+            for item in bodies :		# Each section is sent as a literal
+
+                name, data = self.section( message, item )
+
+                response += name + ' {' + str( len( data ) ) + '}\r\n' + data + ' '
+
+            self.output.append( response[ :-1 ] + ')' )
+
+
+    def section( self, message, item ) :
+
+        '''
+        Returns the tuple ( name, data ) of the FETCH item 'item' (e.g. BODY.PEEK[HEADER.FIELDS (FROM SUBJECT)]) of 'message': the name of the item in the response and its contents. Fetching anything but a PEEK sets the \Seen flag (unless the folder is read-only).
+        '''
+
+        if item in ( 'RFC822', 'RFC822.HEADER', 'RFC822.TEXT' ) :
+
+            section = { 'RFC822': '', 'RFC822.HEADER': 'HEADER', 'RFC822.TEXT': 'TEXT' }[ item ]
+            name = item
+            peek = item == 'RFC822.HEADER'
+
+        else :
+
+            m = reBodySection.match( item )
+
+            if not m :
+
+                raise _Bad( 'Unknown FETCH item ' + item )
+
+            section = m.group(2).upper()
+            name = 'BODY[' + m.group(2) + ']'
+            peek = bool( m.group(1) )
+
+        if not peek and not self.readOnly and not '\\Seen' in message.flags :
+
+            message.flags.add( '\\Seen' )
+
+            self.box.highestModSeq += 1
+
+            message.modSeq = self.box.highestModSeq
+
+        if section == 'HEADER' :
+
+            return ( name, message.header )
+
+        if section == 'TEXT' :
+
+            return ( name, message.body() )
+
+        if section == '' :
+
+            return ( name, message.header + message.body() )
+
+        m = reHeaderFields.match( section )
+
+        if not m :
+
+            raise _Bad( 'Unknown section ' + section )
+
+        fields = set( field.lower() for field in m.group(2).split() )
+
+        lines = [ line for line in reHeaderLine.split( message.header ) if line and ( line.split( ':', 1 )[0].lower() in fields ) != bool( m.group(1) ) ]
+
+        return ( name, ''.join( line + '\r\n' for line in lines ) + '\r\n' )
+
+
+    def uidSTORE( self, tag, args, byUid ) :
+
+        if self.readOnly :
+
+            raise _No( 'Folder is read-only' )
+
+        if isinstance( args[1], list ) :		# Modifiers, e.g. (UNCHANGEDSINCE 12345), are ignored
+
+            args = args[ :1 ] + args[2:]
+
+        item = args[1].upper()
+        flags = args[2] if isinstance( args[2], list ) else args[2:]
+
+        silent = item.endswith( '.SILENT' )
+
+        for seq, message in self.select( args[0], byUid ) :
+
+            if item.startswith( '+' ) :
+
+                changed = message.flags | set( flags )
+
+            elif item.startswith( '-' ) :
+
+                changed = message.flags - set( flags )
+
+            else :
+
+                changed = set( flags )
+
+            if changed != message.flags :
+
+                message.flags = changed
+
+                self.box.highestModSeq += 1
+
+                message.modSeq = self.box.highestModSeq
+
+            if not silent :
+
+                self.untagged( str( seq ) + ' FETCH (' + ( byUid and 'UID ' + str( message.uid ) + ' ' or '' ) + 'FLAGS (' + ' '.join( sorted( message.flags ) ) + ')' + ( self.condstore and ' MODSEQ (' + str( message.modSeq ) + ')' or '' ) + ')' )
+
+
+    def uidCOPY( self, tag, args, byUid ) :
+
+        target = self.folder( args[1] )
+
+        selected = self.select( args[0], byUid )
+
+        if not selected :
+
+            return
+
+        uids = [ message.uid for seq, message in selected ]
+        copies = [ target.add( message.header, message.flags, message.size, message.date ).uid for seq, message in selected ]
+
+        if 'UIDPLUS' in self.server.capabilities.split() :
+
+            return '[COPYUID ' + str( target.uidValidity ) + ' ' + _compactSet( uids ) + ' ' + _compactSet( copies ) + '] Copied'
+
+
+    def uidMOVE( self, tag, args, byUid ) :
+
+        if self.readOnly :
+
+            raise _No( 'Folder is read-only' )
+
+        text = self.uidCOPY( tag, args, byUid )
+
+        if text :
+
+            self.untagged( 'OK ' + text.replace( ' Copied', ' Moved' ) )		# MOVE reports the COPYUID in an untagged response (RFC 6851)
+
+        self.expunge( [ message.uid for seq, message in self.select( args[0], byUid ) ] )
+
+
+    def uidEXPUNGE( self, tag, args, byUid ) :
+
+        if self.readOnly :
+
+            raise _No( 'Folder is read-only' )
+
+        uids = set( message.uid for seq, message in self.select( args[0], True ) )
+
+        self.expunge( [ message.uid for message in self.box.messages if '\\Deleted' in message.flags and message.uid in uids ] )
+
+
+    def expunge( self, uids, silent = False ) :
+
+        '''
+        Removes the emails with the UIDs 'uids' from the selected folder and reports them to the client (with EXPUNGE responses, or a single VANISHED response if QRESYNC is enabled). Other clients that have the folder selected are notified as well.
+        '''
+
+        if not uids :
+
+            return
+
+        uids = set( uids )
+        box = self.box
+
+        removed = []		# Sequence numbers as reported by successive EXPUNGE responses
+
+        remaining = []
+
+        for message in box.messages :
+
+            if message.uid in uids :
+
+                removed.append( len( remaining ) + 1 )
+
+                box.highestModSeq += 1
+
+                box.expunged.append( ( message.uid, box.highestModSeq ) )
+
+            else :
+
+                remaining.append( message )
+
+        box.messages = remaining
+
+        for session in list( self.server.sessions ) :
+
+            if session.box is not box or ( session is self and silent ) :
+
+                continue
+
+            if session.qresync :
+
+                lines = [ '* VANISHED ' + _compactSet( sorted( uids ) ) ]
+
+            else :
+
+                lines = [ '* ' + str( seq ) + ' EXPUNGE' for seq in removed ]
+
+            if session is self :
+
+                self.output += lines
+
+            else :
+
+                for line in lines :
+
+                    session.notify( line )
+
+
+
+def _tokenize( line ) :
+
+    '''
+    Splits a command line in to its arguments: atoms and (unquoted) quoted strings as strings, parenthesized lists as (nested) lists. A quoted string is returned as a _Quoted string so that it can be told apart from an atom.
+    '''
+
+    stack = [ [] ]
+
+    pos = 0
+
+    while pos < len( line ) :
+
+        m = reToken.match( line, pos )
+
+        if not m or m.end() == pos :
+
+            raise _Bad( 'Unable to parse command' )
+
+        pos = m.end()
+
+        quoted, opening, closing, atom = m.groups()
+
+        if quoted is not None :
+
+            stack[-1].append( _Quoted( re.sub( '\\\\(.)', '\\1', quoted ) ) )
+
+        elif opening :
+
+            stack.append( [] )
+
+        elif closing :
+
+            if len( stack ) == 1 :
+
+                raise _Bad( 'Unbalanced parentheses' )
+
+            inner = stack.pop()
+
+            stack[-1].append( inner )
+
+        elif atom :
+
+            stack[-1].append( atom )
+
+    if len( stack ) != 1 :
+
+        raise _Bad( 'Unbalanced parentheses' )
+
+    return stack[0]
+
+
+
+class _Quoted( str ) :		# A quoted string argument (see _tokenize())
+
+    pass
+
+
+
+def _string( token ) :
+
+    if isinstance( token, list ) :
+
+        raise _Bad( 'Expected a string' )
+
+    return str( token )
+
+
+
+def _quote( string ) :
+
+    return '"' + string.replace( '\\', '\\\\' ).replace( '"', '\\"' ) + '"'
+
+
+
+def _statusItems( box, items ) :
+
+    '''
+    Returns the data of a STATUS response (e.g. 'MESSAGES 20 UNSEEN 3') for the fakeFolder 'box' and the list of items requested.
+    '''
+
+    values = { 'MESSAGES': len( box.messages ), 'RECENT': 0, 'UIDNEXT': box.uidNext, 'UIDVALIDITY': box.uidValidity, 'UNSEEN': box.unseen(), 'HIGHESTMODSEQ': box.highestModSeq }
+
+    return ' '.join( item.upper() + ' ' + str( values[ item.upper() ] ) for item in items )
+
+
+
+def _parseSet( setString, largest ) :
+
+    '''
+    Parses a sequence set or UID set (e.g. '1:3,7,10:*') in to a list of ( low, high ) ranges. '*' stands for 'largest'.
+    '''
+
+    ranges = []
+
+    for part in setString.split( ',' ) :
+
+        ends = [ largest if end == '*' else int( end ) for end in part.split( ':' ) ]
+
+        ranges.append( ( min( ends ), max( ends ) ) )
+
+    return ranges
+
+
+
+def _inRanges( number, ranges ) :
+
+    for low, high in ranges :
+
+        if low <= number <= high :
+
+            return True
+
+    return False
+
+
+
+def _compactSet( numbers ) :
+
+    '''
+    Returns the list of integers 'numbers' (in ascending order) as a compact set e.g. '1:3,7'.
+    '''
+
+    parts = []
+
+    for number in numbers :
+
+        if parts and parts[-1][1] == number - 1 :
+
+            parts[-1][1] = number
+
+        else :
+
+            parts.append( [ number, number ] )
+
+    return ','.join( str( low ) if low == high else str( low ) + ':' + str( high ) for low, high in parts )
+
+
+
+def _internalDate( date ) :
+
+    t = time.gmtime( date )
+
+    return '%02d-%s-%04d %02d:%02d:%02d +0000' % ( t.tm_mday, months[ t.tm_mon - 1 ], t.tm_year, t.tm_hour, t.tm_min, t.tm_sec )
+
+
+
+def _parseDate( string ) :
+
+    '''
+    Parses a SEARCH date (e.g. 1-Jan-2013) in to the seconds since the epoch of the start of that day (UTC).
+    '''
+
+    import calendar
+
+    day, month, year = _string( string ).split( '-' )
+
+    return calendar.timegm( ( int( year ), months.index( month.capitalize() ) + 1, int( day ), 0, 0, 0 ) )
+
+
+
+def _searchKeys( args, session ) :
+
+    '''
+    Parses the SEARCH criteria 'args' (tokens) in to a list of predicates, each a function of ( sequence number, fakeMessage ). An email matches if all of the predicates are true.
+    '''
+
+    keys = []
+
+    args = list( args )
+
+    while args :
+
+        keys.append( _searchKey( args, session ) )
+
+    return keys
+
+
+
+def _searchKey( args, session ) :
+
+    '''
+    Removes a single search key (with its arguments) from the front of the list of tokens 'args' and returns its predicate (see _searchKeys()).
+    '''
+
+    token = args.pop(0)
+
+    if isinstance( token, list ) :
+
+        keys = _searchKeys( token, session )
+
+        return lambda seq, message : _matches( keys, seq, message )
+
+    key = token.upper()
+
+    flagKeys = { 'SEEN': '\\Seen', 'DELETED': '\\Deleted', 'FLAGGED': '\\Flagged', 'ANSWERED': '\\Answered', 'DRAFT': '\\Draft' }
+
+    if key == 'ALL' :
+
+        return lambda seq, message : True
+
+    if key in flagKeys :
+
+        return lambda seq, message : flagKeys[ key ] in message.flags
+
+    if key.startswith( 'UN' ) and key[2:] in flagKeys :
+
+        return lambda seq, message : not flagKeys[ key[2:] ] in message.flags
+
+    if key in ( 'NEW', 'RECENT', 'OLD' ) :		# Nothing is ever recent
+
+        return lambda seq, message : key == 'OLD'
+
+    if key == 'NOT' :
+
+        inner = _searchKey( args, session )
+
+        return lambda seq, message : not inner( seq, message )
+
+    if key == 'OR' :
+
+        first = _searchKey( args, session )
+        second = _searchKey( args, session )
+
+        return lambda seq, message : first( seq, message ) or second( seq, message )
+
+    if key == 'UID' :
+
+        setString = _string( args.pop(0) )
+
+        if setString == '$' :
+
+            saved = set( session.saved )
+
+            return lambda seq, message : message.uid in saved
+
+        ranges = _parseSet( setString, session.box.messages and session.box.messages[-1].uid or 0 )
+
+        return lambda seq, message : _inRanges( message.uid, ranges )
+
+    if key[0].isdigit() or key[0] == '*' or key == '$' :		# A sequence set
+
+        if key == '$' :
+
+            saved = set( session.saved )
+
+            return lambda seq, message : message.uid in saved
+
+        ranges = _parseSet( key, len( session.box.messages ) )
+
+        return lambda seq, message : _inRanges( seq, ranges )
+
+    if key in ( 'SINCE', 'SENTSINCE' ) :
+
+        day = _parseDate( args.pop(0) )
+
+        return lambda seq, message : message.date >= day
+
+    if key in ( 'BEFORE', 'SENTBEFORE' ) :
+
+        day = _parseDate( args.pop(0) )
+
+        return lambda seq, message : message.date < day
+
+    if key in ( 'ON', 'SENTON' ) :
+
+        day = _parseDate( args.pop(0) )
+
+        return lambda seq, message : day <= message.date < day + 86400
+
+    if key == 'LARGER' :
+
+        size = int( args.pop(0) )
+
+        return lambda seq, message : message.size > size
+
+    if key == 'SMALLER' :
+
+        size = int( args.pop(0) )
+
+        return lambda seq, message : message.size < size
+
+    if key in ( 'FROM', 'TO', 'CC', 'BCC', 'SUBJECT', 'HEADER' ) :
+
+        field = key.lower() if key != 'HEADER' else _string( args.pop(0) ).lower()
+        value = _string( args.pop(0) ).lower()
+
+        return lambda seq, message : value in _headerField( message.header, field ).lower()
+
+    if key in ( 'BODY', 'TEXT' ) :
+
+        value = _string( args.pop(0) ).lower()
+
+        return lambda seq, message : value in ( key == 'TEXT' and message.header.lower() or '' ) or value in message.body().lower()
+
+    if key == 'MODSEQ' :
+
+        while len( args ) > 1 and not args[0].isdigit() :		# Optional entry name and type
+
+            args.pop(0)
+
+        modSeq = int( args.pop(0) )
+
+        return lambda seq, message : message.modSeq >= modSeq
+
+    raise _Bad( 'Unknown search key ' + key )
+
+
+
+def _matches( keys, seq, message ) :
+
+    for key in keys :
+
+        if not key( seq, message ) :
+
+            return False
+
+    return True
+
+
+
+def _headerField( header, field ) :
+
+    '''
+    Returns the value of the header field 'field' (lower case) of the raw header 'header', or an empty string.
+    '''
+
+    for line in reHeaderLine.split( header ) :
+
+        name, sep, value = line.partition( ':' )
+
+        if sep and name.lower() == field :
+
+            return value.strip()
+
+    return ''
+
+
+
+def main() :
+
+    '''
+    Runs a fakeImapServer from the command line until interrupted.
+    '''
+
+    import argparse
+
+    parser = argparse.ArgumentParser( description = "A stand-in IMAP server holding synthetic emails, for testing and benchmarking fetchheaders without a live server. The accounts are named user1, user2, ... and share a password." )
+
+    parser.add_argument( "-p", "--port", help = "The port to listen on (default 1143).", type = int, default = 1143 )
+    parser.add_argument( "--host", help = "The address to listen on (default 127.0.0.1).", default = '127.0.0.1' )
+    parser.add_argument( "-a", "--accounts", help = "The number of accounts (default 1).", type = int, default = 1 )
+    parser.add_argument( "-m", "--messages", help = "The number of emails in each folder (default 100).", type = int, default = 100 )
+    parser.add_argument( "-f", "--folders", help = "Comma-separated list of the folders of each account that are filled with emails (default INBOX).", default = 'INBOX' )
+    parser.add_argument( "--unseen", help = "The fraction of the emails that are unseen (default 0.3).", type = float, default = 0.3 )
+    parser.add_argument( "--password", help = "The password of every account (default 'secret').", default = 'secret' )
+    parser.add_argument( "--capabilities", help = "The capabilities advertised (default '" + defaultCapabilities + "').", default = defaultCapabilities )
+    parser.add_argument( "--latency", help = "Seconds added to every round trip.", type = float, default = 0 )
+    parser.add_argument( "--bandwidth", help = "Maximum number of bytes per second sent to each client (0 means no limit).", type = int, default = 0 )
+    parser.add_argument( "--slow", help = "A command whose response is delayed, as COMMAND=SECONDS (e.g. 'UID FETCH=0.5'). May be repeated.", action = "append", default = [] )
+    parser.add_argument( "--fail", help = "A command which fails, as COMMAND=NO|BAD|BYE (e.g. LOGIN=NO). May be repeated.", action = "append", default = [] )
+    parser.add_argument( "--failRate", help = "The probability that any other command fails with a NO response.", type = float, default = 0 )
+    parser.add_argument( "--certfile", help = "A PEM file holding the certificate and private key of the server. If given the connections use SSL." )
+
+    args = parser.parse_args()
+
+    accounts = seedAccounts( args.accounts, args.messages, args.folders.split( ',' ), args.unseen, args.password )
+
+    server = fakeImapServer( accounts, ( args.host, args.port ), capabilities = args.capabilities, latency = args.latency, bandwidth = args.bandwidth, slowCommands = parseOptions( args.slow, float ), failCommands = parseOptions( args.fail, str ), failRate = args.failRate, certfile = args.certfile )
+
+    print( 'Serving ' + str( args.accounts ) + ' accounts (' + ', '.join( sorted( accounts )[:3] ) + ( args.accounts > 3 and ', ...' or '' ) + ') on ' + args.host + ':' + str( server.port ) )
+
+    try :
+        server.serveForever()
+
+    except KeyboardInterrupt :
+
+        pass
+
+
+
+def parseOptions( lstOptions, convert ) :
+
+    '''
+    Parses a list of strings of the form 'KEY=VALUE' (e.g. the --slow and --fail arguments) in to a dictionary, with the values converted using the function 'convert'.
+    '''
+
+    output = {}
+
+    for option in lstOptions :
+
+        key, sep, value = option.rpartition( '=' )
+
+        if not sep :
+
+            raise ValueError( 'Expected KEY=VALUE: ' + option )
+
+        output[ key.strip().upper() ] = convert( value.strip() )
+
+    return output
+
+
+
+if __name__ == '__main__' :
+
+    main()
@@ -0,0 +1,548 @@
+# Copyright 2012 Abid Hasan Mujtaba
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Author: Abid H. Mujtaba
+# Email: abid.naqvi83@gmail.com
+#
+# This file implements the daemon mode of fetchheaders (fetchheaders.py --daemon). Most of the time taken to poll an account is spent establishing the (SSL) connection and logging in. The daemon keeps one authenticated imapServer per account alive between polls (sending a NOOP every so often so that the server doesn't drop it, and reconnecting when it does) and listens on a local Unix socket.
+#
+# Whenever fetchheaders.py is run it checks whether a daemon is listening on the socket (see pollAccounts() in miscClasses). If so it sends the daemon its (JSON encoded) dictionary of accounts and the daemon polls them over its existing connections, sending back the (JSON encoded) Output objects as each account completes. The socket and the folder containing it are only accessible to the user running the daemon, and fetchheaders.py refuses to use a socket that isn't (see connectDaemon()), since the request carries the passwords of the accounts.
+
+
+import threading
+import SocketServer
+
+
+class pooledConnection :
+
+    '''
+    An authenticated imapServer connection to a single account that is kept open between polls. All use of the connection is serialized by a lock so that the keep-alive thread and simultaneous requests for the same account never interleave their commands.
+    '''
+
+    def __init__( self, account ) :
+
+        '''
+        account: <DIC> The settings associated with the account. Used to connect and login.
+        '''
+
+        self.account = account
+        self.mail = None		# The imapServer object. None when not connected.
+
+        self.lock = threading.Lock()
+
+        self.lastUsed = 0		# Time at which the server last responded to a command
+
+
+    def connect( self, stats = None ) :
+
+        '''
+        Establishes the connection and logs in (replacing the previous connection, if any). Returns True on success. Must be called with the lock held.
+
+        stats: The pollStats object of the poll that requires the connection (if statistics were requested) so that connecting and logging in are accounted for.
+        '''
+
+        from imapServer import imapServer
+        import time
+
+        account = self.account
+
+        self.mail = None
+
+        mail = imapServer( account['host'], account['useSSL'], account.get( 'connectTimeout' ), account.get( 'readTimeout' ), stats )
+
+        if not mail.login( account['username'], account['password'] ) :
+
+            return False
+
+        if account.get( 'useCache' ) :		# ENABLE must be sent before a folder is examined so we enable CONDSTORE (if available) once, for every subsequent poll
+
+            mail.enableCondstore()
+
+        self.mail = mail
+        self.lastUsed = time.time()
+
+        return True
+
+
+    def disconnect( self ) :
+
+        '''
+        Logs out of the server (if connected). Must be called with the lock held.
+        '''
+
+        if self.mail :
+
+            self.mail.logout()
+
+        self.mail = None
+
+
+    def poll( self, account ) :
+
+        '''
+        Polls the account over the pooled connection and returns the list of Output objects of its folders. 'account' carries the settings for this particular poll (which may differ from those the connection was established with in what is to be displayed, but not in the server, username or password).
+
+        If the poll fails the connection is presumed lost (e.g. dropped by the server since the last keep-alive) so it is re-established and the poll is attempted once more.
+        '''
+
+        from asyncImapServer import runSync
+        from miscClasses import Output, _pollFolders, newStats
+        import time
+
+        outs = None
+
+        stats = newStats( account )
+
+        with self.lock :
+
+            for attempt in range( 2 ) :
+
+                if self.mail is None and not self.connect( stats ) :
+
+                    continue
+
+                self.mail.collectStats( stats )
+
+                try :
+                    outs = runSync( _pollFolders( account, self.mail ) )
+
+                except Exception :		# Raised when the connection drops in the middle of the poll
+
+                    outs = None
+
+                finally :
+                    self.mail.collectStats( None )		# The statistics of this poll must not be added to by the keep-alives (or the next poll)
+
+                if outs and not [ out for out in outs if out.error ] :
+
+                    self.lastUsed = time.time()
+
+                    return outs
+
+                self.mail = None		# Reconnect for the next attempt
+
+
+        if outs :		# Some of the folders couldn't be read (e.g. a folder that doesn't exist). The errors are displayed along with the folders that could be.
+
+            return outs
+
+        out = Output( account )
+
+        out.error = True
+        out.reason = 'Unable to poll account from the daemon'
+
+        return [ out ]
+
+
+    def keepAlive( self, interval ) :
+
+        '''
+        Sends a NOOP to the server if the connection has been idle for at least 'interval' seconds. If the server doesn't respond the connection is re-established straight away, so that the next poll doesn't have to wait for it. A connection that is busy is by definition alive and is skipped.
+        '''
+
+        import time
+
+        if not self.lock.acquire( False ) :
+
+            return
+
+        try :
+            if time.time() - self.lastUsed < interval :
+
+                return
+
+            if self.mail and self.mail.noop() :
+
+                self.lastUsed = time.time()
+
+            else :
+
+                self.connect()
+
+        finally :
+            self.lock.release()
+
+
+
+class fetchDaemon :
+
+    '''
+    Holds the pool of connections (one per account) and polls accounts using them.
+    '''
+
+    def __init__( self, settings ) :
+
+        '''
+        settings: <DIC> The global settings. 'maxThreads' and 'pollTimeout' are used for polling and 'keepAlive' is the interval (in seconds) at which idle connections are sent a NOOP.
+        '''
+
+        self.settings = settings
+
+        self.pool = {}		# pooledConnection objects keyed by account name
+        self.lock = threading.Lock()
+
+
+    def connection( self, account ) :
+
+        '''
+        Returns the pooledConnection for the account, creating it if necessary. If the server or credentials of the account have changed since the connection was created it is replaced.
+        '''
+
+        identity = [ account[ key ] for key in [ 'host', 'username', 'password', 'useSSL' ] ]
+
+        with self.lock :
+
+            conn = self.pool.get( account[ 'name' ] )
+
+            if conn is None or [ conn.account[ key ] for key in [ 'host', 'username', 'password', 'useSSL' ] ] != identity :
+
+                conn = pooledConnection( account )
+
+                self.pool[ account[ 'name' ] ] = conn
+
+            return conn
+
+
+    def poll( self, servers ) :
+
+        '''
+        Polls all of the accounts in 'servers' over the pooled connections. A generator that yields the Output objects in the order in which the accounts complete (see threadedExec()).
+        '''
+
+        from miscClasses import threadedExec
+
+        return threadedExec( servers, self.settings[ 'maxThreads' ], self.settings.get( 'pollTimeout' ), lambda account : self.connection( account ).poll( account ) )
+
+
+    def keepAlive( self ) :
+
+        '''
+        Runs forever (in its own thread) sending NOOPs to idle connections.
+        '''
+
+        import time
+
+        interval = self.settings[ 'keepAlive' ]
+
+        while True :
+
+            time.sleep( max( 1, interval / 4 ) )		# An idle connection receives its NOOP at most a quarter of the interval late
+
+            with self.lock :
+
+                connections = self.pool.values()
+
+            for conn in connections :
+
+                conn.keepAlive( interval )
+
+
+
+class _requestHandler( SocketServer.StreamRequestHandler ) :
+
+    '''
+    Handles a single request from fetchheaders.py: A line containing the JSON encoded dictionary of accounts to be polled. The Output object of each account is sent back as soon as it is available, as a line containing its JSON encoding (see _dumpOutput()).
+    '''
+
+    def handle( self ) :
+
+        import json, socket
+
+        try :
+            servers = _encode( json.loads( self.rfile.readline() ) )
+
+        except ValueError :
+
+            print( 'Ignoring malformed request.' )
+            return
+
+        try :
+            for out in self.server.daemon.poll( servers ) :
+
+                self.wfile.write( json.dumps( _dumpOutput( out ) ) + '\n' )
+
+        except socket.error :		# The client has gone away
+
+            pass
+
+
+
+class _unixServer( SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer ) :
+
+    daemon_threads = True		# Requests still being handled must not prevent the daemon from exiting
+
+
+
+def _encode( data ) :
+
+    '''
+    json.loads() returns unicode strings. The rest of the program expects the settings to be byte strings (as read by ConfigObj) so we encode them (recursively).
+    '''
+
+    if isinstance( data, dict ) :
+
+        return dict( ( _encode( key ), _encode( value ) ) for key, value in data.items() )
+
+    if isinstance( data, list ) :
+
+        return [ _encode( x ) for x in data ]
+
+    if isinstance( data, unicode ) :
+
+        return data.encode( 'utf-8' )
+
+    return data
+
+
+
+def _isPrivate( path ) :
+
+    '''
+    Returns True if the file (or folder) 'path' belongs to the current user and is inaccessible to the group and others.
+    '''
+
+    import os, stat
+
+    info = os.stat( path )
+
+    return info.st_uid == os.getuid() and not info.st_mode & ( stat.S_IRWXG | stat.S_IRWXO )
+
+
+
+def _dumpOutput( out ) :
+
+    '''
+    Returns the Output object 'out' as a dictionary that can be encoded as JSON. Each email is stored as the list [uid, Seen, Date, Timestamp, From, Subject] (the members set when polling) to keep the response compact.
+    '''
+
+    return { 'settings' : out.settings,
+            'emails' : [ [ email.uid, email.Seen, email.Date, email.Timestamp, email.From, email.Subject ] for email in out.emails ],
+            'uids' : out.uids.tolist(),
+            'older' : out.older.tolist(),
+            'numAll' : out.numAll,
+            'numUnseen' : out.numUnseen,
+            'numDigits' : out.numDigits,
+            'error' : out.error,
+            'reason' : out.reason,
+            'stats' : out.stats and [ out.stats.phases, out.stats.bytesSent, out.stats.bytesReceived, out.stats.roundTrips ] }
+
+
+
+def _loadOutput( data ) :
+
+    '''
+    Recreates the Output object dumped by _dumpOutput(). The sender and subject of the emails are kept as unicode (as they are when polled) while the remaining strings are encoded (see _encode()).
+    '''
+
+    from miscClasses import Output, Email
+    from pollStats import pollStats
+
+    out = Output( _encode( data[ 'settings' ] ) )
+
+    for uid, seen, date, timestamp, sender, subject in data[ 'emails' ] :
+
+        email = Email()
+
+        email.uid = _encode( uid )
+        email.Seen = seen
+        email.Date = _encode( date )
+        email.Timestamp = _encode( timestamp )
+        email.From = sender
+        email.Subject = subject
+
+        out.emails.append( email )
+
+    out.uids.fromlist( data[ 'uids' ] )
+    out.older.fromlist( data[ 'older' ] )
+
+    out.numAll = data[ 'numAll' ]
+    out.numUnseen = data[ 'numUnseen' ]
+    out.numDigits = data[ 'numDigits' ]
+    out.error = data[ 'error' ]
+    out.reason = _encode( data[ 'reason' ] )
+
+    if data[ 'stats' ] :
+
+        out.stats = pollStats()
+
+        out.stats.phases, out.stats.bytesSent, out.stats.bytesReceived, out.stats.roundTrips = _encode( data[ 'stats' ] )
+
+    return out
+
+
+
+def runDaemon( servers, settings ) :
+
+    '''
+    Runs the daemon until it is interrupted. The accounts in 'servers' are connected to (in parallel) straight away so that the very first poll is already fast. settings[ 'daemonSocket' ] is the path of the Unix socket to listen on.
+    '''
+
+    import os, signal
+
+    path = os.path.expanduser( settings[ 'daemonSocket' ] )
+
+    if connectDaemon( path ) :
+
+        print( 'A daemon is already listening on ' + path )
+        return
+
+    if os.path.exists( path ) :		# Left behind by a daemon that didn't exit cleanly
+
+        os.remove( path )
+
+    folder = os.path.dirname( path )
+
+    if folder and not os.path.isdir( folder ) :
+
+        os.makedirs( folder, 0700 )
+
+    elif folder and os.stat( folder ).st_uid == os.getuid() :		# Created by an older version (or by the header cache, which shares the folder by default) with the default permissions
+
+        os.chmod( folder, 0700 )
+
+    if not _isPrivate( folder or '.' ) :
+
+        print( 'Refusing to listen on ' + path + ' since its folder belongs to (or is accessible to) other users.' )
+        return
+
+
+    daemon = fetchDaemon( settings )
+
+    oldMask = os.umask( 0177 )		# The socket is created accessible to the current user only (it carries account passwords)
+
+    try :
+        server = _unixServer( path, _requestHandler )
+
+    finally :
+        os.umask( oldMask )
+
+    server.daemon = daemon
+
+
+    from miscClasses import runTasks
+
+    def connect( account ) :
+
+        conn = daemon.connection( account )
+
+        with conn.lock :
+
+            if not conn.connect() :
+
+                print( 'Unable to connect to account ' + account[ 'name' ] + '. Will retry when it is next polled.' )
+
+    for result in runTasks( connect, [ servers[ account ] for account in servers ], settings[ 'maxThreads' ], settings.get( 'pollTimeout' ) ) :
+
+        pass
+
+
+    keeper = threading.Thread( target = daemon.keepAlive )
+    keeper.daemon = True
+    keeper.start()
+
+    def stop( signum, frame ) :
+
+        raise SystemExit
+
+    signal.signal( signal.SIGTERM, stop )		# The daemon is stopped with Ctrl-C or kill, either way cleaning up after itself
+    signal.signal( signal.SIGINT, stop )
+
+    print( 'Listening on ' + path )
+
+    try :
+        server.serve_forever()
+
+    except SystemExit :
+
+        pass
+
+    finally :
+        server.server_close()
+        os.remove( path )
+
+        for conn in daemon.pool.values() :
+
+            if conn.lock.acquire( False ) :
+
+                conn.disconnect()
+
+
+
+def connectDaemon( path ) :
+
+    '''
+    Returns a socket connected to the daemon listening on 'path' or None if there is no such daemon.
+
+    The accounts (and their passwords) are only sent to a daemon run by the current user. None is returned (and the accounts are polled without the daemon) if the socket or its folder belong to another user or are accessible to other users, since anyone able to replace the socket could then read the passwords.
+    '''
+
+    import os, socket
+
+    path = os.path.expanduser( path )
+
+    if not os.path.exists( path ) :
+
+        return None
+
+    if not ( _isPrivate( path ) and _isPrivate( os.path.dirname( path ) or '.' ) ) :
+
+        print( 'Ignoring the daemon socket ' + path + ' since it (or its folder) belongs to or is accessible to other users.' )
+        return None
+
+    sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+
+    try :
+        sock.connect( path )
+
+    except socket.error :
+
+        sock.close()
+        return None
+
+    return sock
+
+
+
+def daemonExec( sock, servers ) :
+
+    '''
+    The daemon counterpart of threadedExec(): sends the dictionary of accounts to the daemon connected to by 'sock' and yields the Output objects sent back by it in the order in which the accounts complete.
+    '''
+
+    import json, socket
+
+    try :
+        sock.sendall( json.dumps( servers ) + '\n' )
+
+        response = sock.makefile( 'rb' )
+
+        stats = {}		# The pollStats object of each account (see below)
+
+        for line in response :		# The daemon closes the connection once all accounts have been polled
+
+            out = _loadOutput( json.loads( line ) )
+
+            if out.stats is not None :		# The folders of an account share a single pollStats object in the daemon but each is sent with its own copy. They are made to share it again.
+
+                out.stats = stats.setdefault( out.settings.get( 'account', out.settings[ 'name' ] ), out.stats )
+
+            yield out
+
+    except ( socket.error, ValueError ) :		# ValueError: A truncated response
+
+        print( 'Lost connection with the daemon.' )
+
+    finally :
+        sock.close()
@@ -29,18 +29,44 @@
 	username = string( default = None )
 	password = string( default = None )
 	showUnseen = boolean( default = True )
-	folder = string( default = 'INBOX' )
+	folder = force_list( default = list( 'INBOX', ) )
 	latestEmailFirst = boolean( default = True )
 	showNums = boolean( default = True )
 	showOnlyNums = boolean( default = False )
 	trashFolder = string( default = 'Trash' )
 	deleteEmails = boolean( default = True )
 	useSSL = boolean( default = True )
+	useCache = boolean( default = True )
+	cacheFolder = string( default = '~/.fetchheaders' )
+	limit = integer( default = 0 )
+
+	searchSince = string( default = None )
+	searchFrom = string( default = None )
+	searchSubject = string( default = None )
+	searchLarger = integer( default = None )
+	search = string( default = None )
 
 
 [global]
 	
 	maxThreads = integer( default = 5 )
+
+	useAsync = boolean( default = False )
+	maxConnections = integer( default = 50 )
+
+	connectTimeout = integer( default = 30 )
+	readTimeout = integer( default = 60 )
+	pollTimeout = integer( default = 300 )
+
+	daemonSocket = string( default = '~/.fetchheaders/daemon.sock' )
+	keepAlive = integer( default = 240 )
+
+	idleTimeout = integer( default = 1740 )
+	pollInterval = integer( default = 60 )
+
+	headerCacheSize = integer( default = 10000 )
+
+	parseProcesses = integer( default = 0 )
 	
 	color = boolean( default = True )
 	colorTitle = string( default = 'blue' )
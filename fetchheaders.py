@@ -33,6 +33,19 @@ import re
 
 maxThreads = 5		# This value will be over-written by the global default and possibly a command-line argument
 
+useAsync = False		# When True the accounts are polled using an asynchronous event loop rather than threads
+maxConnections = 50		# Maximum number of accounts polled concurrently by the asynchronous event loop
+
+parseProcesses = 0		# Number of processes that parse the headers of large folders (0 means they are parsed by the polling threads themselves)
+
+pollTimeout = None		# Number of seconds after which the polling of an account is abandoned (None means never)
+
+daemonSocket = None		# Path of the Unix socket a daemon (see fetchDaemon) listens on. None means the accounts are always polled directly.
+keepAlive = 240			# Interval (in seconds) at which the daemon sends a NOOP to idle connections
+
+idleTimeout = 1740		# Interval (in seconds) at which IDLE is restarted in watch mode
+pollInterval = 60		# Interval (in seconds) at which servers that don't support IDLE are checked in watch mode
+
 colorTitle = None
 colorFlag = None
 colorFrom = None
@@ -41,6 +54,8 @@ colorSubjectSeen = None
 colorSubjectUnseen = None
 showFlags = None
 
+renderer = None		# The textRenderer that displays the accounts in terminal mode (see compileRenderer())
+
 
 
 def setOptions( configFile, configSpecFile ) :
@@ -128,6 +143,15 @@ def setOptions( configFile, configSpecFile ) :
         globalSettings[ key ] = config[ 'global' ][ key ]
 
 
+    # The connection timeouts are global settings but they are needed by pollAccount() and deleteEmails() which only have access to the dictionary of the account. So we copy them in to each account. A value of 0 means no timeout (None).
+
+    for account in servers :
+
+        for key in [ 'connectTimeout', 'readTimeout' ] :
+
+            servers[ account ][ key ] = globalSettings[ key ] or None
+
+
     return servers, globalSettings
 
 
@@ -168,8 +192,40 @@ def argParse() :
 
     parser.add_argument( "-t", "--threads", help = "Specify the maximum number of parallel threads the program will use to simultaneously access IMAP servers. Set to 1 for serial (non-parallel) behaviour.", type = int)
 
+    parser.add_argument( "--async", help = "Flag: Poll all accounts concurrently from a single thread using an asynchronous event loop instead of a pool of threads. Recommended when polling a very large number of accounts.", action = "store_true", dest = "useAsync" )
+
+    parser.add_argument( "--maxConnections", help = "Specify the maximum number of accounts that are polled simultaneously when --async is used.", type = int )
+
+    parser.add_argument( "--parseProcesses", help = "Specify the number of processes that parse the headers of large folders in parallel (see parseProcesses in the configuration file). 0 means the headers are parsed by the threads polling the accounts.", type = int )
+
+    parser.add_argument( "--timeout", help = "Specify the number of seconds after which the polling of an account is abandoned and reported as an error. 0 means never.", type = int )
+
+    parser.add_argument( "--daemon", help = "Flag: Run as a daemon which keeps an authenticated connection to every account open and listens on a local socket (daemonSocket in the configuration file). Subsequent invocations of the program have their accounts polled by the daemon, which is much faster.", action = "store_true" )
+
+    parser.add_argument( "--noDaemon", help = "Flag: Poll the accounts directly even if a daemon is running.", action = "store_true" )
+
+    parser.add_argument( "--watch", help = "Flag: Keep running after the accounts have been polled and update the display as soon as emails arrive, are deleted or are read (using IMAP IDLE). Press Ctrl-C to exit in terminal mode.", action = "store_true" )
+
+    parser.add_argument( "--max", help = "Only fetch the headers of the newest MAX emails of each account. 0 means no limit. In the urwid display older emails are fetched a page at a time when scrolled to.", type = int, dest = "limit" )
+
+    parser.add_argument( "--since", help = "Only show emails received since the specified date (e.g. 1-Jan-2013) or in the specified number of days (e.g. 7). The filtering is carried out by the server.", dest = "searchSince" )
+
+    parser.add_argument( "--from", help = "Only show emails whose From header contains the specified string (case-insensitive).", dest = "searchFrom" )
+
+    parser.add_argument( "--subject", help = "Only show emails whose Subject contains the specified string (case-insensitive).", dest = "searchSubject" )
+
+    parser.add_argument( "--larger", help = "Only show emails larger than the specified number of bytes.", type = int, dest = "searchLarger" )
+
+    parser.add_argument( "--search", help = "Only show emails matching the specified raw IMAP SEARCH criteria (e.g. 'FLAGGED NOT FROM noreply'). Combined with the other filters." )
+
+    parser.add_argument( "--noCache", help = "Flag: Do NOT use the on-disk header cache. The headers of all emails are fetched from the server (and the cache is left untouched).", action = "store_true" )
+
     parser.add_argument( "-T", "--terminal", help = "Flag: Show results in the terminal. Do NOT use urwid.", action = "store_true" )
 
+    parser.add_argument( "--format", help = "Write the accounts and their emails to stdout in a machine readable format (one record per line) instead of displaying them: json, ndjson (one JSON object per line) or csv. Implies -T. Each account is written as soon as it has been polled. See recordWriter.py for the fields of the records.", choices = [ "text", "json", "ndjson", "csv" ], default = "text" )
+
+    parser.add_argument( "--stats", help = "Print the time spent in each phase of polling every account (connecting, logging in, each IMAP command, parsing, caching and displaying) along with the number of round trips and bytes exchanged with its server. The statistics are printed to stderr once all accounts have been displayed (once urwid exits in urwid mode), either as text (the default) or as JSON.", nargs = "?", const = "text", choices = [ "text", "json" ] )
+
 
     # Begin reading in arguments and validate them:
 
@@ -270,7 +326,7 @@ def applyArgs( args, servers, globalSettings ) :
 
     # -T, --terminal. If specified the output is displayed on the terminal (stdout) and 'urwid' is NOT used.
 
-    if args.terminal:
+    if args.terminal or args.format != 'text' :		# Machine readable output is always written to stdout
 
         globalSettings[ 'terminal' ] = True
 
@@ -312,6 +368,44 @@ def applyArgs( args, servers, globalSettings ) :
         globalSettings[ 'showFlags' ] = True
 
 
+    # --stats. Collect the statistics of polling each account.
+
+    if args.stats :
+
+        for account in servers.keys() :
+
+            servers[ account ][ 'stats' ] = True
+
+
+    # --noCache. Do NOT use the on-disk header cache.
+
+    if args.noCache :
+
+        for account in servers.keys() :
+
+            servers[ account ][ 'useCache' ] = False
+
+
+    # --max. Only fetch the headers of the newest emails.
+
+    if args.limit is not None :
+
+        for account in servers.keys() :
+
+            servers[ account ][ 'limit' ] = args.limit
+
+
+    # --since, --from, --subject, --larger, --search. Filters applied by the server to the emails of every account (see searchFilter() in miscClasses).
+
+    for key in [ 'searchSince', 'searchFrom', 'searchSubject', 'searchLarger', 'search' ] :
+
+        if getattr( args, key ) is not None :
+
+            for account in servers.keys() :
+
+                servers[ account ][ key ] = getattr( args, key )
+
+
     # -t, --threads. Set max. number of parallel threads.
 
     if args.threads :
@@ -319,6 +413,41 @@ def applyArgs( args, servers, globalSettings ) :
         globalSettings[ 'maxThreads' ] = args.threads
 
 
+    # --async. Poll accounts using the asynchronous event loop.
+
+    if args.useAsync :
+
+        globalSettings[ 'useAsync' ] = True
+
+
+    # --maxConnections. Set max. number of accounts polled simultaneously by the asynchronous event loop.
+
+    if args.maxConnections :
+
+        globalSettings[ 'maxConnections' ] = args.maxConnections
+
+
+    # --parseProcesses. Set the number of processes that parse headers.
+
+    if args.parseProcesses is not None :
+
+        globalSettings[ 'parseProcesses' ] = args.parseProcesses
+
+
+    # --timeout. Set the number of seconds after which the polling of an account is abandoned.
+
+    if args.timeout is not None :
+
+        globalSettings[ 'pollTimeout' ] = args.timeout
+
+
+    # --noDaemon. Don't use the daemon even if one is running.
+
+    if args.noDaemon :
+
+        globalSettings[ 'daemonSocket' ] = None
+
+
 
     return servers, globalSettings
 
@@ -337,6 +466,51 @@ def applyGlobalSettings( globalSettings ) :
     maxThreads = globalSettings[ 'maxThreads' ]
 
 
+    # Apply asynchronous polling settings:
+
+    global useAsync, maxConnections
+
+    useAsync = globalSettings[ 'useAsync' ]
+    maxConnections = globalSettings[ 'maxConnections' ]
+
+
+    # Apply the timeout on polling a single account:
+
+    global pollTimeout
+
+    pollTimeout = globalSettings[ 'pollTimeout' ] or None
+
+
+    # Apply the daemon settings:
+
+    global daemonSocket, keepAlive
+
+    daemonSocket = globalSettings[ 'daemonSocket' ]
+    keepAlive = globalSettings[ 'keepAlive' ]
+
+
+    # Apply the watch mode settings:
+
+    global idleTimeout, pollInterval
+
+    idleTimeout = globalSettings[ 'idleTimeout' ]
+    pollInterval = globalSettings[ 'pollInterval' ]
+
+
+    # Apply the size of the cache of decoded headers:
+
+    from miscClasses import decodedHeaders
+
+    decodedHeaders.resize( globalSettings[ 'headerCacheSize' ] )
+
+
+    # Apply the number of processes that parse headers:
+
+    global parseProcesses
+
+    parseProcesses = globalSettings[ 'parseProcesses' ]
+
+
     # Apply showFlags settings:
 
     global showFlags
@@ -358,63 +532,69 @@ def applyGlobalSettings( globalSettings ) :
         colorFrom = globalSettings[ 'colorFrom' ]
 
 
+    # The templates of the lines displayed in terminal mode depend on the color and showFlags settings:
 
+    compileRenderer()
 
-def display( out ) :
 
-    '''
-    Accepts an Output data structure and prints out the results to the screen.
 
-    Note: This function carries out all formatting for the output using the purely data-oriented Output object as input. The output is in a text format which can be piped forward
+
+def compileRenderer() :
+
+    '''
+    Compiles the templates of the lines displayed in terminal mode (see display()) from the current color and showFlags settings.
     '''
 
-    from miscClasses import colorWidth as cW	# Custom function that sets width of text fields and colors it.
+    from miscClasses import textRenderer
 
-    print( cW( out.settings[ 'name' ] + ':', 12, colorTitle ), end = '' )			# Print name of account and allow for further text
+    global renderer
 
-    if out.settings[ 'showNums' ] :
+    renderer = textRenderer( { 'title': colorTitle, 'flag': colorFlag, 'date': colorDate, 'from': colorFrom, 'subjectSeen': colorSubjectSeen, 'subjectUnseen': colorSubjectUnseen }, showFlags )
 
-        print( "( total: %d | unseen: %d )" % (out.numAll, out.numUnseen) )
 
-    print( '\n' )
 
+def display( out ) :
 
-    # Preamble printed. Now start printing individual email information
+    '''
+    Accepts an Output data structure and prints out the results to the screen.
 
-    if out.settings[ 'showUnseen' ] :		# Show only unseen messages
+    Note: This function carries out all formatting for the output using the purely data-oriented Output object as input. The output is in a text format which can be piped forward. The whole account is rendered (see miscClasses.textRenderer) and then written in one go.
+    '''
 
-        for ii in range( len( out.emails ) ) :
+    import sys
 
-            email = out.emails[ ii ]
+    if renderer is None :		# The settings haven't been applied (see applyGlobalSettings())
 
-            print( cW( str(ii + 1), out.numDigits, align = '>' ) + '.  ' + cW( email.Date, 17, colorDate ) + '    ' + cW( email.From, 30, colorFrom ) + '   ' + cW( email.Subject, 120, colorSubjectUnseen, fill = False ) )
+        compileRenderer()
 
-    else :						# Show ALL messages. Different formatting scheme.
+    sys.stdout.write( renderer.render( out ) )
 
-        if showFlags :			# Global setting which declares that the flags associated with each message must be displayed
 
-            flags = lambda x : '  [ ' + cW( x, 2, colorFlag ) + ']   '
 
-        else :
 
-            flags = lambda x : '.   '
+def displayAccount( out ) :
+
+    '''
+    Displays the Output object of a single account (see display()) or the fact that an error occurred while polling it.
+    '''
+
+    if out.error:         # If an error occurs while constructing the Output object the exception is caught and the error flag is set
 
+        from miscClasses import colorWidth as cW
 
-        for ii in range( len( out.emails ) ) :
+        print( cW( out.settings[ 'name' ] + ':', 12, colorTitle ), end = '' )       # We indicate in the output that an Error has occurred.
 
-            email = out.emails[ ii ]
+        if out.reason :
 
-            if email.Seen :			# Email has a Seen flag.
+            print( "Error! (" + out.reason + ")\n\n" )
 
-                flag = ' '
-                colorSubject = colorSubjectSeen
+        else :
 
-            else :
-                flag = 'N'
-                colorSubject = colorSubjectUnseen
+            print( "Error!\n\n" )
 
-            print( cW( str(ii + 1), out.numDigits, align = '>' ) + flags( flag ) + cW( email.Date, 17, colorDate ) + '    ' + cW( email.From, 30, colorFrom ) + '   ' + cW( email.Subject, 120, colorSubject ) )
+    else:
 
+        display(out)
 
 
 
@@ -461,24 +641,115 @@ def main() :
     applyGlobalSettings( globalSettings ) 		# Apply the global settings contained in the 'globalSettings' dictionary we created from the configuration file and command-line arguments
 
 
+    settings = { 'maxThreads': maxThreads, 'useAsync': useAsync, 'maxConnections': maxConnections, 'pollTimeout': pollTimeout, 'daemonSocket': daemonSocket, 'keepAlive': keepAlive, 'watch': args.watch, 'idleTimeout': idleTimeout, 'pollInterval': pollInterval, 'showFlags': showFlags, 'stats': args.stats, 'format': args.format }
+
+
+    if parseProcesses > 0 :		# Started before any thread is
+
+        from miscClasses import startParsePool
+
+        startParsePool( parseProcesses )
+
+
+    if args.daemon :		# Run as a daemon instead of displaying anything
+
+        from fetchDaemon import runDaemon
+
+        runDaemon( servers, settings )
+
+        return
+
+
     # Now we determine whether the output is intended to go to the terminal (stdout) straight or passed on to urwid
 
     if globalSettings[ 'terminal' ]:		# Do NOT use urwid
 
-        from miscClasses import threadedExec
+        from miscClasses import pollAccounts
+        import sys
+
+        show = displayAccount		# Displays (or writes) the Output object of a single account
+
+        writer = None
+
+        if settings[ 'format' ] != 'text' :
+
+            from recordWriter import recordWriter
+
+            writer = recordWriter( settings[ 'format' ], sys.stdout )
+
+            sys.stdout = sys.stderr		# Only the records are written to stdout. Anything else that is printed (e.g. a server that can't be reached) goes to stderr.
+
+            show = writer.writeAccount
+
+        if settings[ 'watch' ] :		# Keep displaying the accounts as they change
+
+            from accountWatcher import watchAccounts
+
+            outputs = {}		# Latest Output object of each account
+
+            try :
+                for out in watchAccounts( servers, settings ) :
+
+                    outputs[ out.settings[ 'name' ] ] = out
+
+                    if writer :		# Every update is simply written as it comes
+
+                        show( out )
+
+                    elif sys.stdout.isatty() :		# Redraw all accounts in place. When the output is piped each update is simply appended.
+
+                        print( '\033[H\033[2J', end = '' )
+
+                        for name in sorted( outputs.keys() ) :
+
+                            displayAccount( outputs[ name ] )
 
-        for out in threadedExec( servers, maxThreads ):
+                    else :
 
-            if out.error:         # If an error occurs while constructing the Output object the exception is caught and the error flag is set
+                        displayAccount( out )
 
-                from miscClasses import colorWidth as cW
+                    sys.stdout.flush()
 
-                print( cW( out.settings[ 'name' ] + ':', 12, colorTitle ), end = '' )       # We indicate in the output that an Error has occurred.
-                print( "Error!\n\n" )
+            except KeyboardInterrupt :
 
-            else:
+                pass
 
-                display(out)
+            if writer :
+
+                writer.close()
+
+            return
+
+
+        import time
+
+        start = time.time()
+
+        outs = []		# Only kept if the statistics are to be printed
+
+        for out in pollAccounts( servers, settings ):		# Uses either threads or the asynchronous event loop depending on the settings
+
+            displayStart = time.time()
+
+            show( out )
+
+            sys.stdout.flush()		# Each account is displayed as soon as it has been polled, even when the output is piped to another application
+
+            if out.stats :
+
+                out.stats.add( 'render', time.time() - displayStart )
+
+                outs.append( out )
+
+        if writer :
+
+            writer.close()
+
+        if settings[ 'stats' ] :
+
+            from pollStats import printStats
+
+            printStats( outs, settings[ 'stats' ], time.time() - start )
 
     else:
 
@@ -488,12 +759,12 @@ def main() :
 
         # Create instance of the imported class to create and start the urwid loop to display emails
 
-        settings = { 'maxThreads': maxThreads, 'showFlags': showFlags }
-
         urwidDisplay( servers, settings )
 
 
 
-# Main execution of the program begins here:
+# Main execution of the program begins here (unless the script has been imported as a module, e.g. by benchmark.py):
+
+if __name__ == '__main__' :
 
-main()
+    main()
@@ -0,0 +1,186 @@
+# Copyright 2012 Abid Hasan Mujtaba
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Author: Abid H. Mujtaba
+# Email: abid.naqvi83@gmail.com
+#
+# This file implements a persistent on-disk cache of the header information (From, Subject, Date, uid and Seen) of the emails in a single folder of a single account. The cache allows pollAccount() to only fetch the headers of emails it has not seen on a previous run.
+#
+# The cache is stored in an SQLite database (one per account and folder) in the cache folder specified in the configuration file (~/.fetchheaders by default). It is keyed by the UIDVALIDITY of the folder. If the UIDVALIDITY reported by the server changes the UIDs stored in the cache no longer refer to the same emails and so the cache is thrown away.
+
+
+cacheVersion = '3'		# The version of the information stored. Caches of an older version are thrown away (see validate()). 2: The whole decoded sender is stored rather than one padded and truncated to 30 characters. 3: The ISO 8601 timestamp of the emails is stored.
+
+
+class headerCache :
+
+    '''
+    This class wraps the SQLite database that stores the cached header information for a single folder of a single account.
+    '''
+
+    def __init__( self, account, folder ) :
+
+        '''
+        account: <DIC> The settings associated with the account. The name, host and username are used to identify the cache and 'cacheFolder' specifies where it is stored.
+
+        folder: <STRING> The folder on the IMAP server whose headers are cached.
+        '''
+
+        import os, re, sqlite3
+
+        self.identity = account[ 'host' ] + ':' + account[ 'username' ] + ':' + folder		# Used to detect that the account settings have changed since the cache was created
+
+        cacheFolder = os.path.expanduser( account[ 'cacheFolder' ] )
+
+        if not os.path.isdir( cacheFolder ) :
+
+            os.makedirs( cacheFolder, 0700 )		# The cache holds the senders and subjects of the emails so it is kept private
+
+        fileName = re.sub( '[^A-Za-z0-9._-]', '_', 'cache-' + account.get( 'account', account[ 'name' ] ) + '-' + folder ) + '.sqlite'		# One database file per account and folder so that threads polling different accounts never contend for the same file. ('account' is the name of the account when 'name' also carries the folder, see miscClasses.accountFolders())
+
+        path = os.path.join( cacheFolder, fileName )
+
+        os.close( os.open( path, os.O_RDWR | os.O_CREAT, 0600 ) )		# Created (before SQLite creates it with the default permissions) readable by the current user only. SQLite gives its journal the same permissions.
+
+        os.chmod( path, 0600 )		# Caches created by older versions
+
+        self.db = sqlite3.connect( path )
+
+        self.db.execute( 'CREATE TABLE IF NOT EXISTS meta ( key TEXT PRIMARY KEY, value TEXT )' )
+
+        if self.getMeta( 'version' ) != cacheVersion :		# The table of an older version may lack columns. Its meta data is replaced by validate().
+
+            self.db.execute( 'DROP TABLE IF EXISTS emails' )
+
+        self.db.execute( 'CREATE TABLE IF NOT EXISTS emails ( uid INTEGER PRIMARY KEY, sender TEXT, subject TEXT, date TEXT, timestamp TEXT, seen INTEGER )' )
+
+
+    def validate( self, uidValidity ) :
+
+        '''
+        Compares the UIDVALIDITY of the folder (as reported by the server) with the one stored in the cache. If they differ (or the cache belongs to a different host/username or was written by an older version, see cacheVersion) the cached emails are thrown away and the new UIDVALIDITY is stored.
+
+        If the UIDVALIDITY could not be determined (None is passed) the cache can not be trusted and is always thrown away.
+        '''
+
+        if uidValidity is None or self.getMeta( 'uidValidity' ) != str( uidValidity ) or self.getMeta( 'identity' ) != self.identity or self.getMeta( 'version' ) != cacheVersion :
+
+            self.db.execute( 'DELETE FROM emails' )
+            self.db.execute( 'DELETE FROM meta' )
+
+            self.setMeta( 'uidValidity', uidValidity )
+            self.setMeta( 'identity', self.identity )
+            self.setMeta( 'version', cacheVersion )
+
+
+    def getMeta( self, key ) :
+
+        '''
+        Returns the value (a string) associated with 'key' in the meta table or None if it doesn't exist.
+        '''
+
+        row = self.db.execute( 'SELECT value FROM meta WHERE key = ?', ( key, ) ).fetchone()
+
+        if row :
+            return str( row[0] )
+
+        else :
+            return None
+
+
+    def setMeta( self, key, value ) :
+
+        '''
+        Stores the 'value' associated with 'key' in the meta table.
+        '''
+
+        self.db.execute( 'INSERT OR REPLACE INTO meta ( key, value ) VALUES ( ?, ? )', ( key, str( value ) ) )
+
+
+    def emails( self ) :
+
+        '''
+        Returns a dictionary of the cached Email objects keyed by their uid (a string containing an integer, the same form as returned by imapServer.getUids()).
+        '''
+
+        from miscClasses import Email
+
+        output = {}
+
+        for uid, sender, subject, date, timestamp, seen in self.db.execute( 'SELECT uid, sender, subject, date, timestamp, seen FROM emails' ) :
+
+            email = Email()
+
+            email.From = sender
+            email.Subject = subject
+            email.Date = date
+            email.Timestamp = timestamp
+            email.uid = str( uid )
+            email.Seen = bool( seen )
+
+            output[ email.uid ] = email
+
+        return output
+
+
+    def store( self, emails ) :
+
+        '''
+        Stores (or updates) the list of Email objects in the cache.
+        '''
+
+        self.db.executemany( 'INSERT OR REPLACE INTO emails ( uid, sender, subject, date, timestamp, seen ) VALUES ( ?, ?, ?, ?, ?, ? )', [ ( int( email.uid ), email.From, email.Subject, email.Date, email.Timestamp, int( email.Seen ) ) for email in emails ] )
+
+
+    def discard( self, lstUIDs ) :
+
+        '''
+        Removes the emails specified by the list of UIDs from the cache. Used for emails that have been deleted from the folder.
+        '''
+
+        self.db.executemany( 'DELETE FROM emails WHERE uid = ?', [ ( int( uid ), ) for uid in lstUIDs ] )
+
+
+    def close( self ) :
+
+        '''
+        Commits all changes to the disk and closes the database.
+        '''
+
+        self.db.commit()
+        self.db.close()
+
+
+
+def openCache( account, folder ) :
+
+    '''
+    Returns a headerCache object for the specified account and folder or None if caching is disabled for the account or the cache can not be opened. A broken cache should never prevent the account from being polled.
+    '''
+
+    if not account.get( 'useCache' ) :
+
+        return None
+
+    import sqlite3
+
+    try :
+        return headerCache( account, folder )
+
+    except ( sqlite3.Error, OSError, IOError ) :
+
+        print( 'Unable to open header cache for account ' + account[ 'name' ] + '. Continuing without it.' )
+
+        return None
@@ -0,0 +1,203 @@
+# Copyright 2012 Abid Hasan Mujtaba
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Author: Abid H. Mujtaba
+# Email: abid.naqvi83@gmail.com
+#
+# This file implements the list walker behind the listbox of urwidDisplay. Building the urwid widgets of a header line is by far the most expensive part of displaying an email, so rather than building the lines of ALL emails up front (tens of thousands with -A) the walker stores the Email objects themselves and builds the line of an email only when the listbox asks for it, i.e. when it is about to be displayed. A limited number of lines is cached so that scrolling within the screen doesn't rebuild them.
+
+
+import urwid
+
+from collections import OrderedDict
+
+
+class headerWalker( urwid.ListWalker ) :
+
+    '''
+    A urwid ListWalker whose rows are either urwid widgets (account lines, dividers, placeholders) or Email objects. The line of an Email is built by calling 'constructLine( email, focus )' the first time it is requested. A line that is already built is brought up to date (when the email gains or loses the focus or is flagged for deletion) by calling 'styleLine( line, email, focus )'.
+
+    Changes to the rows (or to the appearance of a single email) must be made through the methods of this class so that the cached lines are discarded and the listbox is redrawn.
+    '''
+
+    def __init__( self, constructLine, styleLine, cacheSize = 500 ) :
+
+        '''
+        constructLine: <FUNCTION> Builds the widget of an email. See urwidDisplay.constructLine().
+
+        styleLine: <FUNCTION> Changes the appearance of a built line. See urwidDisplay.styleLine().
+
+        cacheSize: Maximum number of built lines kept. It only needs to comfortably exceed the height of the screen.
+        '''
+
+        self.constructLine = constructLine
+        self.styleLine = styleLine
+        self.cacheSize = cacheSize
+
+        self.rows = []
+        self.focus = 0			# Position of the row with the listbox focus
+
+        self.focusEmail = None		# The Email whose line is highlighted (drawn with the focus color scheme)
+
+        self.lines = OrderedDict()		# Built lines keyed by position, the least recently used first
+
+
+    def __len__( self ) :
+
+        return len( self.rows )
+
+
+    def __getitem__( self, position ) :
+
+        if position < 0 :		# Positions wrap around in a list but not in a listbox
+
+            raise IndexError( position )
+
+        row = self.rows[ position ]
+
+        if isinstance( row, urwid.Widget ) :
+
+            return row
+
+        if position in self.lines :
+
+            line = self.lines.pop( position )		# Re-inserting the line marks it as the most recently used
+
+        else :
+
+            line = self.constructLine( row, focus = row is self.focusEmail )
+
+            while len( self.lines ) >= self.cacheSize :
+
+                self.lines.popitem( last = False )
+
+        self.lines[ position ] = line
+
+        return line
+
+
+    def next_position( self, position ) :
+
+        if position + 1 >= len( self.rows ) :
+
+            raise IndexError( position + 1 )
+
+        return position + 1
+
+
+    def prev_position( self, position ) :
+
+        if position <= 0 :
+
+            raise IndexError( position - 1 )
+
+        return position - 1
+
+
+    def set_focus( self, position ) :
+
+        self.focus = position
+
+        self._modified()
+
+
+    def insert( self, position, rows ) :
+
+        '''
+        Inserts the list 'rows' before 'position'.
+        '''
+
+        self.rows[ position : position ] = rows
+
+        self.changed()
+
+
+    def append( self, row ) :
+
+        self.rows.append( row )
+
+        self.changed()
+
+
+    def remove( self, row ) :
+
+        self.rows.remove( row )
+
+        self.changed()
+
+
+    def replace( self, rows ) :
+
+        '''
+        Replaces all of the rows with the list 'rows'.
+        '''
+
+        self.rows = list( rows )
+
+        self.changed()
+
+
+    def highlight( self, email ) :
+
+        '''
+        Highlights the line of 'email' (None for no email), removing the highlight from the previous one.
+        '''
+
+        previous = self.focusEmail
+
+        self.focusEmail = email
+
+        for row in ( previous, email ) :		# Only the lines of these two emails change
+
+            if row is not None :
+
+                self.restyle( row.listPos )
+
+        self._modified()
+
+
+    def invalidate( self, position ) :
+
+        '''
+        Brings the line at 'position' up to date (e.g. after the email has been flagged for deletion).
+        '''
+
+        self.restyle( position )
+
+        self._modified()
+
+
+    def restyle( self, position ) :
+
+        line = self.lines.get( position )
+
+        if line is not None :		# A line that hasn't been built yet will be styled correctly when it is
+
+            email = self.rows[ position ]
+
+            self.styleLine( line, email, email is self.focusEmail )
+
+
+    def changed( self ) :
+
+        '''
+        Called whenever the rows have been inserted or removed. Every cached line may now be at the wrong position so all of them are discarded.
+        '''
+
+        self.lines.clear()
+
+        self.focus = max( 0, min( self.focus, len( self.rows ) - 1 ) )
+
+        self._modified()
@@ -26,35 +26,196 @@
 
 
 
+import imaplib		# Import the crucial module that allows interaction with IMAP servers
+import re
+import socket
+
+from pollStats import timed
+
+
+# Patterns used to parse FETCH responses. They are compiled once, here, since they are applied to every email fetched.
+
+reFetchStart = re.compile( '[0-9]+ \\(' )		# Marks the beginning of a new FETCH response (sequence number followed by an opening parenthesis)
+reFetchUid = re.compile( '[( ]UID ([0-9]+)' )
+reFetchFlags = re.compile( '[( ]FLAGS \\(([^\\)]*)\\)' )
+reEsearchAll = re.compile( ' ALL ([0-9:,]+)' )		# The UIDs in an ESEARCH response e.g. '(TAG "A5") UID ALL 1:3,7'
+reHeaderLine = re.compile( '\r?\n(?![ \t])' )		# A line break that is NOT followed by whitespace (which would indicate a folded header)
+reStatus = re.compile( '(.*) \\(([^\\)]*)\\)$' )		# A STATUS response e.g. 'INBOX (MESSAGES 20 UNSEEN 3)'
+reStatusMessages = re.compile( 'MESSAGES ([0-9]+)', re.I )
+reStatusUnseen = re.compile( 'UNSEEN ([0-9]+)', re.I )
+
+
+class _countedIO :
+
+    '''
+    Mixin for _IMAP4 and _IMAP4_SSL that counts the bytes sent to and received from the server (along with the round trips) in the pollStats object 'stats' (see pollStats.py) unless it is None. 'base' is the imaplib class whose methods actually carry out the I/O.
+    '''
+
+    def send( self, data ) :
+
+        if self.stats is not None :
+
+            self.stats.sent( len( data ) )
+
+        self.base.send( self, data )
+
+
+    def read( self, size ) :
+
+        data = self.base.read( self, size )
+
+        if self.stats is not None :
+
+            self.stats.received( len( data ) )
+
+        return data
+
+
+    def readline( self ) :
+
+        line = self.base.readline( self )
+
+        if self.stats is not None :
+
+            self.stats.received( len( line ) )
+
+        return line
+
+
+
+class _IMAP4( _countedIO, imaplib.IMAP4 ) :
+
+    '''
+    The imaplib.IMAP4 class extended to support a timeout on establishing the connection and a timeout on every subsequent read from the server (the python 2 version of imaplib supports neither). A timeout of None means wait forever.
+    '''
+
+    base = imaplib.IMAP4
+
+    def __init__( self, host, connectTimeout = None, readTimeout = None, stats = None ) :
+
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.stats = stats
+
+        host, port = _hostPort( host, imaplib.IMAP4_PORT )
+
+        imaplib.IMAP4.__init__( self, host, port )
+
+
+    def open( self, host = '', port = imaplib.IMAP4_PORT ) :
+
+        self.host = host
+        self.port = port
+        self.sock = socket.create_connection( ( host, port ), self.connectTimeout )
+        self.sock.settimeout( self.readTimeout )
+        self.file = self.sock.makefile( 'rb' )
+
+
+
+class _IMAP4_SSL( _countedIO, imaplib.IMAP4_SSL ) :
+
+    '''
+    The imaplib.IMAP4_SSL class extended to support connect and read timeouts (see _IMAP4).
+    '''
+
+    base = imaplib.IMAP4_SSL
+
+    def __init__( self, host, connectTimeout = None, readTimeout = None, stats = None ) :
+
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.stats = stats
+
+        host, port = _hostPort( host, imaplib.IMAP4_SSL_PORT )
+
+        imaplib.IMAP4_SSL.__init__( self, host, port )
+
+
+    def open( self, host = '', port = imaplib.IMAP4_SSL_PORT ) :
+
+        import ssl, time
+
+        self.host = host
+        self.port = port
+        self.sock = socket.create_connection( ( host, port ), self.connectTimeout )
+        self.sock.settimeout( self.readTimeout )
+
+        start = time.time()
+
+        self.sslobj = ssl.wrap_socket( self.sock, self.keyfile, self.certfile )		# The SSL socket inherits the read timeout of the underlying socket
+
+        if self.stats is not None :
+
+            self.stats.add( 'tls', time.time() - start )		# Part of 'connect' (see imapServer.__init__())
+
+        self.file = self.sslobj.makefile( 'rb' )
+
+
+
 class imapServer: 	# This class implements all the functionality we need from the interface with a given imap server. It forms a wrapper around the 'imaplib' module.
 
-    def __init__( self, server, use_ssl=True ) :
+    def __init__( self, server, use_ssl=True, connectTimeout = None, readTimeout = None, stats = None ) :
 
         '''
-        This is the constructor function for this class. It requires the servername in the form of a string.
+        This is the constructor function for this class. It requires the servername in the form of a string. A port other than the standard one may be specified by appending it to the servername (e.g. 'localhost:1143').
 
         The flag 'use_ssl' determines whether SSL will be used to connect to the specified IMAP server.
+
+        connectTimeout and readTimeout are the number of seconds to wait for the connection to be established and for each response from the server respectively. None (the default) means wait forever. A command that times out fails like any other.
+
+        stats: A pollStats object in which the time spent in each method and the traffic with the server are collected (see pollStats.py). None (the default) means no statistics are collected.
         '''
 
+        import time
+
         self.server = server
 
-        import imaplib		# Import the crucial module that allows interaction with IMAP servers
+        self.stats = stats
+
+        self.capabilities = []		# Capabilities advertised by the server. Populated once the connection is established and updated after logging in.
+
+        self.condstore = False		# Flags that indicate whether the CONDSTORE and QRESYNC extensions have been enabled (see .enableCondstore())
+        self.qresync = False
+
+        start = time.time()
 
         try:
             if use_ssl:
-                self.mail = imaplib.IMAP4_SSL( self.server )		# Establish connection with the server.
+                self.mail = _IMAP4_SSL( self.server, connectTimeout, readTimeout, stats )		# Establish connection with the server.
             else:
-                self.mail = imaplib.IMAP4( self.server )
+                self.mail = _IMAP4( self.server, connectTimeout, readTimeout, stats )
 
         except:
             print( 'Unable to establish SSL connection to IMAP server ' + self.server )
 
+        else:
+            self.capabilities = list( self.mail.capabilities )
+
+        if stats is not None :
+
+            stats.add( 'connect', time.time() - start )		# Includes reading the greeting of the server and (with python 2) requesting its capabilities
+
+
+
+    def collectStats( self, stats ) :
+
+        '''
+        Replaces the pollStats object in which statistics are collected (None stops collecting them). Used by the daemon whose connections outlive a single poll (see fetchDaemon).
+        '''
+
+        self.stats = stats
+
+        if hasattr( self, 'mail' ) :
+
+            self.mail.stats = stats
 
 
+
+    @timed
     def login( self, username, password ) :
 
         '''
-        Method for sending credentials to IMAP server for logging in.
+        Method for sending credentials to IMAP server for logging in. Returns True if the credentials were accepted.
         '''
 
         self.username = username	# Saving credentials in object as members.
@@ -65,312 +226,901 @@ class imapServer: 	# This class implements all the functionality we need from th
 
         except:
             print( 'Credentials (username and password) rejected by IMAP server (or connection lost).' )
+            return False
+
+        else:
+            caps = self.mail.response( 'CAPABILITY' )[1][0]		# Most servers report their (possibly extended) capabilities in the response to LOGIN. If not we hold on to the ones advertised before logging in.
 
+            if caps :
+                self.capabilities = caps.upper().split()
 
+            return True
 
-    def logout( self ) :
+
+
+    @timed
+    def enableCondstore( self ) :
 
         '''
-        Method for closing the selected folder and logging out of the IMAP server.
+        Method for enabling the CONDSTORE extension (RFC 7162), and QRESYNC as well if the server supports it, using the ENABLE command. Once enabled the server reports the HIGHESTMODSEQ of a folder when it is selected/examined which allows .syncFlags() to fetch only the flags that have changed since the last poll.
+
+        Must be called after .login() and before .select()/.examine(). Returns True if CONDSTORE has been enabled. If the server lacks these capabilities nothing is sent to the server and False is returned.
         '''
 
-        try:
-            self.mail.close()
-            self.mail.logout()
+        if not 'ENABLE' in self.capabilities :
 
-        except:
-            print( 'Unable to successfully logout of IMAP server.' )
+            return False
 
+        if 'QRESYNC' in self.capabilities :		# QRESYNC implies CONDSTORE
 
+            extension = 'QRESYNC'
 
-    def select( self, folder = "INBOX" ) :
+        elif 'CONDSTORE' in self.capabilities :
 
-        '''
-        Method for selecting a paticular folder on the imap server. The Inbox is the default option.
+            extension = 'CONDSTORE'
 
-        The folder must be specified as a string according to the IMAP protocols (the string you would use when connecting using imaplib or telnet (openssl). A list of the folders one can access can be listed using the .listFolders() method.
-        '''
+        else :
+            return False
 
-        self.folder = folder
+        imaplib.Commands.setdefault( 'ENABLE', ( 'AUTH', ) )		# Older versions of imaplib don't know about the ENABLE command
 
         try:
-            self.mail.select( self.folder )
+            typ, dat = self.mail._simple_command( 'ENABLE', extension )
+            enabled = ' '.join( [ x for x in self.mail._untagged_response( typ, dat, 'ENABLED' )[1] if x ] ).upper().split()
 
         except:
-            print( 'Unable to select folder ' + self.folder + ' in IMAP server.' )
+            print( 'Unable to enable ' + extension + ' on IMAP server ' + self.server )
+            return False
 
+        self.qresync = 'QRESYNC' in enabled
+        self.condstore = self.qresync or 'CONDSTORE' in enabled
 
+        return self.condstore
 
 
-    def examine( self, folder = 'INBOX' ) :
 
-        '''
-        Method for examining a particular folder. This differs from 'select' in that it is purely readonly, not even the flags (such as 'SEEN') are altered by choosing a folder using 'examine'.
+    @timed
+    def noop( self ) :
 
-        The folder must be specified as a string according to the IMAP protocols (see .select() above).
         '''
-
-        self.folder = folder
+        Method for sending a NOOP to the server. Used to keep an idle connection alive (and to check that it still is). Returns True if the server responded.
+        '''
 
         try:
-            self.mail.select( self.folder, readonly = True )
+            typ, dat = self.mail.noop()
 
         except:
-            print( 'Unable to examine folder ' + self.folder + ' in IMAP server.' )
+            return False
 
+        return typ == 'OK'
 
 
 
-    def listFolders( self ) :
+    @timed
+    def idle( self, timeout ) :
 
         '''
-        Method lists all the folders in the account on the imap server. The output is a raw string.
+        Method for waiting for the server to push changes to the selected folder (RFC 2177 IDLE). Returns as soon as the server reports a change (after giving it a moment to report any related changes) or after 'timeout' seconds, with the list of untagged responses received (stripped of the leading '* ', e.g. '12 EXISTS', '3 EXPUNGE', '5 FETCH (FLAGS (\\Seen))'). An empty list means nothing changed.
 
-        The method assumes that self.login() has been called i.e. self.mail is currently connected to the user's account.
+        If the server doesn't support IDLE we simply wait for 'timeout' seconds and then send a NOOP, in response to which the server reports the same changes.
+
+        Returns None if the connection has failed.
+
+        imaplib doesn't support IDLE so it is implemented using its low-level methods. Since a response can take arbitrarily long to arrive we wait for the socket with select() rather than relying on the read timeout.
         '''
 
+        import select, time
+
+        events = []
+
+        tag = None
+
         try:
-            tmpList = self.mail.list()[1]		# The first member of list() is the result of the attempt. 'OK' if successful. The second member is the list.
-        except:
-            print( 'Unable to list folders in account' )
+            tag = self.mail._new_tag()		# Registers the tag in imaplib's tagged_commands, from which it is removed (below) once the command is over
 
+            if not 'IDLE' in self.capabilities :
 
-        return tmpList
+                time.sleep( timeout )
 
+                self.mail.send( tag + ' NOOP\r\n' )
 
+            else :
 
+                self.mail.send( tag + ' IDLE\r\n' )
 
-    def totalMsgs( self ) :
+                line = self.mail._get_line()
 
-        '''
-        Method to return total number of messages in currently selected folder.
-        '''
+                while line.startswith( '* ' ) :		# Responses already pending may precede the continuation request
 
-        try:
-            tmpStr = self.mail.status( self.folder, "(messages)" )[1][0]	  # status returns list of lists with us needing the first element of the second list
+                    events.append( line[2:] )
+                    line = self.mail._get_line()
 
-        except:
-            print( 'Unable to receive total number of messages in folder: ' + self.folder )
+                if not line.startswith( '+' ) :		# IDLE was rejected
 
-        else:
-            return int( _substring( '.*MESSAGES ([0-9]*).*', tmpStr ) )		# Returned as an integer NOT a string
+                    return None
 
+                sock = self.mail.sslobj if hasattr( self.mail, 'sslobj' ) else self.mail.sock
 
+                deadline = time.time() + timeout
 
+                while True :
 
-    def unseenMsgs( self ) :
+                    remaining = deadline - time.time()
 
-        '''
-        Method to return number of unseen messages in currently selected folder.
-        '''
+                    if remaining <= 0 :
 
-        try:
-            tmpStr = self.mail.status( self.folder, "(unseen)" )[1][0]
+                        break
+
+                    buffered = self.mail.file._rbuf.tell() or ( hasattr( sock, 'pending' ) and sock.pending() )		# Data already read from the socket by imaplib's file object (or the SSL layer) doesn't make the socket readable
+
+                    if not buffered and not select.select( [ sock ], [], [], remaining )[0] :
+
+                        break
+
+                    line = self.mail._get_line()
+
+                    if line.startswith( '* ' ) :
+
+                        events.append( line[2:] )
+
+                        deadline = min( deadline, time.time() + 0.5 )		# Changes (e.g. a batch of new emails) tend to be reported in quick succession
+
+                self.mail.send( 'DONE\r\n' )
+
+            line = self.mail._get_line()
+
+            while not line.startswith( tag ) :
+
+                if line.startswith( '* ' ) :
+
+                    events.append( line[2:] )
+
+                line = self.mail._get_line()
 
         except:
-            print( 'Unable to receive number of unseen messages in folder: ' + self.folder )
+            print( 'Lost connection with IMAP server ' + self.server )
+            return None
 
-        else:
-            return int( _substring( ".*UNSEEN ([0-9]*).*", tmpStr ) )
+        finally :
+            if tag :
 
+                self.mail.tagged_commands.pop( tag, None )		# imaplib only removes the tags of the commands it reads the completion of itself, so in --watch mode every IDLE would otherwise be kept forever
 
+        return events
 
-    def numMsgs( self ) :
+
+
+    @timed
+    def logout( self ) :
 
         '''
-        Method to return both the number of total messages and unseen messages in one go as a tuple of form (total, unseen).
+        Method for closing the selected folder and logging out of the IMAP server.
         '''
 
         try:
-            tmpStr = self.mail.status( self.folder, "(messages unseen)" )[1][0]
+            if self.mail.state == 'SELECTED' :		# No folder is selected if the folders were only checked using STATUS (see .folderStatus())
 
-        except:
-            print( 'Unable to receive number of total and unseen messages in folder: ' + self.folder )
+                queued = []
 
-        else:
+                self.mail.send = queued.append		# We don't wait for the response to CLOSE. It is written along with LOGOUT (see ._pipeline()) and its response is read with that of LOGOUT, saving a round trip.
 
-            numAll = int( _substring( '.*MESSAGES ([0-9]*).*', tmpStr ) )
-            numUnseen = int( _substring( '.*UNSEEN ([0-9]*).*', tmpStr ) )
+                try :
+                    self.mail._command( 'CLOSE' )
 
-            return (numAll, numUnseen)
+                finally :
+                    del self.mail.send
 
+                send = self.mail.send
+
+                self.mail.send = lambda data : send( ''.join( queued ) + data )
+
+            try :
+                self.mail.logout()
+
+            finally :
+                self.mail.__dict__.pop( 'send', None )
+
+        except:
+            print( 'Unable to successfully logout of IMAP server.' )
 
 
-    def getUids( self, strSearch ) :
+
+    @timed
+    def select( self, folder = "INBOX" ) :
 
         '''
-        Method to return the unique UIDs of emails from current folder based upon the status of certain flags as specified by 'strSearch'. The method has the ability to return the UIDs of all messages or just unseen messages .etc.
+        Method for selecting a paticular folder on the imap server. The Inbox is the default option.
 
-        strSearch excepts all of the strings accepted by the SEARCH method in the IMAP protocol. We will mostly be working with "ALL" and "UNSEEN".
+        The folder must be specified as a string according to the IMAP protocols (the string you would use when connecting using imaplib or telnet (openssl). A list of the folders one can access can be listed using the .listFolders() method.
         '''
 
+        self.folder = folder
+
         try:
-            return self.mail.uid( 'search', None, strSearch )[1][0].split()		# This generates a list of UIDs as strings containing integers only.
+            self.mail.select( self.folder )
 
         except:
-            print( 'Unable to retrieve UIDs of emails specified by strSearch from IMAP server in folder: ' + self.folder )
+            print( 'Unable to select folder ' + self.folder + ' in IMAP server.' )
 
 
 
 
-    def fetchHeaders( self, lstUIDs, lstFields = ['from', 'subject'] ) :
+    @timed
+    def examine( self, folder = 'INBOX' ) :
 
         '''
-        Method to fetch fields specified by the list of strings 'lstFields' of the emails whose UIDs are in the list 'lstUIDs' from the current folder.
-
-        lstUIDs is a list of UIDs, each UID being a string containing an integer.
-
-        lstFields is a list of strings specifying the HEADER fields that fetch will use to extract information from the specified emails. A common example for fetching just 'from' and 'subject' fields is ['From', 'Subject']. The first letter of each field string must be uppercase and all the latter ones need to be in lowercase.
+        Method for examining a particular folder. This differs from 'select' in that it is purely readonly, not even the flags (such as 'SEEN') are altered by choosing a folder using 'examine'.
 
-        The output of this method is a dictionary of dictonaries. Each UID is associated with a dictionary where the keys are the values of lstFields.
+        The folder must be specified as a string according to the IMAP protocols (see .select() above).
         '''
 
-        import re
-
-        # We will retrieve each field one at a time. This will increase the internet load but will make it much easier for us to deal with the information that we get since we won't have to parse the information.
+        self.folder = folder
 
-        output = {}
+        try:
+            self.mail.select( self.folder, readonly = True )
 
-        for item in lstUIDs :	output[ item ] = {}	# Initiate the output dictionary of dictionaries
+        except:
+            print( 'Unable to examine folder ' + self.folder + ' in IMAP server.' )
 
-        for field in lstFields :
 
-            try :
-                data = self.mail.uid( 'fetch', ','.join( lstUIDs ), '(BODY[HEADER.FIELDS (' + field + ')])' )[1]
 
-            except:
-                print( 'Unable to fetch field ' + field + ' from folder ' + self.folder )
 
-            else :
+    @timed
+    def openFolder( self, folder, strSearch = None, withNums = False, lstFields = None ) :
 
-                for ii in range( len( lstUIDs ) ) :
+        '''
+        Method which examines 'folder' (see .examine()) and, in the same round trip, asks for the numbers of messages in it (only if 'withNums' is True) and searches it using 'strSearch' (only if specified). The commands are pipelined (see ._pipeline()).
 
-                    uid = lstUIDs[ii]
+        If 'lstFields' is specified and the server supports SEARCHRES (RFC 5182) the search result is saved on the server and the header fields 'lstFields' of the emails found are fetched in that same round trip as well (UID FETCH $), which is how a poll of a folder can cost a single round trip. Otherwise the headers have to be fetched once the UIDs are known (see .fetchHeaders()).
 
-                    # Remove the field name from data using Regex. This requires us to put 'field' in to pascal case.
+        Returns a tuple (nums, uids, headers): 'nums' is the tuple (total, unseen) as returned by .numMsgs(), 'uids' the list of UIDs as returned by .getUids() and 'headers' the dictionary returned by .fetchHeaders() for ALL of these UIDs. Each of them is None if it wasn't asked for (or couldn't be retrieved). All of them are None if the folder couldn't be examined.
+        '''
 
-                    pField = field[0].upper() + field[1:].lower()	# Convert to Pascal case
+        self.folder = folder
 
-                    string = data[ 2 * ii ][1]
+        prefetch = strSearch and lstFields and 'SEARCHRES' in self.capabilities
 
-                    string = _reduceWhitespace( string )
+        commands = [ ( 'EXAMINE', folder ) ]
 
-                    m = re.match( pField + ': (.*)', string )
+        if withNums :
 
-                    if m :
-                        output[ uid ][ field ] = m.group(1)
+            commands.append( ( 'STATUS', folder, '(MESSAGES UNSEEN)' ) )
 
-                    else :
-                        output[ uid ][ field ] = 'RegEx Error: ' + string
+        if prefetch :		# SEARCHRES implies ESEARCH
 
-        return output
+            commands.append( ( 'UID', 'SEARCH', 'RETURN', '(SAVE ALL)', strSearch ) )
+            commands.append( ( 'UID', 'FETCH', '$', _headerItems( lstFields ) ) )
 
+        elif strSearch and 'ESEARCH' in self.capabilities :		# See .getUids()
 
+            commands.append( ( 'UID', 'SEARCH', 'RETURN', '(ALL)', strSearch ) )
 
+        elif strSearch :
 
-    def fetchFlags( self, lstUIDs ) :
+            commands.append( ( 'UID', 'SEARCH', strSearch ) )
 
-        '''
-        Method for fetching flags for the specified emails.
-        '''
+        self.mail.is_readonly = True		# As imaplib's .select() would. Otherwise the READ-ONLY response to EXAMINE is treated as an error.
+        self.mail.state = 'SELECTED'		# imaplib only lets us send the commands that follow EXAMINE once a folder is selected
 
-        output = {}	# Create empty dictionary
+        nums = uids = headers = None
 
         try :
-            data = self.mail.uid( 'fetch', ','.join( lstUIDs ), 'flags' )[1]
+            results = self._pipeline( commands )
 
         except :
-            print( 'Unable to fetch flags for specified emails.' )
-
-        else :
-            import re
+            print( 'Unable to examine folder ' + self.folder + ' in IMAP server.' )
 
-            # Different email servers use different formats for reporting the flags associated with emails in the folder. So we provide a list of regular expressions to cover all the possibilities.
-            # These are formatted as a list of lists.
-            # Each list contains three items:
-            # (i) Actual regex
-            # (ii) The index of the group in the regex that contains the uid
-            # (iii) The index of the group in the regex that contains the flags
-            # The latter two are used to constuct the 'output' dictionary
-            regexes = [['.*UID ([0-9]+)[^\(]*\(([^\)]*)\).*', 1, 2], ['.*FLAGS \(([^\)]*)\) UID ([0-9]+).*', 2, 1]]
+            self.mail.state = 'AUTH'
 
-            for item in data :
+            return ( None, None, None )
 
-                for regex in regexes:
+        typ, untagged = results.pop(0)
 
-                    m = re.match(regex[0], item)
+        if typ != 'OK' :
 
-                    if m:
-                        output[ m.group(regex[1]) ] = m.group(regex[2])
-                        break
+            print( 'Unable to examine folder ' + self.folder + ' in IMAP server.' )
 
-            return output
+            self.mail.state = 'AUTH'
 
+            return ( None, None, None )
 
+        self.mail.untagged_responses = untagged		# Keep the responses to EXAMINE (UIDVALIDITY, HIGHESTMODSEQ) for .uidValidity() and .highestModSeq(), as imaplib's .select() does
 
+        if withNums :
 
-    def fetch( self, lstUIDs, strFetch ) :
+            typ, untagged = results.pop(0)
 
-        '''
-        Wrapper method for the IMAP 'fetch' command. This accepts the standard string used in an IMAP 'fetch' request, along with a list of UIDs identifying the emails for which the fetch request will be carried out. The output is the raw unformatted, unfiltered text that is returned by the server.
+            nums = ( _parseStatus( untagged.get( 'STATUS', [] ) ).values() or [ None ] )[0]		# The folder is named by the server as it sees fit so we don't look it up by name
 
-        The standard request to get just 'From' and 'Subject' fields is to use strFetch = '(BODY[HEADER.FIELDS (from subject)])'
-        '''
+            if nums is None :
+                print( 'Unable to receive number of total and unseen messages in folder: ' + self.folder )
 
-        try :
-            return self.mail.uid( 'fetch', ','.join( lstUIDs ), strFetch )[1]
+        if strSearch :
 
-        except :
-            print( 'Unable to fetch (raw) fields for emails from folder ' + self.folder )
+            typ, untagged = results.pop(0)
 
+            if typ == 'OK' :
+                uids = _parseSearch( untagged )
 
+            else :
+                print( 'Unable to retrieve UIDs of emails specified by strSearch from IMAP server in folder: ' + self.folder )
 
-    def copy( self, lstUIDs, folder ) :
+        if prefetch and uids is not None :
 
-        '''
-        Method copyies the emails specified by list 'lstUIDs' to the specified folder (a string). This method will work with EXAMINE as well as SELECT.
-        '''
+            typ, untagged = results.pop(0)
 
-        try :
-            self.mail.uid( 'copy', ','.join( lstUIDs ), folder )
+            if typ == 'OK' :
+                headers = _parseHeaders( untagged.get( 'FETCH', [] ), uids, lstFields )
 
-        except :
-            print( 'Unable to copy specified emails to folder ' + folder + '.' )
+        return ( nums, uids, headers )
 
 
 
 
-    def delete( self, lstUIDs ) :
+    @timed
+    def uidValidity( self ) :
 
         '''
-        Method marks the emails specified by list lstUIDs for deletion by setting the \Deleted flag.
+        Method to return the UIDVALIDITY of the currently selected folder as an integer. The UIDs of emails in a folder are only guaranteed to refer to the same emails across sessions as long as the UIDVALIDITY of the folder remains unchanged.
 
-        Note: The emails won't actually be deleted until the .logout or .expunge method is called.
+        The value is reported by the server as a response to the SELECT/EXAMINE command so this method must be called after .select() or .examine(). If it wasn't reported we ask for it explicitly using STATUS.
         '''
 
-        try :
-            self.mail.uid( 'STORE', ','.join( lstUIDs ), '+FLAGS', '(\Deleted)' )		# The command wouldn't work without putting some of the strings in all caps
+        try:
+            tmpStr = self.mail.response( 'UIDVALIDITY' )[1][0]
 
-        except :
-            print( 'Unable to set \Deleted flags on specified emails.' )
+            if tmpStr is None :		# The UIDVALIDITY was not included in the response to SELECT/EXAMINE
+
+                tmpStr = _substring( '.*UIDVALIDITY ([0-9]*).*', self.mail.status( self.folder, "(uidvalidity)" )[1][0] )
 
+            return int( tmpStr )
 
+        except:
+            print( 'Unable to receive UIDVALIDITY of folder: ' + self.folder )
 
 
-    def expunge( self ) :
+
+
+    @timed
+    def highestModSeq( self ) :
 
         '''
-        Method calls the IMAP expunge command which permenantly deletes any emails marked for deletion in the current folder.
+        Method to return the HIGHESTMODSEQ of the currently selected folder as an integer. Any change to the flags of an email in the folder increases this value.
+
+        The value is only reported by the server as a response to SELECT/EXAMINE if CONDSTORE has been enabled (see .enableCondstore()). None is returned if it is not available.
         '''
 
-        self.mail.expunge()
+        if not self.condstore :
 
+            return None
 
+        try:
+            tmpStr = self.mail.response( 'HIGHESTMODSEQ' )[1][0]
 
+        except:
+            print( 'Unable to receive HIGHESTMODSEQ of folder: ' + self.folder )
 
-def _substring( pattern, string ) :
+        else:
+            if tmpStr :
+                return int( tmpStr )
 
-    '''
+
+
+
+    @timed
+    def listFolders( self ) :
+
+        '''
+        Method lists all the folders in the account on the imap server. The output is a raw string.
+
+        The method assumes that self.login() has been called i.e. self.mail is currently connected to the user's account.
+        '''
+
+        try:
+            tmpList = self.mail.list()[1]		# The first member of list() is the result of the attempt. 'OK' if successful. The second member is the list.
+        except:
+            print( 'Unable to list folders in account' )
+
+
+        return tmpList
+
+
+
+
+    @timed
+    def totalMsgs( self ) :
+
+        '''
+        Method to return total number of messages in currently selected folder.
+        '''
+
+        try:
+            tmpStr = self.mail.status( self.folder, "(messages)" )[1][0]	  # status returns list of lists with us needing the first element of the second list
+
+        except:
+            print( 'Unable to receive total number of messages in folder: ' + self.folder )
+
+        else:
+            return int( _substring( '.*MESSAGES ([0-9]*).*', tmpStr ) )		# Returned as an integer NOT a string
+
+
+
+
+    @timed
+    def unseenMsgs( self ) :
+
+        '''
+        Method to return number of unseen messages in currently selected folder.
+        '''
+
+        try:
+            tmpStr = self.mail.status( self.folder, "(unseen)" )[1][0]
+
+        except:
+            print( 'Unable to receive number of unseen messages in folder: ' + self.folder )
+
+        else:
+            return int( _substring( ".*UNSEEN ([0-9]*).*", tmpStr ) )
+
+
+
+    @timed
+    def numMsgs( self ) :
+
+        '''
+        Method to return both the number of total messages and unseen messages in one go as a tuple of form (total, unseen).
+        '''
+
+        try:
+            tmpStr = self.mail.status( self.folder, "(messages unseen)" )[1][0]
+
+            numAll = int( _substring( '.*MESSAGES ([0-9]*).*', tmpStr ) )		# Fails if the server responded with NO (e.g. the folder doesn't exist)
+            numUnseen = int( _substring( '.*UNSEEN ([0-9]*).*', tmpStr ) )
+
+        except:
+            print( 'Unable to receive number of total and unseen messages in folder: ' + self.folder )
+
+        else:
+
+            return (numAll, numUnseen)
+
+
+
+    @timed
+    def folderStatus( self, lstFolders ) :
+
+        '''
+        Method to return the number of total and unseen messages of each of the folders in the list 'lstFolders' WITHOUT selecting them. The output is a dictionary mapping the name of each folder to a tuple of form (total, unseen). Folders the server doesn't report on (e.g. folders that don't exist) are missing from the dictionary. None is returned if the command fails.
+
+        If the server supports LIST-STATUS (RFC 5819) the status of all of the folders is requested with a single LIST command. Otherwise one STATUS command is sent per folder. These are pipelined (see ._pipeline()) so that checking ten folders still costs a single round trip.
+        '''
+
+        try :
+            if 'LIST-STATUS' in self.capabilities :
+
+                patterns = '(' + ' '.join( [ _quoteFolder( folder ) for folder in lstFolders ] ) + ')'		# Several patterns in one LIST command are allowed by LIST-EXTENDED (RFC 5258) which LIST-STATUS requires
+
+                typ, dat = self.mail._simple_command( 'LIST', '""', patterns, 'RETURN', '(STATUS (MESSAGES UNSEEN))' )
+
+                data = self.mail._untagged_response( typ, dat, 'STATUS' )[1]
+
+            else :		# A folder that doesn't exist gets a NO (or BAD) response. It is simply left out.
+
+                data = []
+
+                for typ, untagged in self._pipeline( [ ( 'STATUS', folder, '(MESSAGES UNSEEN)' ) for folder in lstFolders ] ) :
+
+                    data += untagged.get( 'STATUS', [] )
+
+        except :
+            print( 'Unable to receive the status of the folders in IMAP server.' )
+
+        else :
+
+            return _parseStatus( data )
+
+
+
+    @timed
+    def getUids( self, strSearch ) :
+
+        '''
+        Method to return the unique UIDs of emails from current folder based upon the status of certain flags as specified by 'strSearch'. The method has the ability to return the UIDs of all messages or just unseen messages .etc.
+
+        strSearch excepts all of the strings accepted by the SEARCH method in the IMAP protocol. We will mostly be working with "ALL" and "UNSEEN".
+
+        If the server supports ESEARCH (RFC 4731) the UIDs are requested as a sequence set (RETURN (ALL)) in which consecutive UIDs are collapsed in to ranges. For a large folder this is a fraction of the size of the plain list of UIDs.
+        '''
+
+        try:
+            if 'ESEARCH' in self.capabilities :
+
+                typ, dat = self.mail.uid( 'search', None, 'RETURN', '(ALL)', strSearch )
+
+                typ, dat = self.mail._untagged_response( typ, dat, 'ESEARCH' )
+
+                m = reEsearchAll.search( dat[-1] or '' )		# No ALL item is returned if nothing matches
+
+                return _expandUidSet( m.group(1) ) if m else []
+
+            return self.mail.uid( 'search', None, strSearch )[1][0].split()		# This generates a list of UIDs as strings containing integers only.
+
+        except:
+            print( 'Unable to retrieve UIDs of emails specified by strSearch from IMAP server in folder: ' + self.folder )
+
+
+
+
+    def _pipeline( self, commands, window = None ) :
+
+        '''
+        Hidden method which sends the IMAP commands in the list 'commands' back to back, without waiting for the response to one command before sending the next, and then reads the responses. imaplib on its own sends a command and waits for its response before it lets us send another, so every command costs a round trip to the server. Pipelined, a whole batch of commands costs little more than one.
+
+        Each command is a tuple of the command name followed by its arguments, as passed to imaplib's ._command() (e.g. ( 'UID', 'SEARCH', 'UNSEEN' )). Only commands that don't depend on each other's results should be pipelined.
+
+        The responses are matched to the commands by their tags. Servers send the untagged responses (the data) of a command before its tagged response (the completion) so the untagged responses received while waiting for the tagged response of a command are attributed to that command.
+
+        window: The maximum number of commands that are sent before waiting for the first of them to complete (None means no limit). A window is needed when the responses are large since the server may stop reading our commands while we aren't reading its responses.
+
+        Returns a list with a tuple (typ, untagged) for each command: 'typ' is the result of the command ('OK', 'NO' or 'BAD') and 'untagged' is a dictionary of its untagged responses keyed by type (as imaplib's untagged_responses). The responses are NOT left in imaplib's untagged_responses. If the connection is lost an exception is raised.
+        '''
+
+        results = []
+        pending = []		# ( name, tag ) of the commands sent whose responses haven't been read yet
+        queued = []		# Lines of the commands not yet written
+
+        send = self.mail.send
+
+        self.mail.send = queued.append		# imaplib writes every command on its own. The commands of a batch are collected and written together instead: written one at a time they would trickle out, since Nagle's algorithm holds back a small write until the previous one has been acknowledged.
+
+        try :
+            for command in commands :
+
+                if window and len( pending ) == window :
+
+                    send( ''.join( queued ) )
+
+                    del queued[:]
+
+                    results.append( self._complete( *pending.pop(0) ) )
+
+                pending.append( ( command[0], self.mail._command( *command ) ) )
+
+        finally :
+            del self.mail.send
+
+        send( ''.join( queued ) )
+
+        for name, tag in pending :
+
+            results.append( self._complete( name, tag ) )
+
+        return results
+
+
+
+
+    def _complete( self, name, tag ) :
+
+        '''
+        Hidden method which reads the responses to the (already sent) command 'name' with the tag 'tag'. Returns the tuple (typ, untagged) described in ._pipeline().
+        '''
+
+        saved = self.mail.untagged_responses
+
+        self.mail.untagged_responses = {}		# Collects the untagged responses of this command alone
+
+        try :
+            typ = self.mail._command_complete( name, tag )[0]
+
+        except self.mail.abort :		# The connection has been lost
+
+            raise
+
+        except self.mail.error :		# imaplib raises an exception for a BAD response
+
+            typ = 'BAD'
+
+        finally :
+            untagged = self.mail.untagged_responses
+
+            self.mail.untagged_responses = saved
+
+        return ( typ, untagged )
+
+
+
+
+    def _uidCommand( self, command, lstUIDs, *args ) :
+
+        '''
+        Hidden method that replaces imaplib's .uid() for commands that act on the list of emails 'lstUIDs' (UIDs as strings). 'args' are the arguments that follow the UID set in the command.
+
+        The UIDs are sent as a compact set (see _uidSets()). If they don't fit in to a single set of reasonable length the command is sent once per set. These commands are pipelined (see ._pipeline()) with a window of 4, so that a large number of sets costs little more than a single round trip.
+
+        The return value is the same as that of .uid(): The untagged FETCH responses of ALL the commands are returned together. The status is 'OK' only if every command succeeded. A BAD response raises an exception, as with .uid().
+        '''
+
+        typ, data = 'OK', []
+
+        for result, untagged in self._pipeline( [ ( 'UID', command.upper(), uidSet ) + args for uidSet in _uidSets( lstUIDs ) ], window = 4 ) :
+
+            if result == 'BAD' :
+
+                raise self.mail.error( 'UID ' + command.upper() + ' command error' )
+
+            if result != 'OK' :	typ = result
+
+            data += untagged.get( 'FETCH', [] )
+
+        return ( typ, data or [ None ] )
+
+
+
+
+    @timed
+    def fetchHeaders( self, lstUIDs, lstFields = ['from', 'subject'] ) :
+
+        '''
+        Method to fetch fields specified by the list of strings 'lstFields' of the emails whose UIDs are in the list 'lstUIDs' from the current folder.
+
+        lstUIDs is a list of UIDs, each UID being a string containing an integer.
+
+        lstFields is a list of strings specifying the HEADER fields that fetch will use to extract information from the specified emails. A common example for fetching just 'from' and 'subject' fields is ['from', 'subject']. The field names are case-insensitive.
+
+        The output of this method is a dictionary of dictonaries. Each UID is associated with a dictionary where the keys are the values of lstFields. Additionally each such dictionary contains the key 'flags' which holds the raw flags string of the email (e.g. '\\Seen \\Answered') since these are fetched in the same request.
+
+        All of the fields, the flags and the UID of every email are retrieved using a single UID FETCH command (one round trip to the server). BODY.PEEK is used so that fetching the headers does not set the \Seen flag on the emails.
+        '''
+
+        data = []
+
+        try :
+            data = self._uidCommand( 'FETCH', lstUIDs, _headerItems( lstFields ) )[1]
+
+        except :
+            print( 'Unable to fetch header fields from folder ' + self.folder )
+
+        return _parseHeaders( data, lstUIDs, lstFields )
+
+
+
+
+    @timed
+    def fetchHeadersAndFlags( self, lstUIDs, lstFields, flagUIDs = [], modSeq = None ) :
+
+        '''
+        Method which fetches the header fields 'lstFields' of the emails in 'lstUIDs' (see .fetchHeaders()) and, in the same round trip, the flags of the emails in 'flagUIDs' (see .fetchFlags()) or, if 'modSeq' is specified, the flags that have changed since then (see .syncFlags()). All of the commands are pipelined (see ._pipeline()).
+
+        Returns the tuple (headers, flags, vanished): 'headers' is the dictionary returned by .fetchHeaders(), 'flags' a dictionary mapping UIDs to their raw flags string (for the emails in 'lstUIDs' as well) and 'vanished' the list of UIDs returned by .syncFlags(). Nothing is sent to the server if there is nothing to fetch.
+        '''
+
+        commands = [ ( 'UID', 'FETCH', uidSet, _headerItems( lstFields ) ) for uidSet in _uidSets( lstUIDs ) ]
+
+        if modSeq :
+
+            commands.append( ( 'UID', 'FETCH', '1:*', '(UID FLAGS)', _changedSince( modSeq, self.qresync ) ) )
+
+        elif flagUIDs :
+
+            commands += [ ( 'UID', 'FETCH', uidSet, '(UID FLAGS)' ) for uidSet in _uidSets( flagUIDs ) ]
+
+        data = []
+        vanished = []
+
+        try :
+            for typ, untagged in self._pipeline( commands, window = 4 ) :
+
+                data += untagged.get( 'FETCH', [] )		# The responses of all of the commands are parsed together so it doesn't matter which command the server attributes a FETCH response to
+
+                for item in untagged.get( 'VANISHED', [] ) :
+
+                    if item :
+                        vanished += _expandUidSet( item.split()[-1] )
+
+        except :
+            print( 'Unable to fetch header fields from folder ' + self.folder )
+
+        flags = dict( [ ( uid, flagStr ) for uid, flagStr, header in _splitFetch( data ) ] )
+
+        return ( _parseHeaders( data, lstUIDs, lstFields ), flags, vanished )
+
+
+
+
+    @timed
+    def fetchFlags( self, lstUIDs ) :
+
+        '''
+        Method for fetching flags for the specified emails. Returns a dictionary mapping each UID to its raw flags string.
+        '''
+
+        output = {}	# Create empty dictionary
+
+        try :
+            data = self._uidCommand( 'FETCH', lstUIDs, '(UID FLAGS)' )[1]
+
+        except :
+            print( 'Unable to fetch flags for specified emails.' )
+
+        else :
+            # Different email servers use different formats (and orders) for reporting the flags associated with emails in the folder. _splitFetch looks for the UID and FLAGS items independently so it covers all the possibilities.
+
+            for uid, flags, header in _splitFetch( data ) :
+
+                output[ uid ] = flags
+
+            return output
+
+
+
+
+    @timed
+    def syncFlags( self, modSeq ) :
+
+        '''
+        Method for fetching ONLY the flags that have changed since the folder had the HIGHESTMODSEQ 'modSeq' (stored from a previous poll). Requires CONDSTORE to have been enabled (see .enableCondstore()).
+
+        Returns a tuple (flags, vanished) where 'flags' is a dictionary mapping the UIDs of the changed emails to their raw flags string and 'vanished' is a list of the UIDs of emails that have been expunged since. The latter is only available if QRESYNC has been enabled, otherwise it is an empty list.
+        '''
+
+        output = {}
+        vanished = []
+
+        try :
+            data = self.mail.uid( 'fetch', '1:*', '(UID FLAGS) ' + _changedSince( modSeq, self.qresync ) )[1]
+
+            if self.qresync :
+
+                for item in self.mail.response( 'VANISHED' )[1] :		# Each item is of the form '(EARLIER) 41,43:116'
+
+                    if item :
+                        vanished += _expandUidSet( item.split()[-1] )
+
+        except :
+            print( 'Unable to fetch changed flags from folder ' + self.folder )
+
+        else :
+
+            for uid, flags, header in _splitFetch( data ) :
+
+                output[ uid ] = flags
+
+        return ( output, vanished )
+
+
+
+
+    @timed
+    def fetch( self, lstUIDs, strFetch ) :
+
+        '''
+        Wrapper method for the IMAP 'fetch' command. This accepts the standard string used in an IMAP 'fetch' request, along with a list of UIDs identifying the emails for which the fetch request will be carried out. The output is the raw unformatted, unfiltered text that is returned by the server.
+
+        The standard request to get just 'From' and 'Subject' fields is to use strFetch = '(BODY[HEADER.FIELDS (from subject)])'
+        '''
+
+        try :
+            return self._uidCommand( 'FETCH', lstUIDs, strFetch )[1]
+
+        except :
+            print( 'Unable to fetch (raw) fields for emails from folder ' + self.folder )
+
+
+
+    @timed
+    def copy( self, lstUIDs, folder ) :
+
+        '''
+        Method copyies the emails specified by list 'lstUIDs' to the specified folder (a string). This method will work with EXAMINE as well as SELECT.
+        '''
+
+        try :
+            self._uidCommand( 'COPY', lstUIDs, folder )
+
+        except :
+            print( 'Unable to copy specified emails to folder ' + folder + '.' )
+
+
+
+
+    @timed
+    def delete( self, lstUIDs ) :
+
+        '''
+        Method marks the emails specified by list lstUIDs for deletion by setting the \Deleted flag.
+
+        Note: The emails won't actually be deleted until the .logout or .expunge method is called.
+        '''
+
+        try :
+            self._uidCommand( 'STORE', lstUIDs, '+FLAGS', '(\Deleted)' )		# The command wouldn't work without putting some of the strings in all caps
+
+        except :
+            print( 'Unable to set \Deleted flags on specified emails.' )
+
+
+
+
+    @timed
+    def expunge( self ) :
+
+        '''
+        Method calls the IMAP expunge command which permenantly deletes any emails marked for deletion in the current folder.
+        '''
+
+        self.mail.expunge()
+
+
+
+
+    @timed
+    def move( self, lstUIDs, folder ) :
+
+        '''
+        Method moves the emails specified by list 'lstUIDs' to the specified folder in a single command (RFC 6851 UID MOVE). This replaces copying the emails, flagging them as deleted and expunging them. Returns True if the emails were moved. If the server doesn't support MOVE nothing is sent and False is returned.
+        '''
+
+        if not 'MOVE' in self.capabilities :
+
+            return False
+
+        imaplib.Commands.setdefault( 'MOVE', ( 'SELECTED', ) )		# Older versions of imaplib don't know about the MOVE command
+
+        try :
+            typ, dat = self._uidCommand( 'MOVE', lstUIDs, folder )
+
+        except :
+            print( 'Unable to move specified emails to folder ' + folder + '.' )
+            return False
+
+        return typ == 'OK'
+
+
+
+
+    @timed
+    def uidExpunge( self, lstUIDs ) :
+
+        '''
+        Method permanently deletes the emails specified by list 'lstUIDs' (which must already be flagged as deleted). Unlike .expunge() emails flagged as deleted by some other means are left alone. Requires the UIDPLUS extension (RFC 4315): If the server doesn't support it nothing is sent and False is returned.
+        '''
+
+        if not 'UIDPLUS' in self.capabilities :
+
+            return False
+
+        try :
+            typ, dat = self._uidCommand( 'EXPUNGE', lstUIDs )
+
+        except :
+            print( 'Unable to expunge specified emails.' )
+            return False
+
+        return typ == 'OK'
+
+
+
+
+def _hostPort( server, port ) :
+
+    '''
+    This is a hidden external function which splits a servername of the form 'host:port' in to the tuple ( host, port ). If no port is specified 'port' (the default port) is returned along with the servername.
+    '''
+
+    host, sep, suffix = server.rpartition( ':' )
+
+    if sep and suffix.isdigit() :
+
+        return ( host, int( suffix ) )
+
+    return ( server, port )
+
+
+
+def _substring( pattern, string ) :
+
+    '''
     This is a hidden external function in this module which is used to extract a specific substring of a string based on a pattern supplied. The pattern is regex where the first group specified will be returned.
     '''
 
@@ -388,9 +1138,283 @@ def _substring( pattern, string ) :
 def _reduceWhitespace( string ) :
 
     '''
-    This is a hidden external function that is meant to be applied on strings returned by the imap server. Its intent is to remove '\r' and '\n', replace '\t' with a single space and reduce any occurence of more than one consecutive space with a single space. It achieves this using regular expressions and the substitute command.
+    This is a hidden external function that is meant to be applied on strings returned by the imap server. Its intent is to remove '\r' and '\n' and reduce any run of spaces and tabs to a single space. Line breaks in a header value are always followed by whitespace (that is what makes it a folded header) so splitting on whitespace and joining with single spaces achieves this in a single pass, without any regular expressions.
     '''
 
-    import re
+    return ' '.join( string.split() )
+
+
+
+def _splitFetch( data ) :
+
+    '''
+    This is a hidden external function which parses the raw data returned by imaplib for a UID FETCH command. It is a generator which yields a (uid, flags, header) tuple for each email as soon as the response of that email is complete, so that the data is processed in a single pass, as it is consumed.
+
+    imaplib returns an email whose response contains a literal (the header block) as a tuple (prefix, literal) followed by a string containing the remainder of the response line. Emails without a literal are returned as a single string. Servers are free to place the UID and FLAGS items before or after the literal (and in any order) so we look for them in both the prefix and the remainder.
+
+    Every email is identified by the UID in its own response, never by its position in the data. Servers may answer in any order and may include unsolicited FETCH responses (e.g. flag changes made by another client). Responses without a UID can not be associated with any email and are skipped.
+    '''
+
+    meta = None		# The response line(s) of the email currently being parsed
+    header = ''
+
+    for item in data :
+
+        if isinstance( item, tuple ) :		# Start of an email with a literal. The literal is the header block.
+
+            if meta is not None :
+
+                email = _fetchItems( meta, header )
+
+                if email :	yield email
+
+            meta, header = item[0], item[1]
+
+        elif item and reFetchStart.match( item ) :		# An email without a literal, contained completely in one string
+
+            if meta is not None :
+
+                email = _fetchItems( meta, header )
+
+                if email :	yield email
+
+            meta, header = item, ''
+
+        elif item and meta is not None :		# Remainder of the response line of the previous email following its literal
+
+            meta += item
+
+    if meta is not None :
+
+        email = _fetchItems( meta, header )
+
+        if email :	yield email
+
+
+
+def _fetchItems( meta, header ) :
+
+    '''
+    This is a hidden external function which extracts the UID and flags from the response line(s) 'meta' of a single email. Returns the tuple (uid, flags, header) or None if the response contains no UID.
+    '''
+
+    m = reFetchUid.search( meta )
+
+    if not m :
+
+        return None
+
+    f = reFetchFlags.search( meta )
+
+    return ( m.group(1), f.group(1) if f else '', header )
+
+
+
+def _parseHeaderBlock( header ) :
+
+    '''
+    This is a hidden external function which accepts a raw block of header lines (as returned by a BODY[HEADER.FIELDS (...)] fetch) and returns a dictionary mapping the lower-case field names to their values. Folded (multi-line) header values are unfolded and their whitespace reduced.
+    '''
+
+    fields = {}
+
+    for line in reHeaderLine.split( header ) :		# Split only at line breaks that are NOT followed by whitespace since those indicate a folded header
+
+        name, sep, value = line.partition( ':' )
+
+        if sep and name.strip() :
+
+            fields[ name.strip().lower() ] = _reduceWhitespace( value )
+
+    return fields
+
+
+
+def _headerItems( lstFields ) :
+
+    '''
+    This is a hidden external function which returns the FETCH items used to fetch the UID, flags and the header fields 'lstFields' of emails. BODY.PEEK is used so that fetching the headers does not set the \Seen flag on the emails.
+    '''
+
+    return '(UID FLAGS BODY.PEEK[HEADER.FIELDS (' + ' '.join( lstFields ).upper() + ')])'
+
+
+
+def _changedSince( modSeq, qresync ) :
+
+    '''
+    This is a hidden external function which returns the FETCH modifier asking for the emails that have changed since 'modSeq' (and, with QRESYNC, for those that have been expunged since, see imapServer.syncFlags()).
+    '''
+
+    if qresync :
+
+        return '(CHANGEDSINCE ' + str( modSeq ) + ' VANISHED)'
+
+    return '(CHANGEDSINCE ' + str( modSeq ) + ')'
+
+
+
+def _parseHeaders( data, lstUIDs, lstFields ) :
+
+    '''
+    This is a hidden external function which parses the FETCH responses 'data' (see imapServer.fetchHeaders()) in to the dictionary of dictionaries returned by imapServer.fetchHeaders(). Only the emails in 'lstUIDs' are included.
+    '''
+
+    output = {}
+
+    for item in lstUIDs :	output[ item ] = dict( [ ( field, '' ) for field in lstFields ] + [ ( 'flags', '' ) ] )	# Initiate the output dictionary of dictionaries. Fields missing from an email are left as empty strings.
+
+    for uid, flags, header in _splitFetch( data ) :		# Each email in the response is reduced to its UID, flags string and raw header block
+
+        if not uid in output :		# Ignore any response that does not belong to the requested UIDs
+
+            continue
+
+        output[ uid ][ 'flags' ] = flags
+
+        fields = _parseHeaderBlock( header )
+
+        for field in lstFields :
+
+            if field.lower() in fields :
+
+                output[ uid ][ field ] = fields[ field.lower() ]
+
+    return output
+
+
+
+def _parseSearch( untagged ) :
+
+    '''
+    This is a hidden external function which returns the list of UIDs in the response to UID SEARCH, given the dictionary of untagged responses 'untagged'. Both the ESEARCH (RFC 4731) and the plain SEARCH response are understood (see imapServer.getUids()).
+    '''
+
+    if 'ESEARCH' in untagged :
+
+        m = reEsearchAll.search( untagged[ 'ESEARCH' ][-1] or '' )		# No ALL item is returned if nothing matches
+
+        return _expandUidSet( m.group(1) ) if m else []
+
+    return ' '.join( [ x for x in untagged.get( 'SEARCH', [] ) if x ] ).split()
+
+
+
+def _quoteFolder( folder ) :
+
+    '''
+    This is a hidden external function which quotes the name of a folder for use inside a parenthesized list, where imaplib doesn't quote arguments for us.
+    '''
+
+    return '"' + folder.replace( '\\', '\\\\' ).replace( '"', '\\"' ) + '"'
+
+
+
+def _parseStatus( data ) :
+
+    '''
+    This is a hidden external function which parses the data of untagged STATUS responses (e.g. '"Sent Items" (MESSAGES 20 UNSEEN 3)') in to a dictionary mapping the name of each folder to the tuple (total, unseen). Responses that can't be parsed (such as a folder name sent as a literal) are skipped.
+    '''
+
+    output = {}
+
+    for item in data :
+
+        m = isinstance( item, str ) and reStatus.match( item )
+
+        if not m :
+
+            continue
+
+        folder, items = m.groups()
+
+        if folder.startswith( '"' ) :
+
+            folder = re.sub( r'\\(.)', r'\1', folder[ 1 : -1 ] )
+
+        numAll = reStatusMessages.search( items )
+        numUnseen = reStatusUnseen.search( items )
+
+        if numAll and numUnseen :
+
+            output[ folder ] = ( int( numAll.group(1) ), int( numUnseen.group(1) ) )
+
+    return output
+
+
+
+def _expandUidSet( uidSet ) :
+
+    '''
+    This is a hidden external function which expands an IMAP sequence set of UIDs (e.g. '41,43:46') in to a list of UIDs as strings (e.g. ['41', '43', '44', '45', '46']).
+    '''
+
+    output = []
+
+    for part in uidSet.split( ',' ) :
+
+        if ':' in part :
+
+            start, end = sorted( [ int( x ) for x in part.split( ':' ) ] )
+
+            output += [ str( x ) for x in range( start, end + 1 ) ]
+
+        elif part :
+
+            output.append( part )
+
+    return output
+
+
+
+def _uidSets( lstUIDs, maxLength = 8000 ) :
+
+    '''
+    This is a hidden external function which encodes a list of UIDs (strings containing integers, in any order) as compactly as possible in IMAP sequence set syntax: runs of consecutive UIDs are collapsed in to ranges (e.g. ['41', '43', '44', '45', '46'] becomes '41,43:46'). It is the inverse of _expandUidSet().
+
+    Returns a LIST of sets, none of which is longer than 'maxLength' characters. Most commands need just one but a large folder whose UIDs are scattered (after years of deletions) can still produce a set far longer than the command lines servers are willing to accept (RFC 7162 recommends that clients limit them to 8192 octets), in which case the UIDs are split across several sets, each of which is sent in its own command.
+    '''
+
+    uids = sorted( set( int( uid ) for uid in lstUIDs ) )
+
+    ranges = []
+
+    for uid in uids :
+
+        if ranges and ranges[-1][1] == uid - 1 :
+
+            ranges[-1][1] = uid
+
+        else :
+
+            ranges.append( [ uid, uid ] )
+
+    output = []
+    parts = []
+    length = 0
+
+    for start, end in ranges :
+
+        if start == end :
+
+            part = str( start )
+
+        else :
+
+            part = str( start ) + ':' + str( end )
+
+        if parts and length + len( part ) + 1 > maxLength :
+
+            output.append( ','.join( parts ) )
+
+            parts = []
+            length = 0
+
+        parts.append( part )
+        length += len( part ) + 1
+
+    if parts :
+
+        output.append( ','.join( parts ) )
 
-    return re.sub( ' \s*', ' ', re.sub( '\t', ' ', re.sub( '[\r|\n]', '', string ) ) )
+    return output
@@ -28,38 +28,209 @@ def pollAccount( account ) :
     This function accepts a dictionary associated with a SINGLE account (a particular email address on a particular imap server) and carries out all the actions required to connect with said account (poll it) and get email information AND display it.
     """
 
-    # Note: The way this function is currently constructed it produces no direct ouput to stdout but rather stores it in a buffer class object which it returns. The calling function decides when to display the information. This has been done to facilitate the parallelizing of polling of the accounts.
+    # Note: The way this function is currently constructed it produces no direct ouput to stdout but rather stores it in a buffer class object which it returns. The calling function decides when to display the information. This has been done to facilitate the parallelizing of polling of the accounts. One Output object is returned for each folder of the account (as a list, see accountFolders()).
 
     from imapServer import imapServer
-    import re
-    from copy import deepcopy
+    from asyncImapServer import runSync
 
-    cW = colorWidth		# Rename function for easier typing and clarity
+    mail = imapServer( account['host'], account['useSSL'], account.get( 'connectTimeout' ), account.get( 'readTimeout' ), newStats( account ) )     # We pass in the useSSL flag that we get from config which tells imapServer whether SSL is to be used or not, along with the connection timeouts (see setOptions() in fetchheaders.py)
 
+    return runSync( _pollAccount( account, mail ) )		# The blocking imapServer methods return their results directly so the coroutine is simply run to completion
 
-    numUnseen = -1		# Set unequal to zero in case showNums = False
 
-    mail = imapServer( account['host'], account['useSSL'] )     # We pass in the useSSL flag that we get from config which tells imapServer whether SSL is to be used or not
 
-    mail.login( account['username'], account['password'] )
 
-    mail.examine()
+def asyncPollAccount( account ) :
+
+    '''
+    The asynchronous counterpart of pollAccount(). This is a coroutine that must be run by an asyncImapServer.eventLoop (see asyncExec()). It returns the same list of Output objects as pollAccount().
+    '''
+
+    from asyncImapServer import asyncImapServer, Return
+
+    mail = asyncImapServer( account['host'], account['useSSL'], account.get( 'connectTimeout' ), account.get( 'readTimeout' ), newStats( account ) )
+
+    yield mail.connect()
+
+    outs = yield _pollAccount( account, mail )
+
+    raise Return( outs )
+
+
+
+
+def _pollAccount( account, mail ) :
+
+    '''
+    This coroutine carries out the actual polling of an account for both pollAccount() and asyncPollAccount(). 'mail' is either an imapServer or an asyncImapServer object (connected to the server). Every call to one of its methods is yielded: the result of a blocking imapServer method is simply sent back while an asyncImapServer method is run by the event loop. The list of Output objects (one per folder) is returned by raising Return.
+    '''
+
+    from asyncImapServer import Return
+
+
+    yield mail.login( account['username'], account['password'] )
+
+    if account.get( 'useCache' ) and not account[ 'showUnseen' ] and not account[ 'showOnlyNums' ] :		# The flags of cached emails are only synchronized when ALL emails are displayed. If the server supports CONDSTORE this lets us fetch only the flags that have changed.
+
+        yield mail.enableCondstore()
+
+    outs = yield _pollFolders( account, mail )
+
+    if [ out for out in outs if out.error ] :		# No point trying to logout if the server couldn't be read
+
+        raise Return( outs )
+
+    yield mail.logout()
+
+    raise Return( outs )		# Return the Output data structures we have just populated
+
 
 
+
+def newStats( account ) :
+
+    '''
+    Returns a new pollStats object in which the statistics of polling the account are to be collected if they were requested (with --stats, see applyArgs() in fetchheaders.py) and None otherwise.
+    '''
+
+    if account.get( 'stats' ) :
+
+        from pollStats import pollStats
+
+        return pollStats()
+
+
+
+
+def accountFolders( account ) :
+
+    '''
+    Returns a list with the settings of each of the folders of the account (the account's 'folder' setting is a list of folders). These are copies of the account dictionary whose 'folder' is a single folder. If the account has more than one folder the name of the folder is appended to the 'name' of each (e.g. 'Work/Lists') so that every folder is displayed as a separate account. 'account' always holds the name of the account itself.
+    '''
+
+    folders = account[ 'folder' ]
+
+    if isinstance( folders, basestring ) :		# Settings passed in by older versions of fetchheaders (e.g. to a running daemon)
+
+        folders = [ folders ]
+
+    if len( folders ) == 1 :
+
+        return [ dict( account, folder = folders[0], account = account[ 'name' ] ) ]
+
+    return [ dict( account, folder = folder, name = account[ 'name' ] + '/' + folder, account = account[ 'name' ] ) for folder in folders ]
+
+
+
+
+def _pollFolders( account, mail ) :
+
+    '''
+    This coroutine polls each of the folders of an account (see accountFolders()) over the single connection 'mail', which must already be logged in, and returns the list of their Output objects (by raising Return). It is used by _pollAccount() and by the daemon (see fetchDaemon).
+
+    If the account has several folders and the numbers of emails are to be displayed, or only unseen emails are, the status of ALL of the folders is first requested in one go without selecting any of them (see imapServer.folderStatus()). A folder that has no unseen emails (when only those are displayed) or of which only the numbers are displayed is then never examined. So checking ten folders costs ten STATUS responses rather than ten logins (or even ten EXAMINEs). A single folder is simply examined since its numbers are requested in the same round trip (see imapServer.openFolder()).
+    '''
+
+    from asyncImapServer import Return
+
+
+    folders = accountFolders( account )
+
+    status = {}
+
+    if len( folders ) > 1 and ( account[ 'showNums' ] or account[ 'showUnseen' ] or account[ 'showOnlyNums' ] ) :
+
+        status = ( yield mail.folderStatus( [ settings[ 'folder' ] for settings in folders ] ) ) or {}		# If the status isn't available every folder is simply examined
+
+    outs = []
+
+    for settings in folders :
+
+        nums = status.get( settings[ 'folder' ] )
+
+        if nums and ( settings[ 'showOnlyNums' ] or settings[ 'showUnseen' ] and nums[1] == 0 ) :		# Nothing more to find out about this folder
+
+            out = Output( settings )
+
+            if settings[ 'showNums' ] :
+
+                out.numAll, out.numUnseen = nums
+
+        else :
+
+            out = yield _pollFolder( settings, mail, nums )
+
+        out.stats = mail.stats		# Every folder shares the statistics of the connection (None unless requested)
+
+        outs.append( out )
+
+    raise Return( outs )
+
+
+
+
+def _pollFolder( account, mail, nums = None ) :
+
+    '''
+    This coroutine examines the folder of an account on a server that 'mail' is already logged in to and returns the populated Output object (by raising Return). 'account' holds the settings of a single folder (see accountFolders()). It is used by _pollFolders() as well as by the watch mode (see accountWatcher).
+
+    nums: The tuple (total, unseen) for the folder if it is already known (see _pollFolders()), in which case it isn't requested again.
+    '''
+
+    from headerCache import openCache
+    from asyncImapServer import Return
+    import time
+
+
+    numUnseen = -1		# Set unequal to zero in case showNums = False
+
     out = Output( account )		# Create Output data structure for imminent population
 
+    strSearch = None
+    filters = None
+
+    if not account[ 'showOnlyNums' ] :
+
+        if account[ 'showUnseen' ] :		# show only unseen emails from the folder
+
+            strSearch = "unseen"
+
+        else :
+
+            strSearch = "all"
+
+        filters = searchFilter( account )
+
+        if filters :		# Only the emails that match the filters are retrieved. The criteria must be parenthesized since imaplib would otherwise quote them as a single string.
+
+            strSearch = '(' + strSearch.upper() + ' ' + filters + ')'
+
+    limit = account.get( 'limit' )
+
+    fields = [ 'from', 'subject', 'date' ]
+
+    prefetch = not account.get( 'useCache' ) and not limit		# The headers of ALL of the emails found will be needed so the server may fetch them along with the search
+
+
+    # The folder is examined, its numbers requested and the search carried out in a single round trip (see imapServer.openFolder()):
+
+    folderNums, ids, data = yield mail.openFolder( account[ 'folder' ], strSearch, account[ 'showNums' ] and nums is None, prefetch and fields or None )
 
 
     if account[ 'showNums' ] :
 
+        if nums is None :
+
+            nums = folderNums
+
         try:
-            (numAll, numUnseen) = mail.numMsgs()
+            (numAll, numUnseen) = nums
 
         except TypeError:           # This happens if an error occurred in connecting to the server and so numMsgs() returns a NoneType object
 
             out.error = True
 
-            return out              # In this case we return out with the error flag set to True
+            raise Return( out )              # In this case we return out with the error flag set to True
 
         out.numAll = numAll		# Store numbers in output object
         out.numUnseen = numUnseen
@@ -68,138 +239,693 @@ def pollAccount( account ) :
     if not account[ 'showOnlyNums' ] :
 
 
-        if account[ 'showUnseen' ] :		# show only unseen emails from the folder
+        if ids is None :		# The folder couldn't be examined or searched
+
+            out.error = True
 
-            ids = mail.getUids( "unseen" )
+            raise Return( out )
 
-        else :
+        allIds = ids
+
+        if limit and len( ids ) > limit :		# Only the headers of the newest emails (those with the highest UIDs) are fetched. The older ones are fetched a page at a time if and when the user scrolls to them (see fetchPage()).
+
+            ids = sorted( ids, key = int )
+
+            out.older.extend( int( uid ) for uid in ids[ : -limit ] )
+
+            ids = ids[ -limit : ]
+
+
+        out.uids.extend( int( uid ) for uid in ids )		# Store the UIDs of the emails retrieived in the general output object
+
+
+        # We open the on-disk header cache for this folder. Only the headers of emails that are NOT in the cache need to be fetched from the server.
+
+        stats = mail.stats
+
+        start = time.time()
+
+        cache = openCache( account, mail.folder )
+
+        cached = {}		# Dictionary of cached Email objects keyed by uid
+
+        if stats :
+
+            stats.add( 'cache', time.time() - start )
+
+        if cache :
+
+            uidValidity = yield mail.uidValidity()
+
+            cache.validate( uidValidity )		# Throws the cache away if the UIDVALIDITY of the folder has changed
+
+            modSeq = yield mail.highestModSeq()		# None unless the server supports CONDSTORE
+
+            start = time.time()
+
+            cached = cache.emails()
+
+            if not account[ 'showUnseen' ] and not filters :		# We have the UIDs of ALL emails in the folder so we can remove the emails from the cache that have since been deleted
+
+                present = set( allIds )
+
+                cache.discard( [ uid for uid in cached if not uid in present ] )
+
+            if stats :
+
+                stats.add( 'cache', time.time() - start )
+
+
+        if len( ids ) > 0 :		# There has to be at least one email to fetch data or otherwise fetchHeaders will throw up an error
+
+
+            newIds = [ uid for uid in ids if not uid in cached ]		# UIDs of emails whose headers are not in the cache
+
+            cachedIds = [ uid for uid in ids if uid in cached ]
+
+            flagIds = []
+            sinceModSeq = None
+
+            if len( cachedIds ) > 0 and not account[ 'showUnseen' ] :		# The Seen flag of cached emails may have changed since they were cached so we refresh them in bulk (only needed when ALL emails are displayed)
+
+                if modSeq and cache.getMeta( 'highestModSeq' ) :		# CONDSTORE: Only the flags that changed since the last poll cross the wire. Emails absent from dicFlags keep their cached flags.
+
+                    sinceModSeq = cache.getMeta( 'highestModSeq' )
+
+                else :		# Fall back to fetching the flags of every cached email
+
+                    flagIds = cachedIds
+
+            dicFlags = {}
+
+            if data is None :		# The headers weren't fetched along with the search. The headers of the new emails and the flags of the cached ones are fetched together in a single round trip.
+
+                data, dicFlags, vanished = yield mail.fetchHeadersAndFlags( newIds, fields, flagIds, sinceModSeq )
+
+                if vanished :
+
+                    cache.discard( vanished )
+
+
+            if account[ 'latestEmailFirst' ] :		# We define an anonymous function that modifies the order in which we access UIDs based on the configuration.
+
+                ids.reverse()
+                out.uids.reverse()		# We must also flip the order in which the uids are stored so that the lines and uids match
+
+
+            if len(ids) > 100 :		# Get number of digits of total number of messages.
+
+                numDigits = len( str( len(ids) ) )		# Used to get number of digits in the number for total number of messages. Crude Hack at best.
+            else :
+
+                numDigits = 2
+
+            out.numDigits = numDigits		# Store the number of digits in the object related to the account
+
+
+            start = time.time()
+
+            changed = []		# List of Email objects which need to be (re-)written to the cache
+
+            emails = yield newEmails( newIds, data )		# The Email objects of the emails that weren't cached (parsed by the parse pool if the folder is large, see startParsePool())
+
+            # We begin by scanning all of the the uids extracted and storing the information in the Output object 'out':
+
+            for uid in ids :
+
+                if uid in cached :		# Header information is available in the cache. Only the Seen flag needs to be updated.
+
+                    email = cached[ uid ]
+
+                    if account[ 'showUnseen' ] :
+
+                        seen = False		# Message is necessarily Unseen
+
+                    elif uid in dicFlags :
+
+                        seen = '\\Seen' in dicFlags[ uid ]
+
+                    else :
+
+                        seen = email.Seen		# Flags haven't changed since the email was cached
+
+                    if seen != email.Seen :
+
+                        email.Seen = seen
+                        changed.append( email )
+
+                    out.emails.append( email )
+
+                    continue
+
+
+                email = emails[ uid ]		# New Email object for insertion in out.emails
+
+                out.emails.append( email )
+
+                changed.append( email )
+
+            if stats :
+
+                stats.add( 'parse', time.time() - start )
+
+
+            if cache :
+
+                start = time.time()
+
+                cache.store( changed )
+
+                if stats :
+
+                    stats.add( 'cache', time.time() - start )
+
+
+        if cache and modSeq and not account[ 'showUnseen' ] and not filters and not out.older :		# The flags of ALL cached emails are now up to date so we store the HIGHESTMODSEQ from which the next poll can synchronize
+
+            cache.setMeta( 'highestModSeq', modSeq )
+
+
+        if cache :
+
+            start = time.time()
+
+            cache.close()		# Commit the changes to the disk
+
+            if stats :
+
+                stats.add( 'cache', time.time() - start )
+
+
+    raise Return( out )
+
+
+
+
+def fetchPage( account, lstUIDs ) :
 
-            ids = mail.getUids( "all" )
+    '''
+    Fetches the headers of the emails with the UIDs (strings) in 'lstUIDs' from the folder of the account and returns a list of Email objects (in no particular order), or None if the account couldn't be read. This is used to display the emails that were left out of the poll by the account's 'limit', a page at a time.
+
+    The header cache is used as for a poll except that the flags of cached emails are always fetched, since they are not synchronized for emails outside of the window (see _pollFolder()).
+    '''
+
+    from imapServer import imapServer
+    from headerCache import openCache
+
+    mail = imapServer( account['host'], account['useSSL'], account.get( 'connectTimeout' ), account.get( 'readTimeout' ) )
+
+    if not mail.login( account['username'], account['password'] ) :
+
+        return None
+
+    mail.examine( account[ 'folder' ] )
+
+    cache = openCache( account, mail.folder )
+
+    cached = {}
+
+    if cache :
+
+        cache.validate( mail.uidValidity() )
+
+        cached = cache.emails()
+
+    emails = []
+
+    cachedIds = [ uid for uid in lstUIDs if uid in cached ]
+    newIds = [ uid for uid in lstUIDs if not uid in cached ]
+
+    data, dicFlags, vanished = mail.fetchHeadersAndFlags( newIds, ['from', 'subject', 'date'], cachedIds )		# A single round trip
+
+    for uid in cachedIds :
+
+        email = cached[ uid ]
+
+        if uid in dicFlags :
+
+            email.Seen = '\\Seen' in dicFlags[ uid ]
+
+        emails.append( email )
+
+    if newIds :
+
+        dates = convertDates( [ data[ uid ][ 'date' ] for uid in newIds ] )
+
+        emails += [ newEmail( uid, data[ uid ], date ) for uid, date in zip( newIds, dates ) ]
+
+    if cache :
+
+        cache.store( emails )
+        cache.close()
+
+    mail.logout()
+
+    return emails
+
+
+
+
+def searchFilter( account ) :
+
+    '''
+    Returns the IMAP SEARCH criteria (as a string) corresponding to the filters set for the account, or an empty string if there are none. The filters are applied by the server so that only the headers of matching emails are ever fetched.
+
+    searchSince: Either a date in the IMAP format (e.g. 1-Jan-2013) or a number of days before today.
+    searchFrom, searchSubject: Strings which must occur in the From and Subject headers respectively (case-insensitive).
+    searchLarger: Minimum size of the emails in bytes.
+    search: Raw IMAP SEARCH criteria, added as they are (e.g. 'FLAGGED NOT DELETED').
+    '''
+
+    criteria = []
+
+    since = account.get( 'searchSince' )
+
+    if since :
+
+        since = str( since ).strip()
+
+        if since.isdigit() :		# Number of days ago. The month names are spelled out since strftime( '%b' ) depends on the locale.
+
+            from datetime import date
+
+            day = date.today() - timedelta( days = int( since ) )
+
+            months = [ 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec' ]
+
+            since = str( day.day ) + '-' + months[ day.month - 1 ] + '-' + str( day.year )
+
+        criteria.append( 'SINCE ' + since )
+
+    for key, name in [ ( 'searchFrom', 'FROM' ), ( 'searchSubject', 'SUBJECT' ) ] :
+
+        if account.get( key ) :
+
+            criteria.append( name + ' "' + account[ key ].replace( '\\', '\\\\' ).replace( '"', '\\"' ) + '"' )		# Quoted string with backslashes and quotes escaped
+
+    if account.get( 'searchLarger' ) :
+
+        criteria.append( 'LARGER ' + str( int( account[ 'searchLarger' ] ) ) )
+
+    if account.get( 'search' ) :
+
+        criteria.append( account[ 'search' ] )
+
+    return ' '.join( criteria )
+
+
+
+
+import re
+
+reFrom = re.compile( '\"?([^<]*?)\"? <.*' )		# The display name of a sender e.g. '"Abid Mujtaba" <abid@example.com>'. Compiled once, here, since it is applied to every email parsed.
+
+
+def newEmail( uid, line, date = None ) :
+
+    '''
+    Creates an Email object from the header information of a single email as returned by imapServer.fetchHeaders() (a dictionary containing the 'from', 'subject', 'date' and 'flags' of the email).
+
+    date: The ( display string, timestamp ) pair of the date of the email already converted (see convertDates()). If not given the 'date' header is converted here, which is slower when there are many emails.
+    '''
+
+    email = Email()
+
+    strFrom = line[ 'from' ].strip()
+
+    m = reFrom.match( strFrom )
+
+    if m:
+        strFrom = m.group(1)
+
+    email.From = emailHeader( strFrom )             # The From and Subject headers can be MIME encoded so we use emailHeader to parse them. The whole display name is decoded (and cached, keyed by its raw form) and stored as it is: It is only fitted to the width of its column when displayed (see textRenderer and urwidDisplay.constructLine()). The name is extracted before it is decoded since decode_header() drops the space between an encoded word and the address that follows it.
+    if date is None :
+
+        date = convertDate( line[ 'date' ] )
+
+    email.Date, email.Timestamp = date
+    email.Subject = emailHeader( line[ 'subject' ] )
+
+    email.uid = uid		# Store the email's uid along with it for later usage
+
+    email.Seen = '\\Seen' in line[ 'flags' ]		# The flags are fetched along with the headers so we know if the email has been seen without making another request to the server
+
+    return email
+
+
+
+
+def newEmails( lstUIDs, data ) :
+
+    '''
+    Creates the Email objects of the emails whose UIDs are in 'lstUIDs' from their header information in 'data' (see newEmail()) and returns them in a dictionary keyed by UID.
+
+    The headers are parsed (the sender extracted, MIME encoded words decoded and dates converted) right here unless a pool of parsing processes has been started (see startParsePool()) and there are at least parseChunk emails. In that case a coroutine is returned instead, which must be yielded. It sends the headers to the processes of the pool in chunks of parseChunk emails and waits for the results without blocking the event loop (should it be run by one), leaving the threads and the event loop free for the network.
+    '''
+
+    if _parsePool is None or len( lstUIDs ) < parseChunk :
+
+        dates = convertDates( [ data[ uid ][ 'date' ] for uid in lstUIDs ] )		# The dates of all new emails are converted in one go
+
+        return dict( [ ( uid, newEmail( uid, data[ uid ], date ) ) for uid, date in zip( lstUIDs, dates ) ] )
+
+    return _poolEmails( lstUIDs, data )
+
+
+
+
+def _poolEmails( lstUIDs, data ) :
+
+    '''
+    Coroutine that has the headers of the emails whose UIDs are in 'lstUIDs' parsed by the processes of the parse pool and returns the dictionary of Email objects (see newEmails()).
+
+    The coroutine is woken up through a socket pair on which the pool signals that ALL chunks have been parsed. Under runSync() the _Wait yielded is simply sent back, in which case fetching the results blocks until they are available.
+    '''
+
+    from asyncImapServer import Return, _Wait
+    import socket
+
+    chunks = [ [ ( uid, data[ uid ] ) for uid in lstUIDs[ ii : ii + parseChunk ] ] for ii in range( 0, len( lstUIDs ), parseChunk ) ]
+
+    receiver, sender = socket.socketpair()
+
+    try :
+        result = _parsePool.map_async( _parseChunk, chunks, 1, lambda results : sender.send( '.' ) )		# The callback is run by a thread of the pool once all chunks are done
+
+        yield _Wait( receiver, 'r' )
+
+        results = result.get()
+
+    finally :
+        receiver.close()
+        sender.close()
+
+    emails = {}
+
+    for chunk in results :
+
+        if isinstance( chunk, Exception ) :		# Raised while parsing (see _parseChunk())
+
+            raise chunk
+
+        chunk, hits, misses = chunk
+
+        decodedHeaders.merge( hits, misses )
+
+        for uid, From, Date, Timestamp, Subject, Seen in chunk :
+
+            email = Email()
+
+            email.uid = uid
+            email.From = From
+            email.Date = Date
+            email.Timestamp = Timestamp
+            email.Subject = Subject
+            email.Seen = Seen
+
+            emails[ uid ] = email
+
+    raise Return( emails )
+
+
+
+
+def _parseChunk( items ) :
+
+    '''
+    Run by the processes of the parse pool. Parses the headers of a chunk of emails ( a list of ( uid, header information ) tuples, see newEmail() ) and returns a list of compact ( uid, From, Date, Timestamp, Subject, Seen ) tuples along with the number of hits and misses of the decodedHeaders cache while doing so. An exception is returned rather than raised since the pool would otherwise never report the results of the other chunks (see _poolEmails()).
+
+    Each process has its own copy of decodedHeaders (inherited when the pool is started) which it fills on its own. Only the hits and misses are passed back, to be added to the counters of the main process.
+    '''
+
+    try :
+        hits, misses = decodedHeaders.hits, decodedHeaders.misses
+
+        dates = convertDates( [ line[ 'date' ] for uid, line in items ] )
+
+        emails = [ newEmail( uid, line, date ) for ( uid, line ), date in zip( items, dates ) ]
+
+        return [ ( email.uid, email.From, email.Date, email.Timestamp, email.Subject, email.Seen ) for email in emails ], decodedHeaders.hits - hits, decodedHeaders.misses - misses
+
+    except Exception, e :
+
+        return e
+
+
+
+
+def startParsePool( processes ) :
+
+    '''
+    Starts a pool of 'processes' processes which parse the headers of large folders (see newEmails()), so that parsing is spread over several cores rather than being serialized (by the GIL) in the threads that poll the accounts. It must be started before any threads are (forking a multi-threaded process is unsafe).
+    '''
+
+    import multiprocessing
+
+    global _parsePool
+
+    _parsePool = multiprocessing.Pool( processes, _ignoreInterrupt )
+
+
+
+
+def _ignoreInterrupt() :
+
+    import signal
+
+    signal.signal( signal.SIGINT, signal.SIG_IGN )		# Ctrl-C is handled by the main process alone
+
+
+
+
+_parsePool = None		# The multiprocessing.Pool started by startParsePool() (if any)
+
+parseChunk = 2000		# Number of emails whose headers are parsed by a process of the pool at a time. Folders with fewer new emails are parsed in place since sending them to the pool would cost more than it saves.
+
+
+
+
+def deleteEmails( account, listUIDs ) :
+
+    '''
+    This function deletes specified emails from a single account. It is meant to be called by a multi-thread execution routine for each account required.
+
+    account: <DICTIONARY> Contains the settings associated with a particular account and folder (those of the Output object the emails were displayed from, see accountFolders()). Used to login to said account.
+
+    listUIDs: <LIST> of <INTEGERS>. Contains the UIDs of the emails that are to be deleted from the specified account.
+    '''
+
+
+    trashFolder = account[ 'trashFolder' ]		# Get name of Trash Folder associated with specified account
+
+    flagDeleteEmails = account[ 'deleteEmails' ]		# Get boolean flag which indicates whether emails actually need to be physically deleted, or just copied.
+
+
+    from imapServer import imapServer
+
+    mail = imapServer( account['host'], account['useSSL'], account.get( 'connectTimeout' ), account.get( 'readTimeout' ) )
+
+    mail.login( account['username'], account['password'] )
+
+    mail.select( account[ 'folder' ] )		# 'account' holds the settings of a single folder (see accountFolders())
+
+    # Now we have accessed the proper folder:
+
+    if not flagDeleteEmails :		# The account setting indicates that emails are only to be copied to the Trash folder. Set to False for Gmail accounts (where this removes them from the Inbox).
+
+        mail.copy( listUIDs, trashFolder )		# We send the list of UIDs and the name of the trash folder to mail.copy() so that these emails can be copied in to the Trash Folder
+
+    elif not mail.move( listUIDs, trashFolder ) :		# If the server supports MOVE the emails are moved to the Trash folder in a single command. Otherwise (False is returned) we do it by hand:
+
+        # First we copy the emails to the Trash folder:
+
+        mail.copy( listUIDs, trashFolder )
+
+        mail.delete( listUIDs )		# Provide mail.delete with list of UIDs. The method flags the emails for deletion on the IMAP server.
+
+        if not mail.uidExpunge( listUIDs ) :		# With UIDPLUS only the specified emails are expunged. Otherwise every email in the folder flagged as deleted is.
+
+            mail.expunge()			# This tells the IMAP server to actually delete the emails flagged as such
+
+
+    if flagDeleteEmails :
+
+        from headerCache import openCache
+
+        cache = openCache( account, mail.folder )		# Remove the deleted emails from the header cache as well
+
+        if cache :
+
+            cache.discard( listUIDs )
+            cache.close()
+
+
+    mail.logout()			# Logout gracefully from the account
+
+
+
+
+
+
+
+import threading
+
+class Worker( threading.Thread ) :
+
+    '''
+    A class inherited from the threading.Thread class which overloads said class to implement an object which maintains a single thread capable of reading tasks from a queue (inQueue) and storing the output of the task to another queue (outQueue).
+
+    This is a general implementation of this sort of threading paradigm.
+
+    The use of Queue class objects greatly simplifies the asynchronous interaction of threads since the Queue class comes built in with various global locks to prevent chaotic data injection and output.
+
+    The inQueue contains ( index, data ) tuples followed by one None (the sentinel) per worker. A worker ceases execution when it extracts a sentinel. (Checking inQueue.empty() before calling the blocking inQueue.get() is racy since another worker can extract the last task in between, leaving the first blocked forever.)
+
+    For every task the worker first puts ( index, 'started', None ) in the outQueue followed by either ( index, 'done', result ) or ( index, 'error', reason ) if the function raised an exception. This allows the consumer (see runTasks()) to time the tasks and to carry on when one of them fails.
+
+    The threads are daemonic so that a worker stuck on an unresponsive server never prevents the program from exiting.
+    '''
+
+    def __init__( self, function, inQueue, outQueue ) :
+
+        '''
+        'function' is an arbitrary function which accepts a single argument of the type stored in inQueue and returns a (single) output that is stored in outQueue.
+        '''
 
+        # We are overloading the default .__init__() method of the parent threading.Thread class. Initialize members of the Worker class
 
-        out.uids = deepcopy( ids )		# Store the UIDs of the emails retrieived in the general output object
+        self.function = function
+        self.inQueue = inQueue
+        self.outQueue = outQueue
 
+        # After having initialized extra members we run the .__init__() script of the parent class (threading.Thread) so that it carries out all tasks necessary for the setting up of a successful thread object
 
-        if len( ids ) > 0 :		# There has to be at least one email to fetch data or otherwise fetchHeaders will throw up an error
+        super( Worker, self ).__init__()
 
+        self.daemon = True
 
-            data = mail.fetchHeaders( ids, ['from', 'subject', 'date'] )
 
+    def run( self ) :
 
-            if account[ 'latestEmailFirst' ] :		# We define an anonymous function that modifies the order in which we access UIDs based on the configuration.
+        '''
+        Overloaded run() method which implements the 2-queue in-Task out-Result thread paradigm.
+        '''
 
-                ids.reverse()
-                out.uids.reverse()		# We must also flip the order in which the uids are stored so that the lines and uids match
+        while True :
 
+            item = self.inQueue.get()		# Extract data for the task from inQueue. Blocks until a task (or the sentinel) is available.
 
-            if len(ids) > 100 :		# Get number of digits of total number of messages.
+            if item is None :		# The sentinel. No more tasks will arrive.
 
-                numDigits = len( str( len(ids) ) )		# Used to get number of digits in the number for total number of messages. Crude Hack at best.
-            else :
+                self.inQueue.task_done()
 
-                numDigits = 2
+                break
 
-            out.numDigits = numDigits		# Store the number of digits in the object related to the account
 
+            index, data = item
 
-            reFrom = re.compile( '\"?([^<]*?)\"? <.*' )
+            self.outQueue.put( ( index, 'started', None ) )
 
-            # We begin by scanning all of the the uids extracted and storing the information in the Output object 'out':
+            try :
+                result = self.function( data )		# Perform task by applying function to the data
 
-            for uid in ids :
+            except Exception, e :		# A failing task must never take the worker (and with it the remaining tasks) down
 
-                email = Email()		# Create a new Email object for insertion in out.emails
+                self.outQueue.put( ( index, 'error', str( e ) or e.__class__.__name__ ) )
 
-                line = data[ uid ]
+            else :
 
-                strFrom = '{:<30.30}'.format( line[ 'from' ] )
+                self.outQueue.put( ( index, 'done', result ) )		# Store the result in the outQueue
 
-                m = reFrom.match( strFrom )
+            self.inQueue.task_done()
 
-                if m:
-                    strFrom = m.group(1)
 
-                email.From = emailHeader( strFrom )             # The From and Subject headers can be MIME encoded so we use emailHeader to parse them
-                email.Date = convertDate( line[ 'date' ] )
-                email.Subject = emailHeader( line[ 'subject' ] )
 
-                email.uid = uid		# Store the email's uid along with it for later usage
+def runTasks( function, tasks, maxThreads, timeout = None ) :
 
-                out.emails.append( email )
+    '''
+    This is the executor used for all threaded tasks. It applies 'function' to each element of the list 'tasks' using at most 'maxThreads' Worker threads and yields ( data, result, reason ) tuples in the order in which the tasks complete. 'reason' is None if the task succeeded. Otherwise it is a string describing why it failed and 'result' is None.
 
+    timeout: The number of seconds a single task is allowed to run (measured from the moment a worker begins it). A task that exceeds it is cancelled: it is yielded with the reason 'Timed out after ... seconds' and its result (should it ever arrive) is discarded. Since a thread can not be killed the worker running it is abandoned and a replacement worker is started in its place, so that one dead host never stalls the remaining tasks. None or 0 means tasks are never cancelled.
+    '''
 
-            # If we are dealing with all emails we may need additional information stored in 'out'
+    from Queue import Queue, Empty
+    import time
 
-            if not account[ 'showUnseen' ] :		# this means we are displaying ALL emails, seen and unseen
+    inQueue = Queue()	# Initiate and populate input queue with list of tasks (data for each task)
+    outQueue = Queue()
 
-                dicFlags = mail.fetchFlags( ids )
+    for index, data in enumerate( tasks ) :
 
-                reSeen = re.compile( '.*Seen.*' )
+        inQueue.put( ( index, data ) )
 
-                for ii in range( len( ids ) ) :
 
-                    m = reSeen.match( dicFlags[ ids[ ii ] ] )
+    numWorkers = min( maxThreads, len( tasks ) )
 
-                    if m :		# Flag has a Seen flag. We store that information in 'out'
+    for ii in range( numWorkers ) :
 
-                        out.emails[ ii ].Seen = True
+        inQueue.put( None )		# One sentinel per worker, placed behind all of the tasks
 
-                    else :
-                        out.emails[ ii ].Seen = False
 
-            else :		# We are displaying only unSeen messages
+    for ii in range( numWorkers ) :
 
-                for ii in range( len( ids ) ) :
+        Worker( function, inQueue, outQueue ).start()
 
-                    out.emails[ ii ].Seen = False		# Message is necessarily Unseen
 
+    remaining = set( range( len( tasks ) ) )		# Indices of the tasks that have not yet been yielded
 
-    mail.logout()
+    started = {}		# The time at which each running task was started, keyed by index
 
-    return out		# Return the Output data structure we have just populated
+    while remaining :
 
+        wait = 1		# We never block indefinitely (a blocking Queue.get() with no timeout can not be interrupted by Ctrl-C in python 2)
 
+        running = [ started[ index ] for index in started if index in remaining ]
 
+        if timeout and running :
 
-def deleteEmails( account, listUIDs ) :
+            wait = max( 0, min( min( running ) + timeout - time.time(), wait ) )
 
-    '''
-    This function deletes specified emails from a single account. It is meant to be called by a multi-thread execution routine for each account required.
+        try :
+            index, status, value = outQueue.get( True, wait )
 
-    account: <DICTIONARY> Contains the settings associated with a particular account. Used to login to said account.
+        except Empty :
 
-    listUIDs: <LIST> of <INTEGERS>. Contains the UIDs of the emails that are to be deleted from the specified account.
-    '''
+            if timeout :
 
+                now = time.time()
 
-    trashFolder = account[ 'trashFolder' ]		# Get name of Trash Folder associated with specified account
+                for index in [ index for index in started if index in remaining and now - started[ index ] >= timeout ] :
 
-    flagDeleteEmails = account[ 'deleteEmails' ]		# Get boolean flag which indicates whether emails actually need to be physically deleted, or just copied.
+                    remaining.discard( index )
 
+                    inQueue.put( None )		# Replace the worker stuck on the cancelled task
+                    Worker( function, inQueue, outQueue ).start()
 
-    from imapServer import imapServer
+                    yield ( tasks[ index ], None, 'Timed out after ' + str( timeout ) + ' seconds' )
 
-    mail = imapServer( account['host'] )
+            continue
 
-    mail.login( account['username'], account['password'] )
 
-    mail.select()
+        if index not in remaining :		# The late result of a cancelled task
 
-    # Now we have accessed the proper folder:
+            continue
 
-    # First we copy the emails to the Trash folder:
+        if status == 'started' :
 
-    mail.copy( listUIDs, trashFolder )		# We send the list of UIDs and the name of the trash folder to mail.copy() so that these emails can be copied in to the Trash Folder
+            started[ index ] = time.time()
 
+            continue
 
-    if flagDeleteEmails :			# If the account setting indicates that emails are to be deleted after copying. Set to False for Gmail accounts.
+        remaining.discard( index )
 
-        mail.delete( listUIDs )		# Provide mail.delete with list of UIDs. The method flags the emails for deletion on the IMAP server.
+        if status == 'done' :
 
-        mail.expunge()			# This tells the IMAP server to actually delete the emails flagged as such
+            yield ( tasks[ index ], value, None )
 
+        else :
 
-    mail.logout()			# Logout gracefully from the account
+            yield ( tasks[ index ], None, value )
 
 
 
@@ -207,172 +933,194 @@ def deleteEmails( account, listUIDs ) :
 
 
 
-import threading
+class Email( object ) :
 
-class Worker( threading.Thread ) :
+    '''
+    Struct like object for storing information about a single email. Each Output object will contain a list of these. Large folders produce a great many of them so the members are fixed using __slots__ (an instance then has no __dict__ and takes a small, constant amount of memory).
 
+    From, Date, Timestamp, Subject, uid (a string containing an integer) and Seen are set when the email is polled. Date is the date as displayed while Timestamp is the same local time in the (unambiguous) ISO 8601 format, e.g. '2013-01-07T11:05:00+01:00', used by the machine readable output (see recordWriter). account, Delete, serial, numDigits and listPos are used by urwidDisplay.
     '''
-    A class inherited from the threading.Thread class which overloads said class to implement an object which maintains a single thread capable of reading tasks from a queue (inQueue) and storing the output of the task to another queue (outQueue) until the inQueue is empty.
 
-    This is a general implementation of this sort of threading paradigm.
+    __slots__ = ( 'From', 'Date', 'Timestamp', 'Subject', 'uid', 'Seen', 'account', 'Delete', 'serial', 'numDigits', 'listPos' )
 
-    The use of Queue class objects greatly simplifies the asynchronous interaction of threads since the Queue class comes built in with various global locks to prevent chaotic data injection and output. In fact the Queue class's .join() method is an excellent technique for making a program hold off until thread execution completes before moving forward with subsequent code.
+    def __init__( self ) :
 
-    The implementation assumes that the inQueue will finish populating before all tasks are completed or even better that the inQueue is completely populated before execution of the tasks even begins. This is reflected in the break condition for the overloaded run method.
-    '''
+        self.From = ''
+        self.Date = ''
+        self.Timestamp = ''
+        self.Subject = ''
+        self.uid = None
+        self.Seen = False
 
-    def __init__( self, function, inQueue, outQueue ) :
+        self.account = None
+        self.Delete = False		# Flag for tracking if the email has to be deleted
+        self.serial = None
+        self.numDigits = 2
+        self.listPos = None
 
-        '''
-        'function' is an arbitrary function which accepts a single argument of the type stored in inQueue and returns a (single) output that is stored in outQueue.
-        '''
 
-        # We are overloading the default .__init__() method of the parent threading.Thread class. Initialize members of the Worker class
 
-        self.function = function
-        self.inQueue = inQueue
-        self.outQueue = outQueue
+def threadedExec( servers, maxThreads, timeout = None, function = pollAccount ) :
 
-        # After having initialized extra members we run the .__init__() script of the parent class (threading.Thread) so that it carries out all tasks necessary for the setting up of a successful thread object
+    '''
+    This implements the email account access part of the program using a threaded queue model (see runTasks()). It is a generator which yields the Output objects (one per folder) in the order in which the accounts complete, so that the fastest accounts can be displayed without waiting for the slowest one.
 
-        super( Worker, self ).__init__()
+    maxThreads in an INTEGER that denotes the maximum number of parallel threads that the program is allowed to open. This is a global setting.
 
+    timeout: The number of seconds after which the polling of an account is cancelled (None means never). A cancelled (or failed) account is yielded as an Output object with error = True and the reason stored in its 'reason' member.
 
-    def run( self ) :
+    function: The function which polls a single account (accepting the dictionary of the account and returning the list of Output objects of its folders). The daemon (see fetchDaemon) passes in a function that uses its pooled connections.
+    '''
 
-        '''
-        Overloaded run() method which implements the 2-queue in-Task out-Result thread paradigm.
-        '''
+    tasks = [ servers[ account ] for account in servers ]
 
-        while True :
+    for account, outs, reason in runTasks( function, tasks, maxThreads, timeout ) :
 
-            if self.inQueue.empty() :	# A thread ceases execution when the inQueue is empty. This assumes that the inQueue is fully populated before execution of the threads ends. Usually this means that the inQueue is populated before the task starts.
+        if reason :
 
-                break
+            out = Output( account )
 
+            out.error = True
+            out.reason = reason
 
-            data = self.inQueue.get()		# Extract data for the task from inQueue
+            outs = [ out ]
 
-            result = self.function( data )		# Perform task by applying function to the data
+        for out in outs :
 
-            self.outQueue.put( result )		# Store the result in the outQueue
+            yield out
 
-            self.inQueue.task_done()		# Indicates to the inQueue that one of the tasks pulled from the queue has now been completed. This allows the Queue's .join() method to stop blocking when all tasks have been completed.
 
 
 
 
-class delWorker( threading.Thread ) :
+def asyncExec( servers, maxConnections, timeout = None ) :
 
     '''
-    This is a class that implements a multi-threaded paradigm based on a single queue and a function that needs to be applied to said objects. No output is produced.
+    This implements the email account access part of the program using coroutines running on a single event loop (see asyncImapServer). It is the asynchronous alternative to threadedExec() and is used to poll a large number of accounts without opening a thread for each.
 
-    This is a custom implementation with the class repsonsible for taking objects from the inQueue, splitting off into two parts and passing these parts to the appropriate function.
+    maxConnections is an INTEGER that denotes the maximum number of accounts that are polled concurrently (i.e. the number of simultaneously open connections). This is a global setting.
 
-    The purpose of each worker is to read accounts and UID lists from the inQueue and call the deleteEmails() function upon them.
+    timeout: The number of seconds after which the polling of an account is cancelled (None means never). Unlike a thread a coroutine can actually be stopped so the connection of a cancelled account is closed immediately.
+
+    Output objects (one per folder) are yielded one at a time in the order in which the accounts complete. Accounts that failed or were cancelled are yielded with error = True and the reason stored in 'reason'.
     '''
 
-    def __init__( self, inQueue ) :
+    from asyncImapServer import eventLoop
+    import time
 
-        '''
-        inQueue: <Queue Object> Contains dictionaries, each with two parts: 'account' <DIC> associated with each email account and 'listUIDs' list of UIDs of emails to be deleted.
-        '''
+    loop = eventLoop()
 
-        self.function = deleteEmails		# Store the above defined deleteEmails as the function to be applied. This takes in two parameters: dictionary of account settings and list of UIDs.
+    pending = [ servers[ account ] for account in servers ]		# Accounts that have not yet been started
 
-        self.inQueue = inQueue
+    while pending or loop.tasks :
 
-        # After having performed customized start up we call the .__ini__() script of the parent class (threading.Thread) to carry out tasks necessary for setting up threading.
+        while pending and len( loop.tasks ) < maxConnections :		# Start polling accounts until the concurrency cap is reached
 
-        super( delWorker, self ).__init__()
+            account = pending.pop(0)
 
+            task = loop.spawn( asyncPollAccount( account ), account )
 
+            task.deadline = time.time() + timeout if timeout else None
 
-    def run( self ) :
 
-        '''
-        Overloaded run() method which implements the single queue thread paradigm.
-        '''
+        deadlines = [ t.deadline for t in loop.tasks if t.deadline ]
 
-        while True :
+        wait = None
 
-            if self.inQueue.empty() :		# No more tasks left in queue. The delWorker should cease execution of tasks
+        if deadlines :
 
-                break
+            wait = max( 0, min( deadlines ) - time.time() )
 
+        for task in loop.step( wait ) :
 
-            data = self.inQueue.get()		# Extract data for task from inQueue
+            if task.error or task.result is None :		# An exception was raised while polling the account
 
-            self.function( data[ 'account' ], data[ 'listUIDs' ] )		# Perform task using data and the function associated with the task. In this case delete specified emails from specified account
+                out = Output( task.data )
 
+                out.error = True
+                out.reason = str( task.error or '' ) or None
 
-            self.inQueue.task_done()		# Inform the inQueue that an extracted task has been completed. This allows the inQueue to know when all tasks have been completed.
+                yield out
 
+            else :
 
+                for out in task.result :		# The Output objects of the folders of the account
 
+                    yield out
 
 
+        now = time.time()
 
+        for task in [ t for t in loop.tasks if t.deadline and t.deadline <= now ] :
 
+            loop.cancel( task )
 
+            out = Output( task.data )
 
-class Email :		# Struct like object for storing information about a single email. Members can be created on the fly. Each Output object will contain a list of these.
+            out.error = True
+            out.reason = 'Timed out after ' + str( timeout ) + ' seconds'
 
-    subject = ''
+            yield out
 
 
 
-def threadedExec( servers, maxThreads ) :
+def pollAccounts( servers, settings ) :
 
     '''
-    This implements the email account access part of the program using a threaded queue model
+    Polls all of the accounts in 'servers' and returns an iterable of the resulting Output objects. 'settings' is the dictionary of global settings: If settings[ 'useAsync' ] is True the accounts are polled using asyncExec() with at most settings[ 'maxConnections' ] at a time. Otherwise they are polled using threadedExec() with settings[ 'maxThreads' ] threads. The polling of an account is cancelled after settings[ 'pollTimeout' ] seconds (if specified and non-zero).
 
-    maxThreads in an INTEGER that denotes the maximum number of parallel threads that the program is allowed to open. This is a global setting.
+    If a daemon (see fetchDaemon) is listening on settings[ 'daemonSocket' ] the accounts are polled by it instead, over its already authenticated connections.
     '''
 
-    from Queue import Queue
-
-    inQueue = Queue()	# Initiate and populate input queue with list of tasks (data for each task)
-
-    for account in servers :
-
-        inQueue.put( servers[ account ] )		# Store the account dictionary in inQueue. This denotes the data required for a single task: polling a single server
-
-    outQueue = Queue( maxsize = inQueue.qsize() )		# Prepare output queue for storing results
-
-    # Create a number of threads to parallelize the tasks. Threads created using the Worker class inherited from the threading.Thread class:
+    timeout = settings.get( 'pollTimeout' ) or None
 
+    if settings.get( 'daemonSocket' ) :
 
-    workers = [ Worker( pollAccount, inQueue, outQueue ) for ii in range( maxThreads ) ]		# maxThreads is a global variable that determines the maximum number of open threads
+        from fetchDaemon import connectDaemon, daemonExec
 
-    for worker in workers :
+        sock = connectDaemon( settings[ 'daemonSocket' ] )
 
-        worker.start()		# Begun execution of the thread
+        if sock :		# Otherwise no daemon is running and we poll the accounts ourselves
 
+            return daemonExec( sock, servers )
 
-    inQueue.join()		# Pause program stepping forward here until all tasks in inQueue are completed
+    if settings.get( 'useAsync' ) :
 
+        return asyncExec( servers, settings[ 'maxConnections' ], timeout )
 
-    while not outQueue.empty() :
+    else :
 
-        yield outQueue.get()		# this wording makes test3() a generator and it should be used as such. test3 will return Buffer type objects from each server poll one at a time.
+        return threadedExec( servers, settings[ 'maxThreads' ], timeout )
 
 
 
 
 
-class Output() :
+class Output( object ) :
 
     '''
-    This class stores the information retrieved from each account. It acts as a fancier version of a struct.
+    This class stores the information retrieved from each account (from each folder of an account that has several, see accountFolders()). It acts as a fancier version of a struct, with its members fixed using __slots__ (as for Email).
     '''
 
+    __slots__ = ( 'settings', 'emails', 'uids', 'older', 'numAll', 'numUnseen', 'numDigits', 'error', 'reason', 'stats' )
+
     def __init__( self, settings ) :		# Initialize the account output by storing the account 'settings' dictionary for concurrent use with the lines of output we will be storing
 
+        from array import array
+
         self.settings = settings	# Store account name in class
         self.emails = []		# Stores the Email objects, one for each email/uid
+        self.uids = array( 'I' )		# The UIDs of the emails (as integers) in the order in which they are displayed. An array takes 4 bytes per UID compared to the tens of bytes taken by each string in a list.
+        self.older = array( 'I' )		# The UIDs (in ascending order) of the emails whose headers haven't been fetched because of the account's 'limit' (see fetchPage())
+
+        self.numAll = None		# Total number of emails in the folder (only if the account's showNums is True)
+        self.numUnseen = None
+        self.numDigits = 2		# Number of digits used to display the serial numbers of the emails
 
         self.error = False      # This is a flag used to indicate if an Error has occurred during the construction of this object
+        self.reason = None      # A description of the error (if known) for display along with it
+
+        self.stats = None		# The pollStats object of the account if statistics were requested (see pollStats.py)
 
 
 
@@ -427,7 +1175,9 @@ class LocalTimezone(tzinfo):
 def convertDate( strDate ) :
 
     '''
-    This function accepts the date string as returned by the IMAP server and translates it in to the client's local time (zone) and returns it as a string formatted as desired in the final output.
+    This function accepts the date string as returned by the IMAP server and translates it in to the client's local time (zone). It returns the pair ( display string, timestamp ): the date formatted as desired in the final output and as an ISO 8601 timestamp (see Email).
+
+    This is the slow (but forgiving) path, using dateutil. Lists of dates should be converted using convertDates() which only falls back to this function for dates it can't parse itself.
     '''
 
     try:
@@ -442,45 +1192,118 @@ def convertDate( strDate ) :
 
     dt = dateParse( strDate.split( '(' ) [0] )		# We perform a split on the left parenthesis for the sometime possibility that the date string ends with something like (GMT-06:00)
 
-    Local = LocalTimezone()		# create an instance of the LocalTimezone class defined above
-
     try:
-        ldt = dt.astimezone( Local )
+        ldt = dt.astimezone( _localTimezone )
 
     except ValueError:
 
         print('Error - Using .astimezone(local).')
-        return ''
+        return '', ''
 
-    return ldt.strftime( '%b %d - %I:%M %P' )
+    return ldt.strftime( '%b %d - %I:%M %P' ), ldt.strftime( '%Y-%m-%dT%H:%M:%S' ) + _isoOffset( ldt.utcoffset() )
 
 
+_localTimezone = LocalTimezone()		# A single instance of the LocalTimezone class defined above suffices for all conversions
 
 
-def colorText( string, color ) :
+
+
+def _isoOffset( offset ) :
 
     '''
-    This function is a wrapper which implements the xterm color model using the simplistic escape codes that wrap text which needs to be output in color. Only the very basic color model is implemented. None of the fancy blinking, bold, underline, .etc is suppored.
+    Returns the UTC offset (a timedelta) in the form used by ISO 8601 timestamps e.g. '+05:30'.
+    '''
+
+    minutes = ( offset.days * 86400 + offset.seconds ) // 60
+
+    return ( minutes < 0 and '-' or '+' ) + '%02d:%02d' % divmod( abs( minutes ), 60 )
+
+
+
+
+def convertDates( lstDates ) :
+
+    '''
+    Converts a list of date strings (the Date headers of emails) in to the client's local time, returning a list of ( display string, timestamp ) pairs formatted exactly as by convertDate().
+
+    Almost every Date header is in the RFC 2822 format (e.g. 'Mon, 7 Jan 2013 10:05:00 +0000') which email.utils parses far more cheaply than dateutil. Dates it can't parse, or which lack a time zone, are passed on to convertDate().
+
+    The emails of a folder tend to share dates (e.g. mailing lists, automated messages) so each distinct string is converted only once. The offset of the local time zone only changes (with DST) on the hour so it is looked up once for every hour in which an email was sent, rather than once per email.
     '''
 
-    # We begin by defining the opening and closing escape sequences which we will use to get the correct color wrapper:
+    from email.utils import parsedate_tz
+    from calendar import timegm
+
+    epoch = datetime( 1970, 1, 1 )
+
+    converted = {}		# Converted dates keyed by the original string
+    offsets = {}		# UTC offset (in seconds) of the local time zone keyed by the hour (since the epoch)
+
+    output = []
+
+    for strDate in lstDates :
+
+        if strDate in converted :
+
+            output.append( converted[ strDate ] )
+
+            continue
+
+        parsed = parsedate_tz( strDate )
+
+        if parsed is None or parsed[9] is None :
+
+            converted[ strDate ] = convertDate( strDate )
+
+        else :
+
+            try :
+                stamp = timegm( parsed[:6] ) - parsed[9]		# Seconds since the epoch (UTC). The offset in parsed[9] is that of the sender's time zone.
+
+                hour = stamp // 3600
+
+                if not hour in offsets :
+
+                    local = _time.localtime( stamp )
+
+                    offsets[ hour ] = -_time.altzone if local.tm_isdst > 0 else -_time.timezone
+
+                ldt = epoch + timedelta( seconds = stamp + offsets[ hour ] )
 
-    escOpen = "[0;"
-    escClose = "[0m"
+                converted[ strDate ] = ldt.strftime( '%b %d - %I:%M %P' ), ldt.strftime( '%Y-%m-%dT%H:%M:%S' ) + _isoOffset( timedelta( seconds = offsets[ hour ] ) )
 
-    # Now we define the dictionary that translates color name strings to number strings that xterm will accept:
+            except ( ValueError, OverflowError ) :		# A date so far out of range that it is certainly malformed
 
-    dicColor = {
-            'black' : '30',
-            'red' : '31',
-            'green' : '32',
-            'yellow': '33',
-            'blue': '34',
-            'magenta': '35',
-            'cyan': '36',
-            'white': '37' }
+                converted[ strDate ] = convertDate( strDate )
 
-    # And now we output the string with color wrappers surrounding it
+        output.append( converted[ strDate ] )
+
+    return output
+
+
+
+
+# The escape sequences that wrap colored text (see colorText()) and the dictionary that translates color name strings to number strings that xterm will accept. Defined once, here, since text is colored for every field of every email displayed.
+
+escOpen = "[0;"
+escClose = "[0m"
+
+dicColor = {
+        'black' : '30',
+        'red' : '31',
+        'green' : '32',
+        'yellow': '33',
+        'blue': '34',
+        'magenta': '35',
+        'cyan': '36',
+        'white': '37' }
+
+
+def colorText( string, color ) :
+
+    '''
+    This function is a wrapper which implements the xterm color model using the simplistic escape codes that wrap text which needs to be output in color. Only the very basic color model is implemented. None of the fancy blinking, bold, underline, .etc is suppored.
+    '''
 
     return escOpen + dicColor[ color ] + 'm' + string + escClose
 
@@ -534,18 +1357,219 @@ def strWidth( string, width, align = '<', fill = True ) :
 
             string = ( '{:' + align + str(width) + '.' + str(width) + '}' ).format( string )
 
+        if isinstance( string, unicode ) :		# Encoded as above. Otherwise the line it ends up in is unicode and can't be printed when the output is piped (or is mixed with encoded fields containing non-ASCII characters).
+
+            string = string.encode( 'utf-8' )
+
+    return string
+
+
+
+class textRenderer :
+
+    '''
+    Renders the Output object of an account as the block of text displayed in terminal mode (see display() in fetchheaders.py). The text is exactly what building every field of every line with colorWidth() produces but the templates of the lines, complete with the color escape codes and the widths of the fields, are compiled once (by the constructor) so that each line takes a single call of str.format().
+
+    colors: Dictionary mapping 'title', 'flag', 'date', 'from', 'subjectSeen' and 'subjectUnseen' to the name of the color of the field (None means it isn't colored).
+
+    showFlags: When True the mutt-style flags are displayed (when ALL emails are displayed).
+    '''
+
+    def __init__( self, colors, showFlags ) :
+
+        def field( spec, color ) :		# Wraps the replacement field 'spec' in the escape codes of 'color' (see colorText())
+
+            if color :
+
+                return colorText( spec, color )
+
+            return spec
+
+        self.title = field( '{0:<12.12}', colors[ 'title' ] )
+
+        fields = field( '{1:<17.17}', colors[ 'date' ] ) + '    ' + field( '{2:<30.30}', colors[ 'from' ] ) + '   '		# The date and sender of the email
+
+        self.unseenOnly = '.  ' + fields + field( '{3}', colors[ 'subjectUnseen' ] )		# The subject is truncated but not filled (see render())
+
+        if showFlags :
+
+            flagSeen = '  [ ' + field( '  ', colors[ 'flag' ] ) + ']   '		# The flag filled to a width of 2 (see colorWidth())
+            flagUnseen = '  [ ' + field( 'N ', colors[ 'flag' ] ) + ']   '
+
+        else :
+            flagSeen = flagUnseen = '.   '
+
+        self.seen = flagSeen + fields + field( '{3:<120.120}', colors[ 'subjectSeen' ] )
+        self.unseen = flagUnseen + fields + field( '{3:<120.120}', colors[ 'subjectUnseen' ] )
+
+
+    def render( self, out ) :
+
+        '''
+        Returns the text displayed for the Output object 'out' (as an encoded string, every line terminated by a newline).
+        '''
+
+        lines = [ self.title.format( ( out.settings[ 'name' ] + ':' ).encode( 'utf-8' ) ) ]		# Name of account followed by further text on the same line
+
+        if out.settings[ 'showNums' ] :
+
+            lines.append( "( total: %d | unseen: %d )\n" % ( out.numAll, out.numUnseen ) )
+
+        lines.append( '\n\n' )
+
+        number = '{0:>' + str( out.numDigits ) + '.' + str( out.numDigits ) + '}'		# The serial number of the email, right aligned
+
+        if out.settings[ 'showUnseen' ] :		# Show only unseen messages
+
+            line = ( number + self.unseenOnly + '\n' ).format
+
+            lines.extend( line( str( ii ), email.Date.encode( 'utf-8' ), email.From.encode( 'utf-8' ), _encode( email.Subject[ : 120 ] ) ) for ii, email in enumerate( out.emails, 1 ) )
+
+        else :						# Show ALL messages. Different formatting scheme.
+
+            seen = ( number + self.seen + '\n' ).format
+            unseen = ( number + self.unseen + '\n' ).format
+
+            lines.extend( ( email.Seen and seen or unseen )( str( ii ), email.Date.encode( 'utf-8' ), email.From.encode( 'utf-8' ), email.Subject.encode( 'utf-8' ) ) for ii, email in enumerate( out.emails, 1 ) )		# The fields are encoded before being formatted (as by strWidth()) so they are truncated to a number of bytes
+
+        if out.older :		# The account's limit left out some older emails
+
+            lines.append( '\n' + ' ' * ( out.numDigits + 4 ) + '... and ' + str( len( out.older ) ) + ' older emails (raise the limit or use --max to show them)\n' )
+
+        return ''.join( lines )
+
+
+
+
+def _encode( string ) :
+
+    '''
+    Returns 'string' encoded as UTF-8 if it is unicode (see strWidth()).
+    '''
+
+    if isinstance( string, unicode ) :
+
+        return string.encode( 'utf-8' )
+
     return string
 
 
 
+class lruCache :
+
+    '''
+    A bounded cache mapping keys to values which, when full, discards the entry that was used least recently. It is shared by all polling threads so access is serialized by a lock. The number of hits and misses is counted so that the size can be tuned.
+    '''
+
+    def __init__( self, size ) :
+
+        from collections import OrderedDict
+
+        self.size = size		# Maximum number of entries. 0 disables the cache.
+        self.data = OrderedDict()		# Entries in order of use, the least recently used first
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+
+    def resize( self, size ) :
+
+        with self.lock :
+
+            self.size = size
+
+            while len( self.data ) > size :
+
+                self.data.popitem( last = False )
+
+
+    def get( self, key, function ) :
+
+        '''
+        Returns the value cached for 'key', computing it as function( key ) (and caching it) if it is not present. The function is called without holding the lock so that a slow computation never blocks the other threads.
+        '''
+
+        with self.lock :
+
+            if key in self.data :
+
+                self.hits += 1
+
+                value = self.data.pop( key )		# Re-inserting the entry marks it as the most recently used
+
+                self.data[ key ] = value
+
+                return value
+
+            self.misses += 1
+
+        value = function( key )
+
+        with self.lock :
+
+            if self.size > 0 :
+
+                self.data[ key ] = value
+
+                while len( self.data ) > self.size :
+
+                    self.data.popitem( last = False )
+
+        return value
+
+
+    def merge( self, hits, misses ) :
+
+        '''
+        Adds the hits and misses counted by a copy of the cache in another process (see _poolEmails()) to those of this one.
+        '''
+
+        with self.lock :
+
+            self.hits += hits
+            self.misses += misses
+
+
+    def stats( self ) :
+
+        '''
+        Returns a dictionary with the number of 'hits' and 'misses', the number of cached entries ('size') and the maximum number of entries ('capacity').
+        '''
+
+        with self.lock :
+
+            return { 'hits': self.hits, 'misses': self.misses, 'size': len( self.data ), 'capacity': self.size }
+
+
+
+decodedHeaders = lruCache( 10000 )		# Decoded From and Subject headers keyed by the raw header. The size is set by the headerCacheSize global setting.
+
+
+
 def emailHeader(header):
     """
     Takes an email header and decodes it if it has been MIME-encoded.
 
+    Headers without an encoded word (which always begins with '=?') are returned as they are. The others are decoded only once and then served from the decodedHeaders cache since mailing lists and notifications repeat the same encoded senders and subjects over and over.
+
     :param header: The email header to be decoded
     :return: The decoded header returned as a string
     """
 
+    if not '=?' in header:
+
+        return unicode(header, 'ASCII')         # This is exactly what decoding a header without encoded words produces
+
+    return decodedHeaders.get(header, _decodeHeader)
+
+
+
+def _decodeHeader(header):
+    """
+    Decodes a MIME-encoded header. Used by emailHeader() for headers that aren't in its cache.
+    """
+
     from email.header import decode_header
 
     dh = decode_header(header)          # Returns a list of 2-tuples where the first element is the decoded string and the second is the encoding corresponding to it
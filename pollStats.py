@@ -0,0 +1,252 @@
+# Copyright 2012 Abid Hasan Mujtaba
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Author: Abid H. Mujtaba
+# Email: abid.naqvi83@gmail.com
+#
+# This file implements the statistics collected when fetchheaders is run with --stats: the time spent in each phase of polling an account (every network method of imapServer/asyncImapServer plus the parsing, caching and rendering done by fetchheaders itself), the number of round trips made and the number of bytes sent to and received from the server. When --stats is not given no pollStats object is created and the only cost is a check of 'stats is None' per method call (and per line read from the server).
+
+
+import time
+
+
+class pollStats( object ) :
+
+    '''
+    The statistics of polling a single account. All of the folders of the account share the same object since they are polled over the same connection (see _pollAccount() in miscClasses).
+
+    phases: Dictionary mapping the name of a phase to the list [seconds, calls]. The phases are named after the methods of imapServer (e.g. 'login', 'openFolder', 'fetchHeadersAndFlags') along with 'connect' (which includes the 'tls' handshake), 'parse' (creating the Email objects), 'cache' (reading and writing the header cache) and 'render' (displaying the emails). Commands that are pipelined (see imapServer.openFolder()) are necessarily timed together. With --async the time of a method includes the time the event loop spends on the other accounts while waiting for the server.
+
+    A round trip is counted every time data is received after data has been sent, so the greeting of the server is counted as one as well.
+    '''
+
+    __slots__ = ( 'phases', 'bytesSent', 'bytesReceived', 'roundTrips', 'awaiting' )
+
+    def __init__( self ) :
+
+        self.phases = {}
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.roundTrips = 0
+        self.awaiting = True		# Data is awaited from the server (its greeting to begin with)
+
+
+    def add( self, phase, seconds ) :
+
+        entry = self.phases.get( phase )
+
+        if entry is None :
+
+            self.phases[ phase ] = [ seconds, 1 ]
+
+        else :
+            entry[0] += seconds
+            entry[1] += 1
+
+
+    def sent( self, size ) :
+
+        self.bytesSent += size
+        self.awaiting = True
+
+
+    def received( self, size ) :
+
+        self.bytesReceived += size
+
+        if self.awaiting :
+
+            self.roundTrips += 1
+            self.awaiting = False
+
+
+    def total( self ) :
+
+        '''
+        Returns the total number of seconds spent in the phases. 'tls' is excluded since it is part of 'connect'.
+        '''
+
+        return sum( [ seconds for phase, ( seconds, calls ) in self.phases.items() if phase != 'tls' ] )
+
+
+    def asDict( self ) :
+
+        '''
+        Returns the statistics as a dictionary that can be serialized as JSON.
+        '''
+
+        return { 'phases' : dict( [ ( phase, { 'seconds' : round( seconds, 6 ), 'calls' : calls } ) for phase, ( seconds, calls ) in self.phases.items() ] ),
+                'total' : round( self.total(), 6 ),
+                'roundTrips' : self.roundTrips,
+                'bytesSent' : self.bytesSent,
+                'bytesReceived' : self.bytesReceived }
+
+
+    def format( self ) :
+
+        '''
+        Returns the statistics as a list of lines of text: one per phase (slowest first) followed by the totals.
+        '''
+
+        lines = []
+
+        for phase, ( seconds, calls ) in sorted( self.phases.items(), key = lambda item : -item[1][0] ) :
+
+            lines.append( '    %-22s %10.1f ms  %6d call%s' % ( phase, seconds * 1000, calls, calls != 1 and 's' or '' ) )
+
+        lines.append( '    %-22s %10.1f ms  %6d round trip%s, %s sent, %s received' % ( 'total', self.total() * 1000, self.roundTrips, self.roundTrips != 1 and 's' or '', _size( self.bytesSent ), _size( self.bytesReceived ) ) )
+
+        return lines
+
+
+
+
+def printStats( outs, form = 'text', elapsed = None ) :
+
+    '''
+    Prints the statistics of the accounts whose Output objects are in the iterable 'outs' to stderr (so that they don't mingle with the emails when the output is piped). The folders of an account share a single pollStats object which is printed once, under the name of the account.
+
+    form: 'text' for a table per account or 'json' for a single JSON object (on one line) mapping the name of each account to its statistics (see pollStats.asDict()).
+
+    The counters of the cache of decoded headers (see lruCache.stats() in miscClasses), which is shared by all accounts, are printed as well. When the accounts are polled by a daemon the headers are decoded (and counted) by the daemon instead.
+
+    elapsed: The number of seconds taken to poll (and display) all of the accounts, if known.
+    '''
+
+    import sys
+
+    from miscClasses import decodedHeaders
+
+    cache = decodedHeaders.stats()
+
+    accounts = []
+    seen = set()
+
+    for out in outs :
+
+        if out.stats is not None and not id( out.stats ) in seen :
+
+            seen.add( id( out.stats ) )
+
+            accounts.append( ( out.settings.get( 'account', out.settings[ 'name' ] ), out.stats ) )
+
+    if form == 'json' :
+
+        import json
+
+        data = { 'accounts' : dict( [ ( name, stats.asDict() ) for name, stats in accounts ] ), 'decodedHeaders' : cache }
+
+        if elapsed is not None :
+
+            data[ 'elapsed' ] = round( elapsed, 6 )
+
+        sys.stderr.write( json.dumps( data, sort_keys = True ) + '\n' )
+
+        return
+
+    lines = []
+
+    for name, stats in sorted( accounts ) :
+
+        lines.append( name + ':' )
+        lines.extend( stats.format() )
+
+    lookups = cache[ 'hits' ] + cache[ 'misses' ]
+
+    lines.append( 'Decoded header cache: %d hit%s, %d miss%s (%.1f%% hits), %d of %d entries used' % ( cache[ 'hits' ], cache[ 'hits' ] != 1 and 's' or '', cache[ 'misses' ], cache[ 'misses' ] != 1 and 'es' or '', lookups and 100.0 * cache[ 'hits' ] / lookups or 0, cache[ 'size' ], cache[ 'capacity' ] ) )
+
+    if elapsed is not None :
+
+        lines.append( 'Polled ' + str( len( accounts ) ) + ' account' + ( len( accounts ) != 1 and 's' or '' ) + ' in %.1f ms' % ( elapsed * 1000 ) )
+
+    sys.stderr.write( '\n'.join( lines ) + '\n' )
+
+
+
+
+def timed( method ) :
+
+    '''
+    Decorator that adds the time spent in a method of imapServer or asyncImapServer to the phase of the same name of the pollStats object stored in the 'stats' member of the instance. The method is simply called if 'stats' is None.
+
+    The methods of asyncImapServer return coroutines. The time of these is measured from the call until the coroutine has completed (see _timedCoroutine()).
+    '''
+
+    import types
+
+    name = method.__name__
+
+    def wrapper( self, *args, **kwargs ) :
+
+        stats = self.stats
+
+        if stats is None :
+
+            return method( self, *args, **kwargs )
+
+        start = time.time()
+
+        result = method( self, *args, **kwargs )
+
+        if type( result ) is types.GeneratorType :
+
+            return _timedCoroutine( result, stats, name, start )
+
+        stats.add( name, time.time() - start )
+
+        return result
+
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+
+    return wrapper
+
+
+
+
+def _timedCoroutine( coroutine, stats, name, start ) :
+
+    '''
+    Coroutine that runs 'coroutine' and adds the time elapsed since 'start' to the phase 'name' once it has completed (successfully or not).
+    '''
+
+    from asyncImapServer import Return
+
+    try :
+        result = yield coroutine
+
+    finally :
+        stats.add( name, time.time() - start )
+
+    raise Return( result )
+
+
+
+
+def _size( numBytes ) :
+
+    '''
+    Returns the number of bytes as a short human readable string e.g. '1.2 MB'.
+    '''
+
+    for unit in ( 'B', 'KB', 'MB' ) :
+
+        if numBytes < 1024 :
+
+            return ( unit == 'B' and '%d ' or '%.1f ' ) % numBytes + unit
+
+        numBytes /= 1024.0
+
+    return '%.1f GB' % numBytes
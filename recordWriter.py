@@ -0,0 +1,183 @@
+# Copyright 2012 Abid Hasan Mujtaba
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Author: Abid H. Mujtaba
+# Email: abid.naqvi83@gmail.com
+#
+# This file implements the machine readable output of fetchheaders (--format json, ndjson or csv). Every account (every folder of an account with several) is written as an 'account' record followed by an 'email' record for each of its emails, one record per line, as soon as the account has been polled. Nothing is padded, truncated or colored. The records are written straight to the output stream one at a time so that the output of an account with a hundred thousand emails is never held in memory as a whole.
+#
+# The fields of the records are (in this order):
+#
+#   account:  type, account, folder, total, unseen, emails, older, error, reason
+#   email:    type, account, folder, uid, seen, date, timestamp, from, subject
+#
+# 'account' is the name of the account and 'folder' the folder polled. 'total' and 'unseen' are the numbers of emails in the folder (null unless they are displayed, see showNums), 'emails' the number of email records that follow and 'older' the number of older emails left out because of the account's limit (see --max). 'date' is the date of the email as displayed and 'timestamp' the same (local) time in the ISO 8601 format, including the year and the UTC offset e.g. "2013-01-07T11:05:00+01:00" (empty if the Date header of the email couldn't be parsed). 'from' is the whole (decoded) name of the sender, or the address if the email has none.
+#
+# With csv every row has all of the columns (named in a header row). The columns that don't apply to the type of the row are left empty and booleans are written as 1 or 0.
+
+
+accountFields = ( 'type', 'account', 'folder', 'total', 'unseen', 'emails', 'older', 'error', 'reason' )
+
+csvColumns = ( 'type', 'account', 'folder', 'total', 'unseen', 'emails', 'older', 'error', 'reason', 'uid', 'seen', 'date', 'timestamp', 'from', 'subject' )
+
+
+class recordWriter :
+
+    '''
+    Writes the Output objects of the accounts polled to 'stream' (a file object, which is flushed after every account) as records in the format 'form': 'json' (a single array with one record per line), 'ndjson' (one JSON object per line) or 'csv'. .close() must be called once all accounts have been written.
+    '''
+
+    def __init__( self, form, stream ) :
+
+        import json
+
+        self.form = form
+        self.stream = stream
+
+        self.encode = json.JSONEncoder().encode		# A single encoder (with the default settings that json.dumps() would use) for all records
+
+        self.separator = ''		# Written before each JSON record. Becomes ',\n' within a JSON array once the first record is written.
+
+        if form == 'csv' :
+
+            import csv
+
+            self.csv = csv.writer( stream, lineterminator = '\n' )
+
+            self.csv.writerow( csvColumns )
+
+        elif form == 'json' :
+
+            stream.write( '[\n' )
+
+
+    def writeAccount( self, out ) :
+
+        '''
+        Writes the records of the Output object 'out' of a single account (or folder).
+        '''
+
+        settings = out.settings
+
+        account = settings.get( 'account', settings[ 'name' ] )		# The name of the account itself even if it has several folders (see accountFolders() in miscClasses)
+        folder = settings[ 'folder' ]
+
+        if not isinstance( folder, basestring ) :		# The account failed as a whole (e.g. its server couldn't be reached) so its Output holds all of its folders
+
+            folder = ','.join( folder )
+
+        emails = [] if out.error else out.emails
+
+        values = ( 'account', account, folder, out.numAll, out.numUnseen, len( emails ), len( out.older ), out.error, out.reason )
+
+        if self.form == 'csv' :
+
+            self._writeRows( values, emails )
+
+        else :
+            self._writeJson( values, emails )
+
+        self.stream.flush()		# The account is passed on as soon as it has been polled, even when the output is piped
+
+
+    def close( self ) :
+
+        if self.form == 'json' :
+
+            self.stream.write( '\n]\n' )
+
+        self.stream.flush()
+
+
+    def _writeJson( self, values, emails ) :
+
+        encode = self.encode
+
+        line = '{' + ', '.join( [ encode( field ) + ': ' + encode( _text( value ) ) for field, value in zip( accountFields, values ) ] ) + '}'
+
+        if self.form == 'ndjson' :
+
+            separator, end = '', '\n'
+
+        else :
+            separator, end = ',\n', ''
+
+        self.stream.write( self.separator + line + end )
+
+        # The fields shared by all emails of the account are encoded once. Only the uid, flag, date, sender and subject of each email are encoded:
+
+        prefix = separator + '{"type": "email", "account": ' + encode( _text( values[1] ) ) + ', "folder": ' + encode( _text( values[2] ) ) + ', "uid": '
+
+        self.stream.writelines( prefix + str( email.uid ) + ', "seen": ' + ( email.Seen and 'true' or 'false' ) + ', "date": ' + encode( _text( email.Date ) ) + ', "timestamp": ' + encode( _text( email.Timestamp ) ) + ', "from": ' + encode( _text( email.From ) ) + ', "subject": ' + encode( _text( email.Subject ) ) + '}' + end for email in emails )
+
+        self.separator = separator
+
+
+    def _writeRows( self, values, emails ) :
+
+        account, folder = _utf8( values[1] ), _utf8( values[2] )
+
+        row = [ _utf8( _csvValue( value ) ) for value in values ]
+
+        self.csv.writerow( row + [ '' ] * ( len( csvColumns ) - len( row ) ) )
+
+        blank = [ '' ] * ( len( accountFields ) - 3 )		# The account columns of an email row
+
+        self.csv.writerows( [ 'email', account, folder ] + blank + [ email.uid, email.Seen and 1 or 0, _utf8( email.Date ), _utf8( email.Timestamp ), _utf8( email.From ), _utf8( email.Subject ) ] for email in emails )
+
+
+
+
+def _text( value ) :
+
+    '''
+    Returns 'value' with byte strings decoded (as UTF-8, replacing invalid bytes) so that it can always be encoded as JSON.
+    '''
+
+    if isinstance( value, str ) :
+
+        return value.decode( 'utf-8', 'replace' )
+
+    return value
+
+
+
+
+def _utf8( value ) :
+
+    '''
+    Returns 'value' with unicode strings encoded as UTF-8 (the csv module of python 2 only writes byte strings).
+    '''
+
+    if isinstance( value, unicode ) :
+
+        return value.encode( 'utf-8' )
+
+    return value
+
+
+
+
+def _csvValue( value ) :
+
+    if value is None :
+
+        return ''
+
+    if value is True or value is False :
+
+        return value and 1 or 0
+
+    return value
@@ -46,9 +46,6 @@ class urwidDisplay() :
             import sys
             sys.exit(1)
 
-        from miscClasses import threadedExec		# This function implements email account access using threads
-
-
         self.settings = settings		# Store the settings (mostly global for the program) locally in a dictionary
 
         self.servers = servers			# This wealth of information will come in handy when we will be deleting emails
@@ -94,6 +91,14 @@ class urwidDisplay() :
 
 
 
+        # The lines of the emails are built using the normal attributes above. These maps translate them to one of the other schemes (see styleLine()). The None key covers the parts of a line without an attribute of their own, giving the whole line the same background color.
+
+        names = [ 'bw', 'flag', 'date', 'from', 'subject', 'subjectSeen' ]
+
+        self.attrMaps = dict( ( pre, dict( [ ( name, pre + name ) for name in names ] + [ ( None, pre + 'bw' ) ] ) ) for pre in [ '', 'F_', 'D_', 'DF_' ] )
+
+
+
         self.title = urwid.AttrMap( urwid.Text( " FetchHeaders      q: Quit    a: Abort    d: Delete    u: UnDelete    j: Down    k: Up" ), 'title' )
 
         self.div = urwid.Divider()
@@ -105,85 +110,379 @@ class urwidDisplay() :
 
         self.focus = -1			# Initially no header has focus. This is donated by the value -1. 0 will donate the first header corresponding to self.emails[0].
 
+        self.total = 0			# Total no. of emails being displayed. Grows as the accounts finish polling.
 
-        self.List = []		# This is the list of objects that will be used to construct the main listbox that displays all email headers and auxiliary information.
 
-        # We will now extract header information from each account and use it to construct various objects. While doing so we must keep in mind that when focus shifts the objects must be re-drawn explicitly. This can be handled by constructing the lines every time it is required, using separate functions to handle the construction by simply passing them the same information
+        from headerWalker import headerWalker
 
+        self.List = headerWalker( self.constructLine, self.styleLine )		# This is the list of objects that will be used to construct the main listbox that displays all email headers and auxiliary information. It holds the Email objects themselves and only builds the lines of those that are actually displayed, so the number of emails doesn't affect the time taken to start up (see headerWalker).
 
-        for out in threadedExec( servers, self.settings[ 'maxThreads' ] ) :		# This calls the threaded processed to extract information and return it in an iterable queue
+        # The accounts are polled in a background thread while the urwid loop is already running. Until an account has been polled a "polling..." placeholder line is displayed for it at the bottom of the list. As each account completes its placeholder is removed and the account's section is inserted just above the remaining placeholders. That way the positions of the lines of accounts that have already been displayed never change.
 
-            if out.error:         # out.error is True if an Exception is raised while it is being calculated. In such a case we display an error line
+        self.placeholders = {}		# Placeholder line for each account that is still being polled
 
-                account = urwid.Text( ('account', ' ' + out.settings[ 'name' ] + ':' ) )
-                error = urwid.Text(('bw', 'Error!'))
-                accountLine = urwid.Columns( [('fixed', 13, account), error ])
+        self.paging = set()		# Names of the accounts whose next page of older emails is being fetched
 
-                self.List += [ accountLine ]
+        self.outputs = {}		# The Output object currently displayed for each account, keyed by name
+        self.sections = []		# Names of the accounts displayed in the order of their sections
 
-            else:
-                # Construct account line widget
+        for name in sorted( servers.keys() ) :
 
-                account = urwid.Text( ( 'account', ' ' + out.settings[ 'name' ] + ':' ) )
+            account = urwid.Text( ( 'account', ' ' + name + ':' ) )
+            polling = urwid.Text( ( 'bw', 'polling...' ) )
 
-                if out.settings[ 'showNums' ] :			# Numbers are supposed to displayed after the account name
+            self.placeholders[ name ] = urwid.Columns( [ ( 'fixed', 13, account ), polling ] )
 
-                    numbers = urwid.Text( ( 'bw', '( total: ' + str( out.numAll ) + ' | unseen: ' + str( out.numUnseen ) + ' )' ) )
+            self.List.append( self.placeholders[ name ] )
 
-                    accountLine = urwid.Columns( [ ( 'fixed', 13, account ), numbers ] )
 
-                else :			# Don't display numbers
+        self.listbox = urwid.ListBox( self.List )
 
-                    accountLine = urwid.Columns( [ ( 'fixed', 13, account ) ] )
+        self.frame = urwid.Frame( self.listbox, header = self.titlePile )		# By using a frame we ensure that the top title doesn't move when we scroll through the listbox
 
+        self.loop = urwid.MainLoop( self.frame, self.palette, unhandled_input = self.handler )
 
-                self.List += [ accountLine, self.div ]		# First line displays account name and number of messages
 
+        # Results are passed from the polling thread to the thread running the urwid loop using a queue. Writing to the pipe created by watch_pipe wakes up the urwid loop which then calls self.receive()
 
+        from Queue import Queue
+        import threading
 
-                # We now construct and display the email headers
+        self.results = Queue()
 
-                for ii in range( len( out.emails ) ) :
+        self.pipe = self.loop.watch_pipe( self.receive )
 
-                    email = out.emails[ ii ]
+        poller = threading.Thread( target = self.poll )
 
-                    email.account = out.settings[ 'name' ]		# Store name of account associated with each email
+        poller.daemon = True		# The program must be able to exit (e.g. on abort) while accounts are still being polled
 
-                    email.Delete = False		# Boolean Flag for tracking if email has to be deleted.
+        poller.start()
 
-                    email.serial = ii + 1		# Serial Number associated with this email
 
-                    email.numDigits = out.numDigits		# No. of digits for displaying serial number, calculated by analyzing the number of emails for this particular account
+        # Now we run the main loop:
 
-                    email.listPos = len( self.List )	# Store the position of the email header urwid object (urwid.Columns) in self.List. Will need it for focusing or deletion.
+        self.deleteErrors = []		# Messages describing the accounts whose emails could not be deleted when quitting. They are printed once urwid has restored the terminal.
 
-                    self.emails.append( email )		# Add the displayed email to the self.emails list
+        self.loop.run()
 
+        for message in self.deleteErrors :
 
-                    line = self.constructLine( email, focus = False )
+            print( message )
 
+        if settings.get( 'stats' ) :
 
-                    self.List.append( line )		# Call constructLine to create header line using data in 'email' object. ii + 1 is serial number
+            from pollStats import printStats
 
+            printStats( self.outputs.values(), settings[ 'stats' ] )
 
-            self.List += [ self.div, self.div ] 		# Add two empty lines after account ends
 
 
-        self.total = len( self.emails )		# Total no. of emails being displayed
 
+    def poll( self ) :
 
-        # All account information has been input and the urwid display is almost ready:
+        '''
+        This method is run in a background thread. It polls all the accounts and hands each Output object to the urwid loop as soon as the account completes.
 
-        self.listbox = urwid.ListBox( self.List )
+        In watch mode it never returns: an updated Output object is handed over whenever an account changes.
+        '''
 
-        self.frame = urwid.Frame( self.listbox, header = self.titlePile )		# By using a frame we ensure that the top title doesn't move when we scroll through the listbox
+        import os
 
-        self.loop = urwid.MainLoop( self.frame, self.palette, unhandled_input = self.handler )
+        from miscClasses import pollAccounts		# This function implements email account access using threads (or an asynchronous event loop)
+        from accountWatcher import watchAccounts
 
+        if self.settings.get( 'watch' ) :
 
-        # Now we run the main loop:
+            outputs = watchAccounts( self.servers, self.settings )
 
-        self.loop.run()
+        else :
+
+            outputs = pollAccounts( self.servers, self.settings )
+
+        for out in outputs :		# Output objects are yielded in the order in which the accounts complete
+
+            self.results.put( out )
+
+            os.write( self.pipe, 'x' )		# Wake up the urwid loop
+
+
+
+
+    def receive( self, data ) :
+
+        '''
+        This method is called by the urwid loop (in its own thread) when the polling thread writes to the pipe. It adds the sections of all accounts that have completed to the display.
+        '''
+
+        while not self.results.empty() :
+
+            result = self.results.get()
+
+            if isinstance( result, tuple ) :		# A page of older emails (see fetchPage())
+
+                self.addPage( *result )
+
+            else :
+
+                self.addAccount( result )
+
+
+
+
+    def addAccount( self, out ) :
+
+        '''
+        This method displays the information in the Output object 'out' of a single account in place of the account's placeholder line or, in watch mode, in place of the account's previous section.
+        '''
+
+        import time
+
+        name = out.settings[ 'name' ]
+
+        if name in self.outputs :		# Watch mode update of an account already displayed
+
+            self.outputs[ name ] = out
+
+            self.rebuild()
+
+            return
+
+        self.outputs[ name ] = out
+        self.sections.append( name )
+
+        placeholder = self.placeholders.pop( out.settings.get( 'account', name ), None )		# An account with several folders has a section for each (see miscClasses.accountFolders()) but a single placeholder, which is removed along with the first of them
+
+        if placeholder is not None :
+
+            self.List.remove( placeholder )		# The placeholder lies below the position at which the section is inserted
+
+        start = time.time()
+
+        self.insertSection( out )
+
+        if out.stats :
+
+            out.stats.add( 'render', time.time() - start )		# Only the lines on screen are actually built (see headerWalker), and only when the screen is next drawn
+
+
+
+
+    def fetchPage( self, name ) :
+
+        '''
+        Fetches the next page of older emails of the account 'name' in a background thread. The page is handed to addPage() (via receive()) once it arrives. Pages aren't fetched in watch mode since the next update of the account would discard them.
+        '''
+
+        import os, threading
+
+        from miscClasses import fetchPage
+
+        if name in self.paging or self.settings.get( 'watch' ) :
+
+            return
+
+        self.paging.add( name )
+
+        out = self.outputs[ name ]
+
+        size = out.settings.get( 'limit' ) or len( out.older )
+
+        uids = [ str( uid ) for uid in out.older[ -size : ] ]		# The newest of the older emails
+
+        def fetch() :
+
+            try :
+                emails = fetchPage( out.settings, uids )
+
+            except Exception :
+
+                emails = None
+
+            self.results.put( ( name, uids, emails ) )
+
+            os.write( self.pipe, 'x' )
+
+        thread = threading.Thread( target = fetch )
+        thread.daemon = True
+        thread.start()
+
+
+
+
+    def addPage( self, name, uids, emails ) :
+
+        '''
+        Adds a page of older emails (fetched by fetchPage()) to the display of the account 'name'. If the page couldn't be fetched nothing changes and it is fetched again the next time the oldest email is focused.
+        '''
+
+        from array import array
+
+        self.paging.discard( name )
+
+        out = self.outputs[ name ]
+
+        if emails is None :
+
+            return
+
+        latestFirst = out.settings[ 'latestEmailFirst' ]
+
+        emails.sort( key = lambda email : int( email.uid ), reverse = latestFirst )
+
+        if latestFirst :
+
+            out.emails.extend( emails )
+
+        else :
+
+            out.emails[ 0 : 0 ] = emails
+
+        out.older = array( 'I', out.older[ : -len( uids ) ] )
+        out.uids = array( 'I', [ int( email.uid ) for email in out.emails ] )
+
+        out.numDigits = max( out.numDigits, len( str( len( out.emails ) ) ) )
+
+        self.rebuild()
+
+
+
+
+    def rebuild( self ) :
+
+        '''
+        Reconstructs the contents of the listbox from the Output objects of all accounts (used when one of them changes in watch mode). The focus stays on the same email if it still exists. Emails flagged for deletion remain flagged.
+        '''
+
+        focused = None
+
+        if 0 <= self.focus < len( self.emails ) :
+
+            focused = self.emails[ self.focus ]
+
+
+        self.emails = []
+
+        self.List.replace( [ self.placeholders[ name ] for name in sorted( self.placeholders.keys() ) ] )
+
+        for name in self.sections :
+
+            self.insertSection( self.outputs[ name ] )
+
+
+        if focused and self.total :
+
+            for ii in range( self.total ) :
+
+                if self.emails[ ii ].account == focused.account and self.emails[ ii ].uid == focused.uid :
+
+                    self.focus = ii
+
+            self.focus = min( self.focus, self.total - 1 )		# If the focused email has gone the focus stays at (or near) its position
+
+            self.shiftFocus( None )
+
+        else :
+
+            self.focus = -1
+
+            self.List.highlight( None )
+
+
+
+
+    def insertSection( self, out ) :
+
+        '''
+        This method constructs the lines displaying the information in the Output object 'out' of a single account and inserts them in to the listbox just above the placeholders of accounts that are still being polled.
+        '''
+
+        import urwid
+
+
+        pos = len( self.List ) - len( self.placeholders )		# Position just above the placeholders of accounts that are still being polled
+
+
+        lines = []		# Lines of the section of this account
+
+        if out.error:         # out.error is True if an Exception is raised while it is being calculated. In such a case we display an error line
+
+            account = urwid.Text( ('account', ' ' + out.settings[ 'name' ] + ':' ) )
+            error = urwid.Text(('bw', 'Error!' + ( ' (' + out.reason + ')' if out.reason else '' ) ))
+            accountLine = urwid.Columns( [('fixed', 13, account), error ])
+
+            lines += [ accountLine ]
+
+        else:
+            # Construct account line widget
+
+            account = urwid.Text( ( 'account', ' ' + out.settings[ 'name' ] + ':' ) )
+
+            if out.settings[ 'showNums' ] :			# Numbers are supposed to displayed after the account name
+
+                numbers = urwid.Text( ( 'bw', '( total: ' + str( out.numAll ) + ' | unseen: ' + str( out.numUnseen ) + ' )' ) )
+
+                accountLine = urwid.Columns( [ ( 'fixed', 13, account ), numbers ] )
+
+            else :			# Don't display numbers
+
+                accountLine = urwid.Columns( [ ( 'fixed', 13, account ) ] )
+
+
+            lines += [ accountLine, self.div ]		# First line displays account name and number of messages
+
+
+            if out.older :		# The account's limit left out some older emails. They are shown at the end of the list nearest to them.
+
+                if self.settings.get( 'watch' ) :
+
+                    more = urwid.Text( ( 'bw', '... and ' + str( len( out.older ) ) + ' older emails' ) )
+
+                else :
+
+                    more = urwid.Text( ( 'bw', '... and ' + str( len( out.older ) ) + ' older emails (move past the last email to load them)' ) )
+
+                more = urwid.Padding( more, left = out.numDigits + 4 )
+
+            else :
+
+                more = None
+
+
+            if more and not out.settings[ 'latestEmailFirst' ] :
+
+                lines.append( more )
+
+
+
+            # We now construct and display the email headers
+
+            for ii in range( len( out.emails ) ) :
+
+                email = out.emails[ ii ]
+
+                email.account = out.settings[ 'name' ]		# Store name of account associated with each email
+
+                email.serial = ii + 1		# Serial Number associated with this email
+
+                email.numDigits = out.numDigits		# No. of digits for displaying serial number, calculated by analyzing the number of emails for this particular account
+
+                email.listPos = pos + len( lines )	# Store the position of the email header urwid object (urwid.Columns) in self.List. Will need it for focusing or deletion.
+
+                self.emails.append( email )		# Add the displayed email to the self.emails list
+
+                lines.append( email )		# The line of the email is only constructed (by the walker) when it is displayed
+
+
+        if not out.error and more and out.settings[ 'latestEmailFirst' ] :
+
+            lines.append( more )
+
+        lines += [ self.div, self.div ] 		# Add two empty lines after account ends
+
+
+        self.List.insert( pos, lines )		# Insert the section in to the listbox
+
+        self.total = len( self.emails )		# Total no. of emails being displayed
 
 
 
@@ -202,6 +501,11 @@ class urwidDisplay() :
             raise urwid.ExitMainLoop()
 
 
+        if not self.emails and not key in ( 'q', 'Q' ) :		# No headers are being displayed (yet) so there is nothing to navigate or flag for deletion
+
+            return
+
+
         if key in ( 'j', 'J' ) :		# This pushes focus down
 
             self.focus += 1
@@ -278,31 +582,17 @@ class urwidDisplay() :
 
             # Now we delete the specified emails by logging in to the various accounts in a threaded fashion:
 
-            from Queue import Queue
-
-            inQueue = Queue()
+            from miscClasses import runTasks, deleteEmails
 
+            tasks = [ { 'account': self.outputs[ name ].settings, 'listUIDs': delete[ name ] } for name in delete.keys() ]		# <DIC> containing account settings and UIDs of emails to be deleted. The settings of the section (rather than those of the account) specify the folder the emails are in.
 
-            # Populate Queue with task data
+            function = lambda data : deleteEmails( data[ 'account' ], data[ 'listUIDs' ] )
 
-            for name in delete.keys() :
+            for data, result, reason in runTasks( function, tasks, self.settings[ 'maxThreads' ], self.settings.get( 'pollTimeout' ) ) :		# Blocks until every account is done or has been abandoned, so that an unresponsive server can't prevent the program from quitting
 
-                inQueue.put( { 'account': self.servers[ name ], 'listUIDs': delete[ name ] } )		# Add <DIC> containing account settings and UIDs of emails to be deleted.
+                if reason :
 
-
-            # Create a number of threads to parallelize the task:
-
-            from miscClasses import delWorker
-
-            workers = [ delWorker( inQueue ) for ii in range( self.settings[ 'maxThreads' ] ) ]
-
-
-            for worker in workers :
-
-                worker.start()		# Begin execution of each thread
-
-
-            inQueue.join()		# Pause program execution here until all tasks in inQueue are complete
+                    self.deleteErrors.append( 'Unable to delete emails from account ' + data[ 'account' ][ 'name' ] + ': ' + reason )
 
 
         raise urwid.ExitMainLoop()
@@ -323,20 +613,18 @@ class urwidDisplay() :
         if self.focus >= self.total :  self.focus = 0			# Move around the circle and set focus to first email.
 
 
-        # First we unfocus the previously focussed email, if there is one.
+        # First we unfocus the previously focussed email, if there is one. Its line is restyled since it may just have been flagged (or unflagged) for deletion.
 
-        if oldFocus != None :		# If 'None' has been passed in the focus hasn't changed position, for instance if the email is to be marked for deletion.
+        if oldFocus != None :		# If 'None' has been passed in the focus hasn't changed position
 
-            email = self.emails[ oldFocus ]
-
-            self.List[ email.listPos ] = self.constructLine( email, focus = False )
+            self.List.invalidate( self.emails[ oldFocus ].listPos )
 
 
         # Now implement change in focus.
 
         email = self.emails[ self.focus ]		# We select the email object associated with the new focus
 
-        self.List[ email.listPos ] = self.constructLine( email, focus = True )
+        self.List.highlight( email )
 
 
         # Finally change listbox focus so that the listbox scrolls properly with our scrolling:
@@ -344,6 +632,15 @@ class urwidDisplay() :
         self.listbox.set_focus( email.listPos )
 
 
+        # If this is the oldest email displayed for an account that has more, the next page of older emails is fetched.
+
+        out = self.outputs[ email.account ]
+
+        if out.older and email is out.emails[ -1 if out.settings[ 'latestEmailFirst' ] else 0 ] :
+
+            self.fetchPage( email.account )
+
+
 
 
 
@@ -352,6 +649,8 @@ class urwidDisplay() :
         '''
         This function takes the 'email' object and a single flag and uses them to construct a urwid.Column object representing the correctly formatted header line for the display. This is stored in the listbox for displaying.
 
+        The line is built (and its fields truncated and padded) once only. Its widgets carry the normal attributes of the palette and the whole line is wrapped in an AttrMap. A change in focus or in the deletion flag is displayed by styleLine(), which merely swaps the attribute map and, if flags are shown, the text of the flag.
+
         serialNum: An integer specifying the serial number associated with the email in the list of emails when it is displayed.
 
         numDigits: Number of digits for displaying the serial number. An account level value that has already been calculated.
@@ -368,54 +667,77 @@ class urwidDisplay() :
         import urwid
         from miscClasses import strWidth as sW
 
-        if focus : pre = 'F_'		# This string determines which color from the palette is used: normal of focus scheme, flagged for deletion or not.
+        date = urwid.Text( ( 'date', sW( email.Date, 17 ) ) )
+        From = urwid.Text( ( 'from', sW( email.From, 30 ) ) )
+        serial = urwid.Text( ( 'bw', sW( str( email.serial ), email.numDigits, align = '>' ) ) )
 
-        else : pre = ''
 
-        if email.Delete :
+        if not email.Seen :		# If email is unseen then:
 
-            if focus: pre = 'DF_'		# Email is both flagged for deletion and in focus
+            subject = urwid.Text( ( 'subject', sW( email.Subject, 120 ) ) )
 
-            else : pre = 'D_'		# Email is flagged for deletion
+        else:
 
+            subject = urwid.Text( ( 'subjectSeen', sW( email.Subject, 120 ) ) )
 
-        date = urwid.Text( ( pre + 'date', sW( email.Date, 17 ) ) )
-        From = urwid.Text( ( pre + 'from', sW( email.From, 30 ) ) )
-        serial = urwid.Text( ( pre + 'bw', sW( str( email.serial ), email.numDigits, align = '>' ) ) )
 
+        flag = None
 
-        if not email.Seen :		# If email is unseen then:
+        if self.settings[ 'showFlags' ] :		# Flags are to be displayed
 
-            subject = urwid.Text( ( pre + 'subject', sW( email.Subject, 120 ) ) )
+            flag = urwid.Text( ( 'flag', '' ) )		# The text is set by styleLine() since it depends on the deletion flag
 
-        else:
+            sep = [ ('fixed', 2, urwid.Text(( 'bw', " [" ))), ('fixed', 3, flag), ('fixed', 4, urwid.Text(( 'bw', "]   " ))) ]
 
-            subject = urwid.Text( ( pre + 'subjectSeen', sW( email.Subject, 120 ) ) )
+        else :
+            sep = [ ( 'fixed', 3, urwid.Text(( 'bw', ".  " )) ) ]
 
 
-        if self.settings[ 'showFlags' ] :		# Flags are to be displayed
+        lineList = [ ('fixed', email.numDigits, serial) ] + sep + [ ('fixed', 21, date ), ('fixed', 34, From), subject ]
 
-            if email.Seen :
 
-                if email.Delete : ch = " D "
+        line = urwid.AttrMap( urwid.Columns( lineList ), 'bw' )		# Applying the AttrMap here ensures the whole line gets the same background color
 
-                else : ch = "   "
+        line.flag = flag		# Kept so that styleLine() can change the text of the flag
 
-            else :
-                if email.Delete : ch = " ND"
+        self.styleLine( line, email, focus )
 
-                else : ch = " N "
+        return line		# Return the constructed line
 
 
-            sep = [ ('fixed', 2, urwid.Text(( pre + 'bw', " [" ))), ('fixed', 3, urwid.Text(( pre + 'flag', ch ))), ('fixed', 4, urwid.Text(( pre + 'bw', "]   " ))) ]
 
-        else :
-            sep = [ ( 'fixed', 3, urwid.Text(( pre + 'bw', ".  " )) ) ]
 
+    def styleLine( self, line, email, focus = False ) :
 
-        lineList = [ ('fixed', email.numDigits, serial) ] + sep + [ ('fixed', 21, date ), ('fixed', 34, From), subject ]
+        '''
+        Displays the focus and deletion state of 'email' on its (already constructed) 'line' by choosing the matching color scheme of the palette. Nothing is rebuilt: the attribute map of the line is swapped for one of four prepared maps.
+        '''
+
+        if focus : pre = 'F_'		# This string determines which color from the palette is used: normal of focus scheme, flagged for deletion or not.
 
+        else : pre = ''
 
-        line = urwid.AttrMap( urwid.Columns( lineList ), pre + 'bw' )		# Applying the AttrMap here ensures the whole line gets the same background color
+        if email.Delete :
 
-        return line		# Return the constructed line
+            if focus: pre = 'DF_'		# Email is both flagged for deletion and in focus
+
+            else : pre = 'D_'		# Email is flagged for deletion
+
+
+        line.set_attr_map( self.attrMaps[ pre ] )
+
+
+        if line.flag :
+
+            if email.Seen :
+
+                if email.Delete : ch = " D "
+
+                else : ch = "   "
+
+            else :
+                if email.Delete : ch = " ND"
+
+                else : ch = " N "
+
+            line.flag.set_text( ( 'flag', ch ) )